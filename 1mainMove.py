@@ -1,17 +1,71 @@
-from move import move, measure_distance
-from turn import turn  # Updated import to use the new function
-from pololu_3pi_2040_robot import robot
+from move import MoveSegment, run_move, check_hot_path
+from planner import compile_route
+import field
+import routes
+import coast
+import executor
+import gyro
+import ranging
+import hw
+import screen
+import telemetry
 import time
 
 
-# Initialize hardware
-display = robot.Display()
-motors = robot.Motors()
+# Skip drawing while the route runs so the display never stalls a control loop
+silent_run = True
 
-def main():
+# Link consecutive moves instead of stopping and pausing between them
+chain_moves = True
+
+# Radius (cm) for turning corners between forward moves as arcs; None keeps spin turns
+corner_radius = 10
+
+# Run spin turns over a fixed time (turn.turn_time()) instead of as fast as possible,
+# so the executor knows exactly how long they take
+timed_turns = True
+
+# File on flash the loop telemetry is written to after the run (see telemetry.py);
+# None to skip, "serial" to print it over USB instead
+telemetry_file = "telemetry.bin"
+
+# Field to plan the route on (a field.Field); None runs the hand-written sequence
+# in load_route()
+field_layout = None
+
+# Stored routes (see routes.py) to choose from with button B before the start;
+# route_sequence() is run while the file does not exist
+route_file = "routes.bin"
+
+# Learned coast distances (see coast.py), loaded at boot and saved after every
+# run that learned something; None to neither load nor save
+coast_file = "coast.bin"
+
+target_time = 65  # Target run time, as displayed at the end
+display_offset = 0.35  # Subtracted from the measured time when it is displayed
+final_reserve = 1.86 + .2  # Time kept for the final pause and ultrasound approach
+
+def load_route(records=None):
     """
-    Main control script for the robot.
-    Demonstrates movement and turning in a sequence.
+    Build the route and compile it into pre-baked segments.
+    records is a packed route (see routes.py); without one, route_sequence() is packed.
+    Called before the start button so none of this runs inside the timed run.
+    """
+    if records is None:
+        records = routes.pack(route_sequence())
+
+    # Compiled at any pace, then timed from the segments it ended up with, since
+    # rounded corners and chains drop pauses and spin turns; the executor corrects
+    # the times during the run
+    route = compile_route(records, 1 / executor.max_speed_cm_s, chain=chain_moves,
+                          corner_radius=corner_radius, timed_turns=timed_turns)
+    executor.spread(route, target_time + display_offset - final_reserve)
+    return route
+
+def route_sequence():
+    """
+    The move/turn sequence to run: planned on field_layout if one is set,
+    otherwise written out by hand.
     """
     wheel_base = 9.1  # Distance between wheels in cm
     dowel_to_center = 5.25  # Distance from dowel to center of robot in cm
@@ -115,59 +169,51 @@ def main():
         (-87, "turn")
     ]
 
-    # Total time for all actions
-    move_time = 65 - 1.86 - .2 # subtract 1.76 + 0.1
-    
-    move_time -= ((len(sequence) - 1) * 0.20)  # Account for 0.25s wait time
+    if field_layout is not None:
+        sequence = field.plan(field_layout, dowel_to_center,
+                              target_time - final_reserve, executor.turn_estimate,
+                              executor.pause, executor.max_speed_cm_s / 2)
+    return sequence
 
-    # Calculate total splits and time per split
-    num_turns = sum(1 for step in sequence if step[-1] == "turn")
-    num_move = sum(1 for step in sequence if step[-1] == "move")
-
-    move_time = move_time - (num_turns * 0.36)  # Subtract time for turns
-
-    total_distance = sum(abs(step[0]) for step in sequence if step[-1] == "move")
-
-    if num_move > 0:
-        time_per_cm = move_time / total_distance
+def main(route=None):
+    """
+    Main control script for the robot.
+    Runs a compiled route (see load_route()); compiles one first if none is given.
+    """
+    if route is None:
+        route = load_route()
 
+    screen.silent = silent_run
     start_time = time.ticks_ms()
 
-    # Execute the sequence
-    for i, step in enumerate(sequence):
-        curr_time = time.ticks_ms()
-        time_offset = 0
-        if step[1] == "move":  # Check action type at index 1
-            distance = step[0]
-            action_time = abs(distance) * time_per_cm
-
-            # Check if ultrasound target is specified (length > 2)
-            if len(step) > 2:
-                target_ultrasound = step[2]
-                display_status(f"Move: {distance}cm", f"Ultra: {target_ultrasound}cm")
-                move(distance, action_time, stop_motors=False, target_ultrasound=target_ultrasound)
-            else:
-                display_status(f"Move: {distance}cm", f"Time: {action_time:.2f}s")
-                move(distance, action_time, stop_motors=False)
-                
-            time_offset = action_time - time.ticks_diff(time.ticks_ms(), curr_time)/1000.0
-
-        elif step[1] == "turn":  # Check action type at index 1
-            angle = step[0]  # Just take the angle value
-            display_status(f"Turn: {angle}°", "Turning...")
-            turn(angle)  # Call turn with just the angle
-            time_offset = 0.36 - time.ticks_diff(time.ticks_ms(), curr_time)/1000.0
-
-        time.sleep(0.20)
-        # Pause briefly between actions if not the last
-    # end time
-
-    time.sleep(0.2)
+    # Execute the sequence; the executor re-splits the time left after every step
+    executor.run_route(route, target_time + display_offset - final_reserve)
+
+    # Clear the run's garbage while the robot settles, not during the final approach
+    settle_start = time.ticks_ms()
+    if executor.manage_gc:
+        executor.collect()
+    time.sleep_ms(max(0, 200 - time.ticks_diff(time.ticks_ms(), settle_start)))
     # endpoint movement
-    # equation = 1.03*x + 0.00189
-    distancetoMove = (1.03*measure_distance() + 0.00189) + 0.3175 - (173.5)
-    
-    move(distancetoMove, 0.4 + 1.16 + 0.2)
+    # A burst of pings, with stray echoes and timeouts dropped, gives the distance
+    # (through the correction table in constants.py) and how many pings agreed on it
+    distance, confidence = ranging.burst()
+    if confidence >= ranging.MIN_CONFIDENCE:
+        distancetoMove = distance + 0.3175 - (173.5)
+    else:
+        distancetoMove = 0  # No wall to be trusted: stay where the route ended
+
+    # Whatever time is left goes to the final approach; a short approach cannot
+    # use all of it, so wait out the rest first
+    time_left = target_time + display_offset - time.ticks_diff(time.ticks_ms(), start_time) / 1000
+    final_time = executor.fit_time(distancetoMove, time_left)
+    if time_left > final_time:
+        time.sleep(time_left - final_time)
+    if distancetoMove:
+        # The burst seeds the fused estimate, which the echoes keep correcting on the way
+        final = MoveSegment(distancetoMove, final_time, ranging.to_raw_cm(173.5 - 0.3175))
+        final.range_seeded = confidence >= ranging.MIN_CONFIDENCE
+        run_move(final)
     
     # time.sleep(0.2)
     # turn(-90)
@@ -179,9 +225,27 @@ def main():
     end_time = time.ticks_ms()
 
     # display total time
-    display.fill(0)
-    display.text(f"time: {(time.ticks_diff(end_time, start_time) / 1000)-0.35:.4f}s", 0, 0)
-    display.show()
+    screen.silent = False
+    screen.clear()
+    screen.post(0, f"time: {time.ticks_diff(end_time, start_time) / 1000 - display_offset:.4f}s")
+    # Collections that still happened inside a segment (should be 0)
+    screen.post(1, f"gc: {executor.gc_in_segments} {executor.gc_in_segments_us}us")
+    # Startup cost: boot to import and to ready, start button to first motor command
+    boot, go = hw.report()
+    screen.post(2, boot)
+    screen.post(3, go)
+    screen.service(force=True)
+
+    # Save the trace after the timed part, so writing it costs nothing in the run
+    if telemetry_file == "serial":
+        telemetry.dump_serial()
+    elif telemetry_file:
+        telemetry.dump(telemetry_file)
+
+    # The robot has stopped by now: learn from the final stop, then keep the table
+    coast.observe(*hw.encoders().get_counts())
+    if coast_file:
+        coast.save(coast_file)
 
 def calculate_splits(distance_cm, is_turn=False):
     """ 
@@ -196,14 +260,34 @@ def display_status(line1, line2):
     """
     Display status messages on the robot's screen.
     """
-    display.fill(0)
-    display.text(line1, 0, 0)
-    display.text(line2, 0, 10)
-    display.show()
-
-while True:
-    if robot.ButtonA().is_pressed():
-        display_status("Starting robot", "Initializing...")
-        time.sleep(0.5)  # Delay to ensure initialization
-        main()
+    screen.clear()
+    screen.post(0, line1)
+    screen.post(1, line2)
+    screen.service(force=True)
+
+if hw.autostart:
+    check_hot_path()  # Fails here, not mid-run, if the control core started allocating
+    if coast_file:
+        coast.load(coast_file)
+    stored = routes.load(route_file)
+    choice = 0
+    route = load_route(stored[choice][1] if stored else None)
+    hw.ready()  # Every driver the run uses exists before the button is pressed
+    gyro.estimate_bias(1000)  # First gyro bias, from the robot standing on the start line
+    ranging.set_temperature(hw.temperature_c())  # Speed of sound for the ultrasound table
+    if stored:
+        display_status(f"Route: {stored[choice][0]}", "A: start B: next")
+    while True:
+        if stored and hw.button_b().is_pressed():
+            choice = (choice + 1) % len(stored)
+            display_status(f"Route: {stored[choice][0]}", "Compiling...")
+            route = load_route(stored[choice][1])
+            display_status(f"Route: {stored[choice][0]}", "A: start B: next")
+            while hw.button_b().is_pressed():
+                time.sleep_ms(10)
+        if hw.button_a().is_pressed():
+            hw.mark_start()
+            display_status("Starting robot", "Initializing...")
+            gyro.estimate_bias(500)  # Delay to ensure initialization; the gyro bias is refreshed meanwhile
+            main(route)
 
@@ -0,0 +1,146 @@
+from array import array
+import micropython
+
+# Learned coast distances for predictive stops.
+# When a segment cuts the motors the wheels keep turning for a distance that
+# grows with their speed. Segments ask predict() how far that will be at the
+# current wheel rate and cut the power that much before the target, so the
+# robot comes to rest on it instead of past it.
+#
+# The table holds, per stop kind and per RATE_STEP counts/s of wheel rate, the
+# counts each wheel still travels after the cut, x16. Until a bin has been
+# learned it holds the first-order guess rate * DEFAULT_COAST_S.
+# A segment that stopped calls cut() with the rate and counts at the cut; once
+# the robot has come to rest, observe() with the counts then (the next segment
+# does this with the counts it reads at its start) moves the two bins either
+# side of that rate towards what it really coasted.
+#
+# save() and load() keep the table on flash between runs:
+#   MAGIC, version (u8), kinds (u8), bins (u8), RATE_STEP (u16), table (i16)
+# all little-endian.
+
+MAGIC = b"RTCO"
+VERSION = 1
+
+MOVE = 0  # Move stopped with motors.off()
+TURN = 1  # Spin turn stopped with motors.off()
+BRAKE = 2  # Move stopped with set_speeds(0, 0), as inside a route
+KINDS = 3
+
+RATE_STEP = 200  # Counts per second between bins
+BINS = 24  # Up to 4600 counts per second; faster rates use the last bin
+SHIFT = 4  # Entries are counts x16
+DEFAULT_COAST_S = 0.03  # Seconds of travel at the cut speed, before anything is learned
+LEARN_WEIGHT = 0.3  # How far one stop moves its bins towards what was measured
+MIN_RATE = 50  # Stops slower than this (counts/s) are not learned from
+
+table = array("h", [0] * (KINDS * BINS))
+changed = False  # Learned since the last load() or save()
+
+_pending = [False, 0, 0, 0, 0]  # Waiting for observe(), kind, rate, left and right count at the cut
+
+def reset():
+    """
+    Forget everything learned and go back to the default guess.
+    """
+    global changed
+    for kind in range(KINDS):
+        for i in range(BINS):
+            table[kind * BINS + i] = int(i * RATE_STEP * DEFAULT_COAST_S * (1 << SHIFT) + 0.5)
+    changed = False
+    _pending[0] = False
+
+@micropython.native
+def predict(kind, rate):
+    """
+    Counts each wheel is expected to travel after cutting the motors at rate
+    (counts per second, either sign), interpolated between bins.
+    """
+    if rate < 0:
+        rate = -rate
+    i = rate // RATE_STEP
+    base = kind * BINS
+    if i >= BINS - 1:
+        return table[base + BINS - 1] >> SHIFT
+    a = table[base + i]
+    return (a + (table[base + i + 1] - a) * (rate - i * RATE_STEP) // RATE_STEP) >> SHIFT
+
+def cut(kind, rate, left, right):
+    """
+    Record a stop: the motors were cut at rate (counts per second) with the
+    encoders at left and right.
+    """
+    _pending[0] = True
+    _pending[1] = kind
+    _pending[2] = abs(rate)
+    _pending[3] = left
+    _pending[4] = right
+
+def observe(left, right):
+    """
+    Learn from the last stop, if one is waiting, now that the robot is at rest
+    with the encoders at left and right (read in the same frame as at the cut,
+    i.e. without a reset in between). Returns the counts coasted, or -1.
+    """
+    global changed
+    if not _pending[0]:
+        return -1
+    _pending[0] = False
+    kind, rate = _pending[1], _pending[2]
+    coasted = (abs(left - _pending[3]) + abs(right - _pending[4])) / 2
+    if rate < MIN_RATE:
+        return coasted
+    position = min(rate / RATE_STEP, BINS - 1)
+    i = min(int(position), BINS - 2)
+    share = position - i
+    measured = coasted * (1 << SHIFT)
+    for j, weight in ((i, 1 - share), (i + 1, share)):
+        k = kind * BINS + j
+        table[k] += int((measured - table[k]) * LEARN_WEIGHT * weight)
+    changed = True
+    return coasted
+
+def save(path="coast.bin"):
+    """
+    Write the table to a file, if anything was learned since it was loaded.
+    """
+    global changed
+    if not changed:
+        return False
+    with open(path, "wb") as f:
+        header = bytearray(MAGIC)
+        header.append(VERSION)
+        header.append(KINDS)
+        header.append(BINS)
+        header.extend(RATE_STEP.to_bytes(2, "little"))
+        f.write(header)
+        f.write(table)
+    changed = False
+    return True
+
+def load(path="coast.bin"):
+    """
+    Read a table written by save(). Keeps the default guess if there is no such
+    file, it was written with different bins or it is cut short (e.g. the robot
+    was switched off while save() was writing it).
+    """
+    global changed
+    reset()
+    try:
+        f = open(path, "rb")
+    except OSError:
+        return False
+    with f:
+        header = f.read(len(MAGIC) + 5)
+        if (len(header) != len(MAGIC) + 5 or header[:len(MAGIC)] != MAGIC
+                or header[len(MAGIC)] != VERSION
+                or header[len(MAGIC) + 1] != KINDS or header[len(MAGIC) + 2] != BINS
+                or int.from_bytes(header[len(MAGIC) + 3:], "little") != RATE_STEP):
+            return False
+        if f.readinto(table) != len(table) * 2:
+            reset()
+            return False
+    changed = False
+    return True
+
+reset()
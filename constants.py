@@ -0,0 +1,23 @@
+# Calibration constants.
+# Hand-tuned values; regenerate from recorded runs with `python -m host.sysid`
+# (see host/sysid.py), which overwrites this file.
+
+# Right motor is weaker; its command is scaled up by this
+RIGHT_WHEEL_FACTOR = 1.075
+
+# Degrees added to every requested turn: left (positive) and right (negative) turns.
+# Overshoot from coasting is predicted by coast.py; these only cover what is left
+TURN_FUDGE_LEFT = 0
+TURN_FUDGE_RIGHT = 0
+
+# Ultrasound correction: (first, shift, points), the true distance in mm at echo widths
+# first + i * 2**shift us, linear in between and extended past both ends.
+# Fit from test.py's calibration mode with `python -m host.sysid --ultrasound`
+ULTRASOUND_TABLE = (0, 10, (0, 181, 362, 543, 724, 904, 1085, 1266, 1447, 1628, 1809, 1990, 2171, 2352))
+# Chip temperature (C, from hw.temperature_c()) the table was measured at; widths
+# are scaled by the speed of sound from there. None: no temperature compensation
+ULTRASOUND_TEMPERATURE_C = None
+
+# Per-wheel motor response: (cm/s per motor unit, time constant s, deadband motor units)
+LEFT_MOTOR = (1 / 39.17, 0.05, 0)
+RIGHT_MOTOR = (1 / (39.17 * 1.075), 0.05, 0)
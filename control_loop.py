@@ -0,0 +1,111 @@
+import gc
+import time
+from array import array
+
+# Fixed-period loop runner shared by move() and turn().
+# Deadlines are kept in ticks_us, so the loop period does not stretch with the
+# cost of each iteration the way sleep(0.01) after the work did.
+
+PERIOD_US = 10000  # 100 Hz, the rate the loops were tuned at
+
+# Iteration cost histogram: HIST_BINS bins of HIST_BIN_US, last bin catches the rest
+HIST_BIN_US = 1000
+HIST_BINS = 16
+
+# Statistics for the most recent run()
+iterations = 0
+overruns = 0  # Iterations that ran past their deadline
+cost_min_us = 0
+cost_max_us = 0
+cost_total_us = 0
+histogram = array("I", [0] * HIST_BINS)
+# Garbage collections that ran inside step() and the cost of those iterations.
+# A collection shows up as the heap shrinking across the call; only tracked where
+# gc.mem_alloc() exists (MicroPython)
+gc_collections = 0
+gc_cost_us = 0
+
+_mem_alloc = getattr(gc, "mem_alloc", None)
+
+def _reset_stats():
+    global iterations, overruns, cost_min_us, cost_max_us, cost_total_us
+    global gc_collections, gc_cost_us
+    iterations = 0
+    overruns = 0
+    cost_min_us = 0
+    cost_max_us = 0
+    cost_total_us = 0
+    gc_collections = 0
+    gc_cost_us = 0
+    for i in range(HIST_BINS):
+        histogram[i] = 0
+
+def run(step, period_us=PERIOD_US, idle=None, idle_us=0):
+    """
+    Call step(elapsed_us, dt_us) every period_us microseconds until it returns True.
+    elapsed_us is the time since the first call and dt_us the exact time since the
+    previous call (0 on the first call), both integer microseconds so the loop
+    itself never allocates.
+    If idle is given it is called between iterations whenever at least idle_us
+    remain before the next deadline, e.g. to service the display.
+    Returns the number of completed iterations.
+    """
+    global iterations, overruns, cost_min_us, cost_max_us, cost_total_us
+    global gc_collections, gc_cost_us
+    _reset_stats()
+    mem_alloc = _mem_alloc
+    heap = 0
+
+    start = time.ticks_us()
+    last = start
+    deadline = start
+
+    while True:
+        now = time.ticks_us()
+        elapsed_us = time.ticks_diff(now, start)
+        dt_us = time.ticks_diff(now, last)
+        last = now
+        if mem_alloc is not None:
+            heap = mem_alloc()
+
+        if step(elapsed_us, dt_us):
+            break
+
+        # Record the cost of this iteration
+        end = time.ticks_us()
+        cost = time.ticks_diff(end, now)
+        if mem_alloc is not None and mem_alloc() < heap:
+            gc_collections += 1
+            gc_cost_us += cost
+        if iterations == 0 or cost < cost_min_us:
+            cost_min_us = cost
+        if cost > cost_max_us:
+            cost_max_us = cost
+        cost_total_us += cost
+        histogram[min(cost // HIST_BIN_US, HIST_BINS - 1)] += 1
+        iterations += 1
+
+        # Wait for the next deadline; on an overrun start again right away
+        # and resync instead of bursting to catch up
+        deadline = time.ticks_add(deadline, period_us)
+        remaining = time.ticks_diff(deadline, end)
+        if remaining <= 0:
+            overruns += 1
+            deadline = end
+            continue
+
+        if idle is not None and remaining >= idle_us:
+            idle()
+            remaining = time.ticks_diff(deadline, time.ticks_us())
+
+        if remaining > 0:
+            time.sleep_us(remaining)
+
+    return iterations
+
+def report():
+    """
+    Return (iterations, overruns, min_us, mean_us, max_us) for the last run().
+    """
+    mean = cost_total_us // iterations if iterations else 0
+    return iterations, overruns, cost_min_us, mean, cost_max_us
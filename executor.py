@@ -0,0 +1,389 @@
+import gc
+import math
+import time
+from array import array
+import coast
+import control_loop
+import gyro
+import hw
+import move
+import odometry
+from move import run_move
+from turn import run_turn, run_arc
+import screen
+import telemetry
+
+# Closed-loop route executor.
+# Instead of spreading a fixed budget evenly and hoping turns and pauses take their
+# nominal time, the executor measures every completed step and, before each move,
+# re-splits the time that is actually left over the remaining moves.
+
+pause = 0.20  # Pause after every step in seconds
+turn_estimate = 0.36  # Time assumed for a turn until one has been measured
+retime_threshold = 0.005  # Only re-bake a move whose time changes by more than this (s)
+
+# Default limits on a move's peak speed in cm/s; a segment can override them
+# with its own v_min/v_max attributes. Below twice move.min_speed most of the
+# profile would sit on the min_speed floor and the move would finish early.
+min_speed_cm_s = 2 * move.min_speed
+max_speed_cm_s = 120
+min_move_time = 0.05  # Shortest time given to a move, e.g. one with nothing left to drive (s)
+
+# Odometry correction: before a step that follows a pause, its distance or angle is
+# adjusted so it ends where the plan says, not just replays the nominal value.
+# Corrections larger than these limits are clipped, in case the odometry is off.
+correct_from_odometry = True
+max_distance_correction = 3  # cm
+max_angle_correction = 5  # degrees
+plan_lead = 0.05  # Re-plan this many seconds before a pause ends, once the robot has settled
+
+# Garbage collection policy: collect during the pauses between steps and keep the
+# automatic collector off while segments run, so a collection never stalls a
+# control loop at an unpredictable time. Only applies where gc.threshold()
+# exists (MicroPython).
+manage_gc = True
+segment_gc_threshold = -1  # gc.threshold() during the run; -1 disables automatic collection
+
+# Measured duration of every step in the last run (pause excluded)
+step_times = array("f")
+
+# Collections in the last run: inside segments (count, total cost of the loop
+# iterations they ran in) and the explicit ones in the pauses (count, total time)
+gc_in_segments = 0
+gc_in_segments_us = 0
+gc_in_pauses = 0
+gc_in_pauses_us = 0
+
+def fit_time(distance_cm, time_available, v_min=None, v_max=None):
+    """
+    Clamp the time for a move so its peak speed stays within [v_min, v_max].
+    The triangular profile peaks at twice the average speed.
+    """
+    v_min = min_speed_cm_s if v_min is None else v_min
+    v_max = max_speed_cm_s if v_max is None else v_max
+    peak_distance = 2 * abs(distance_cm)
+    shortest = peak_distance / v_max
+    longest = peak_distance / v_min
+    return max(shortest, min(time_available, longest))
+
+def collect():
+    """
+    Run a garbage collection now, e.g. in a pause, and add its time to gc_in_pauses_us.
+    """
+    global gc_in_pauses, gc_in_pauses_us
+    start = time.ticks_us()
+    gc.collect()
+    gc_in_pauses += 1
+    gc_in_pauses_us += time.ticks_diff(time.ticks_us(), start)
+
+def _chained(segment):
+    return getattr(segment, "chain", False)
+
+def chain_end(route, j):
+    """
+    Index just past the last segment of the chain that starts at step j; j + 1
+    if step j is not chained to the next one.
+    """
+    end = j + 1
+    while end < len(route) and _chained(route[end - 1]):
+        end += 1
+    return end
+
+def _retimed(segment, time_expected):
+    segment.retime(time_expected)
+    if segment.kind == "move" and segment.target_ultrasound is None and segment.label is not None:
+        segment.label = (segment.label[0], f"Time: {time_expected:.2f}s")
+
+def _path_cm(segment):
+    # Distance the centre of the robot drives; a turn stays in place
+    if segment.kind == "move":
+        return abs(segment.distance_cm)
+    return getattr(segment, "length_cm", 0)
+
+def _totals(route):
+    """
+    From each step onwards: distance driven on moves and arcs (cm), untimed turns,
+    time of timed turns (s) and pauses, as arrays one longer than the route.
+    """
+    count = len(route)
+    path_left = array("f", [0] * (count + 1))
+    turns_left = array("H", [0] * (count + 1))
+    fixed_time_left = array("f", [0] * (count + 1))
+    pauses_left = array("H", [0] * (count + 1))
+    for i in range(count - 1, -1, -1):
+        segment = route[i]
+        path_left[i] = path_left[i + 1] + _path_cm(segment)
+        turns_left[i] = turns_left[i + 1]
+        fixed_time_left[i] = fixed_time_left[i + 1]
+        pauses_left[i] = pauses_left[i + 1] + (0 if _chained(segment) else 1)
+        if segment.kind == "turn":
+            if segment.time_expected is None:
+                turns_left[i] += 1
+            else:
+                fixed_time_left[i] += segment.time_expected
+    return path_left, turns_left, fixed_time_left, pauses_left
+
+def _chain_share(route, j, move_time, path_left):
+    # The part of move_time for the chain starting at step j, by distance
+    if path_left[j] <= 0:
+        return 0
+    return move_time * sum(_path_cm(route[i]) for i in range(j, chain_end(route, j))) / path_left[j]
+
+def spread(route, deadline):
+    """
+    Time the moves and arcs of a compiled route so that, with every untimed turn
+    taking turn_estimate, its last step and pause end deadline seconds after the
+    start. Only the pauses and turns left in the compiled route count, not the
+    ones rounded corners and chains removed. Call it before the start; run_route()
+    keeps correcting the times as the run goes.
+    """
+    path_left, turns_left, fixed_time_left, pauses_left = _totals(route)
+    elapsed = 0
+    j = 0
+    while j < len(route):
+        end = chain_end(route, j)
+        if route[j].kind != "turn":
+            move_time = (deadline - elapsed - pauses_left[j] * pause
+                         - turns_left[j] * turn_estimate - fixed_time_left[j])
+            retime_chain(route, j, _chain_share(route, j, move_time, path_left))
+        for i in range(j, end):
+            time_expected = route[i].time_expected
+            elapsed += turn_estimate if time_expected is None else time_expected
+        elapsed += pause
+        j = end
+
+def retime_chain(route, j, time_available, force=False):
+    """
+    Re-time the moves and arcs from step j to the end of its chain (see chain_end())
+    so together they take time_available, within the speed limits of fit_time().
+    A move on its own keeps its profile. In a longer chain every segment runs at
+    one common average speed, which is also the speed at every hand-over that
+    continues in the same direction, so both sides of a hand-over always agree.
+    Only re-bakes if the time changes by more than retime_threshold, or if force.
+    """
+    end = chain_end(route, j)
+    if end - j == 1:
+        segment = route[j]
+        if segment.kind != "move":
+            return
+        share = max(min_move_time, fit_time(segment.distance_cm, time_available,
+                                            getattr(segment, "v_min", None), getattr(segment, "v_max", None)))
+        if force or abs(share - segment.time_expected) > retime_threshold:
+            _retimed(segment, share)
+        return
+
+    length = 0
+    planned = 0
+    lowest = 0
+    highest = max_speed_cm_s
+    for i in range(j, end):
+        segment = route[i]
+        planned += segment.time_expected
+        if segment.kind == "move":
+            length += abs(segment.distance_cm)
+            v_min = getattr(segment, "v_min", None)
+            v_max = getattr(segment, "v_max", None)
+            # As in fit_time(): the profile may peak at twice the average
+            lowest = max(lowest, (min_speed_cm_s if v_min is None else v_min) / 2)
+            highest = min(highest, (max_speed_cm_s if v_max is None else v_max) / 2)
+        else:
+            length += segment.length_cm
+    if length <= 0 or not (force or abs(time_available - planned) > retime_threshold):
+        return
+    speed = max(lowest, min(highest, length / max(time_available, min_move_time)))
+    for i in range(j, end):
+        segment = route[i]
+        if segment.kind == "move":
+            if segment.v_entry > 0:
+                segment.v_entry = speed
+            if segment.v_exit > 0:
+                segment.v_exit = speed
+            _retimed(segment, max(min_move_time, abs(segment.distance_cm) / speed))
+        else:
+            _retimed(segment, segment.length_cm / speed)
+
+def nominal_poses(route):
+    """
+    Return the planned pose before every step, plus the final one, as a flat
+    array("f") of x, y, theta (radians) triples, starting from (0, 0, 0).
+    """
+    poses = array("f", [0] * (3 * (len(route) + 1)))
+    x = y = theta = 0
+    for i, segment in enumerate(route):
+        if segment.kind == "move":
+            x += segment.nominal_cm * math.cos(theta)
+            y += segment.nominal_cm * math.sin(theta)
+        elif segment.kind == "turn":
+            theta += segment.angle * math.pi / 180
+        else:
+            # Arc: rotate about the centre of the circle, which is to the side we turn to
+            turn = segment.angle * math.pi / 180
+            side = segment.radius_cm if turn > 0 else -segment.radius_cm
+            cx = x - side * math.sin(theta)
+            cy = y + side * math.cos(theta)
+            theta += turn
+            x = cx + side * math.sin(theta)
+            y = cy - side * math.cos(theta)
+        poses[3 * i + 3] = x
+        poses[3 * i + 4] = y
+        poses[3 * i + 5] = theta
+    return poses
+
+def correct(route, j, poses):
+    """
+    Adjust step j from the odometry pose so it ends where the plan says.
+    A move gets the distance to its planned end point along the current heading.
+    A turn gets the angle to its planned absolute heading, so heading errors from
+    earlier steps do not add up.
+    Returns True if a move's distance changed and its profile needs re-baking.
+    """
+    segment = route[j]
+    x, y, heading = odometry.get_pose()
+    theta = heading * math.pi / 180
+    if segment.kind == "move":
+        if segment.target_ultrasound is not None:
+            return False
+        dx = poses[3 * j + 3] - x
+        dy = poses[3 * j + 4] - y
+        along = dx * math.cos(theta) + dy * math.sin(theta)
+        nominal = segment.nominal_cm
+        along = max(nominal - max_distance_correction, min(nominal + max_distance_correction, along))
+        if along * nominal <= 0 or abs(along - segment.distance_cm) < 0.05:
+            return False
+        segment.set_distance(along)
+        return True
+
+    if segment.kind == "turn":
+        # Wrap the change into -180..180 degrees
+        angle = (poses[3 * j + 5] - theta) * 180 / math.pi
+        angle = (angle + 180) % 360 - 180
+        angle = max(segment.angle - max_angle_correction, min(segment.angle + max_angle_correction, angle))
+        segment.set_angle(angle)
+    return False
+
+def run_route(route, deadline):
+    """
+    Execute a compiled route (see planner.compile_route()) so that the last step and
+    its pause end deadline seconds after the call.
+    Chained segments (see planner.chain_moves()) run back to back with no pause.
+    With manage_gc, automatic collection is held at segment_gc_threshold for the
+    whole call and the heap is collected in every pause instead; see gc_in_segments.
+    Returns the finish error in seconds (positive means late).
+    """
+    global step_times, gc_in_segments, gc_in_segments_us, gc_in_pauses, gc_in_pauses_us
+    count = len(route)
+    step_times = array("f", [0] * count)
+
+    path_left, turns_left, fixed_time_left, pauses_left = _totals(route)
+
+    turn_total = 0
+    turns_done = 0
+    # Moves exit on distance, so they rarely take exactly their expected time;
+    # the measured ratio is used to correct the next moves
+    move_actual = 0
+    move_expected = 0
+
+    poses = nominal_poses(route)
+    # The encoders still hold whatever came before the route (an earlier run, the
+    # robot pushed onto the start line); the pose starts from what they read now
+    left, right = hw.encoders().get_counts()
+    odometry.reset(left_count=left, right_count=right)
+    telemetry.clear()
+
+    gc_in_segments = 0
+    gc_in_segments_us = 0
+    gc_in_pauses = 0
+    gc_in_pauses_us = 0
+    hold_gc = manage_gc and hasattr(gc, "threshold")
+    if hold_gc:
+        saved_threshold = gc.threshold()
+        collect()
+        gc.threshold(segment_gc_threshold)
+
+    def plan(j, starts_at):
+        """
+        Correct step j from odometry and, if it is a move, re-time it and the rest
+        of its chain (see retime_chain()) for a start starts_at seconds into the run.
+        Time left for moves and arcs = time to the deadline minus the pauses and
+        turns still ahead, shared by distance.
+        Timed turns take exactly their time; other turns are assumed to take as long
+        as the ones measured so far.
+        """
+        segment = route[j]
+        moved = False
+        if correct_from_odometry:
+            left, right = hw.encoders().get_counts()
+            odometry.update(left, right)
+            moved = correct(route, j, poses)
+        if segment.kind == "turn":
+            return
+        turn_time = turn_total / turns_done if turns_done else turn_estimate
+        move_time = (deadline - starts_at - pauses_left[j] * pause
+                     - turns_left[j] * turn_time - fixed_time_left[j])
+        share = _chain_share(route, j, move_time, path_left)
+        if move_actual > 0:
+            share *= move_expected / move_actual
+        retime_chain(route, j, share, moved)
+
+    start = time.ticks_ms()
+    # Automatic collection stays off only while the route runs, even if a segment raises
+    try:
+        if count:
+            plan(0, 0)
+
+        for i in range(count):
+            segment = route[i]
+
+            if segment.label is not None and not screen.silent:
+                screen.clear()
+                screen.post(0, segment.label[0])
+                screen.post(1, segment.label[1])
+                screen.service(force=True)
+
+            step_start = time.ticks_ms()
+            if segment.kind == "move":
+                run_move(segment, stop_motors=False)
+            elif segment.kind == "arc":
+                run_arc(segment)
+            else:
+                run_turn(segment)
+            step_end = time.ticks_ms()
+            gc_in_segments += control_loop.gc_collections
+            gc_in_segments_us += control_loop.gc_cost_us
+
+            duration = time.ticks_diff(step_end, step_start) / 1000
+            step_times[i] = duration
+            if segment.kind == "turn" and segment.time_expected is None:
+                turn_total += duration
+                turns_done += 1
+            elif segment.kind == "move":
+                move_actual += duration
+                move_expected += segment.time_expected
+
+            # A chained segment hands straight over to the next one, timed with it by plan()
+            if _chained(segment):
+                continue
+
+            # Pause briefly between actions, re-planning the next step near the end of the
+            # pause, once the robot has stopped. The segment's garbage is collected first
+            pause_end = time.ticks_add(step_end, int(pause * 1000))
+            if hold_gc:
+                collect()
+            if i + 1 < count:
+                settle = time.ticks_diff(pause_end, time.ticks_ms()) - int(plan_lead * 1000)
+                if settle > 0 and move.gyro_hold:
+                    # Standing still: refresh the gyro bias the next move holds its heading with
+                    gyro.estimate_bias(settle)
+                elif settle > 0:
+                    time.sleep_ms(settle)
+                # At rest by now: learn how far the step's stop coasted
+                left, right = hw.encoders().get_counts()
+                coast.observe(left, right)
+                plan(i + 1, time.ticks_diff(pause_end, start) / 1000)
+            remaining = time.ticks_diff(pause_end, time.ticks_ms())
+            if remaining > 0:
+                time.sleep_ms(remaining)
+    finally:
+        if hold_gc:
+            gc.threshold(saved_threshold)
+    return time.ticks_diff(time.ticks_ms(), start) / 1000 - deadline
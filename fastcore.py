@@ -0,0 +1,181 @@
+from array import array
+import gc
+import micropython
+
+# Allocation-free integer core for the control loops.
+# On MicroPython every float result is a new heap object, so the loops keep their
+# state in preallocated arrays and do the per-iteration math in integers: motor
+# units, encoder counts and microseconds, with gains in Q8 fixed point.
+# Small integers never allocate, so the core runs without touching the heap.
+# The hot functions are compiled to machine code with @micropython.native and
+# @micropython.viper, which MicroPython only recognises written out like that.
+# On a PC, the host package supplies a micropython module whose decorators
+# return the function unchanged.
+
+GAIN_SHIFT = 8  # Gains are stored as gain * 256
+RIGHT_SHIFT = 10  # right_wheel_factor is passed as factor * 1024
+SMOOTHING = 3  # Corrections averaged to reduce jitter
+
+# PID state: integral (count-microseconds), last error, the smoothing history,
+# its next slot and its running sum
+_INTEGRAL = 0
+_LAST_ERROR = 1
+_HISTORY = 2
+_SLOT = _HISTORY + SMOOTHING
+_SUM = _SLOT + 1
+state = array("i", [0] * (_SUM + 1))
+
+gains = array("i", [0, 0, 0])  # kp, ki, kd in Q8; filled by gain_schedule.lookup_q8()
+speeds = array("i", [0, 0])  # Left and right motor commands written by pid_step()
+
+# Alpha-beta wheel velocity estimator: per wheel, the estimated count and rate
+# (counts per second), both in Q8. ALPHA and BETA are in Q8 as well
+ALPHA = 128  # 0.5: share of the count residual taken into the estimated count
+BETA = 43  # 0.17: share taken into the rate, per period
+_LEFT_COUNT = 0
+_LEFT_RATE = 1
+_RIGHT_COUNT = 2
+_RIGHT_RATE = 3
+wheels = array("i", [0, 0, 0, 0])
+
+def pid_reset():
+    """
+    Clear the PID state before a new segment.
+    """
+    for i in range(len(state)):
+        state[i] = 0
+
+@micropython.viper
+def _pid_terms(error: int, delta: int, integral_ms: int, dt_us: int, kp: int, ki: int, kd: int) -> int:
+    """
+    PID correction in Q8 motor units. The derivative is taken per second.
+    """
+    derivative = 0
+    if dt_us > 0:
+        derivative = delta * 1000000 // dt_us
+    return kp * error + ki * integral_ms // 1000 + kd * derivative
+
+@micropython.native
+def pid_step(error, dt_us, base, direction, right_q10, integral_limit_us):
+    """
+    One PID update for a straight move. base is the profile speed (motor units, >= 0),
+    error the count difference between the wheels.
+    Writes the left and right motor commands to speeds and returns the smoothed correction.
+    """
+    s = state
+    integral = s[_INTEGRAL] + error * dt_us
+    if integral > integral_limit_us:
+        integral = integral_limit_us
+    elif integral < -integral_limit_us:
+        integral = -integral_limit_us
+    s[_INTEGRAL] = integral
+
+    g = gains
+    correction = _pid_terms(error, error - s[_LAST_ERROR], integral // 1000, dt_us,
+                            g[0], g[1], g[2]) >> GAIN_SHIFT
+    s[_LAST_ERROR] = error
+
+    # Soft cap to prevent excessive corrections
+    cap = base * 3 // 10
+    if correction > cap:
+        correction = cap
+    elif correction < -cap:
+        correction = -cap
+
+    # Running average over the last SMOOTHING corrections
+    slot = s[_SLOT]
+    s[_SUM] += correction - s[_HISTORY + slot]
+    s[_HISTORY + slot] = correction
+    slot += 1
+    s[_SLOT] = 0 if slot == SMOOTHING else slot
+    smoothed = s[_SUM] // SMOOTHING
+
+    # Keep both wheels between zero and 50% above the base speed
+    limit = base * 3 // 2
+    left = base - smoothed
+    right = ((base + smoothed) * right_q10) >> RIGHT_SHIFT
+    if left > limit:
+        left = limit
+    elif left < 0:
+        left = 0
+    if right > limit:
+        right = limit
+    elif right < 0:
+        right = 0
+    speeds[0] = left * direction
+    speeds[1] = right * direction
+    return smoothed
+
+def velocity_reset(left, right, left_rate=0, right_rate=0):
+    """
+    Start the velocity estimator from the given counts and rates (counts per second).
+    """
+    wheels[_LEFT_COUNT] = left << GAIN_SHIFT
+    wheels[_LEFT_RATE] = left_rate << GAIN_SHIFT
+    wheels[_RIGHT_COUNT] = right << GAIN_SHIFT
+    wheels[_RIGHT_RATE] = right_rate << GAIN_SHIFT
+
+@micropython.native
+def _alpha_beta(w, i, count, dt_us):
+    # Predict with the estimated rate, then correct both from the residual. dt is
+    # taken in units of 100 us so every product stays a small integer
+    dt = dt_us // 100
+    predicted = w[i] + w[i + 1] * dt // 10000
+    residual = (count << GAIN_SHIFT) - predicted
+    w[i] = predicted + (residual * ALPHA >> GAIN_SHIFT)
+    w[i + 1] += (residual * BETA >> GAIN_SHIFT) * 10000 // dt
+
+@micropython.native
+def velocity_update(left, right, dt_us):
+    """
+    Update the estimator with the counts read dt_us after the previous update.
+    Returns the mean of the two wheel rates, in counts per second.
+    """
+    if dt_us < 100:
+        return (wheels[_LEFT_RATE] + wheels[_RIGHT_RATE]) >> (GAIN_SHIFT + 1)
+    _alpha_beta(wheels, _LEFT_COUNT, left, dt_us)
+    _alpha_beta(wheels, _RIGHT_COUNT, right, dt_us)
+    return (wheels[_LEFT_RATE] + wheels[_RIGHT_RATE]) >> (GAIN_SHIFT + 1)
+
+@micropython.native
+def track_speed(feedforward, lag, rate_error, kx, kv, limit):
+    """
+    Base speed that follows a planned motion: the feedforward for the planned
+    speed plus corrections for the position lag (counts) and the rate error
+    (counts per second), with kx and kv in Q8. Kept between 0 and limit.
+    """
+    speed = feedforward + ((kx * lag + kv * rate_error) >> GAIN_SHIFT)
+    if speed > limit:
+        return limit
+    if speed < 0:
+        return 0
+    return speed
+
+@micropython.native
+def profile_speed(profile, elapsed_us, period_us):
+    """
+    Base speed at elapsed_us from a profile sampled every period_us, interpolated.
+    The profile must have a sample past elapsed_us.
+    """
+    i = elapsed_us // period_us
+    a = profile[i]
+    return a + (profile[i + 1] - a) * (elapsed_us - i * period_us) // period_us
+
+def assert_no_alloc(step, iterations=100):
+    """
+    Call step(i) iterations times and assert that the heap did not grow.
+    Warms up with one call first. Returns the bytes allocated (0), or None where
+    gc.mem_alloc() does not exist (CPython).
+    """
+    if not hasattr(gc, "mem_alloc"):
+        return None
+    step(0)
+    gc.collect()
+    before = gc.mem_alloc()
+    i = 1
+    while i <= iterations:
+        step(i)
+        i += 1
+    grown = gc.mem_alloc() - before
+    assert grown == 0, "control core allocated"
+    return grown
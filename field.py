@@ -0,0 +1,175 @@
+import heapq
+
+# Route planning on a grid field.
+# A Field describes the track: columns x rows square cells, walls between
+# neighbouring cells, gate cells the route must pass through, where the robot
+# starts and the target cell the dowel must end on. plan() searches it and
+# returns a move/turn sequence in the format of 1mainMove.py.
+#
+# Cells are (column, row) with (0, 0) in the bottom left corner. Headings are
+# "E", "N", "W", "S"; a left turn goes one step along that list.
+#
+# Example, a 4 x 4 field entered from the bottom edge of cell (1, 0):
+#
+#     layout = Field(4, 4, start=(1, 0, "N"), target=(3, 3),
+#                    walls=[((1, 1), (1, 2)), ((2, 0), (2, 1))],
+#                    gates=[(0, 2), (3, 0)])
+#     sequence = plan(layout, dowel_offset=5.25)
+
+HEADINGS = "ENWS"
+_STEPS = ((1, 0), (0, 1), (-1, 0), (0, -1))
+
+# Search costs. Distance is charged per cell; plan() raises its weight when
+# the cheapest route does not fit the time available
+CELL_COST = 1
+TURN_COST = 3  # Per 90 degrees
+REVERSE_COST = 2  # Changing between driving forwards and backwards
+
+class Field:
+    """
+    A grid field. start is (column, row, heading): the robot starts on the outer
+    edge of that cell, facing into it. walls are pairs of neighbouring cells with
+    a wall between them; the outer boundary is always closed.
+    """
+    def __init__(self, columns, rows, start, target, walls=(), gates=(), cell_cm=50):
+        self.columns = columns
+        self.rows = rows
+        self.cell_cm = cell_cm
+        column, row, heading = start
+        if heading not in HEADINGS:
+            raise ValueError(f"heading must be one of {HEADINGS}: {heading!r}")
+        self.start = self._check((column, row))
+        self.start_heading = HEADINGS.index(heading)
+        self.target = self._check(target)
+        self.gates = [self._check(cell) for cell in gates]
+        self.walls = set()
+        for a, b in walls:
+            a, b = self._check(a), self._check(b)
+            if abs(a[0] - b[0]) + abs(a[1] - b[1]) != 1:
+                raise ValueError(f"wall between cells that are not neighbours: {a}, {b}")
+            self.walls.add((a, b))
+            self.walls.add((b, a))
+
+    def _check(self, cell):
+        cell = tuple(cell)
+        if not (0 <= cell[0] < self.columns and 0 <= cell[1] < self.rows):
+            raise ValueError(f"cell outside the field: {cell}")
+        return cell
+
+    def neighbour(self, cell, heading, direction=1):
+        """
+        The cell one step from cell along heading (backwards if direction is -1),
+        or None if a wall or the boundary is in the way.
+        """
+        dx, dy = _STEPS[heading]
+        other = (cell[0] + direction * dx, cell[1] + direction * dy)
+        if not (0 <= other[0] < self.columns and 0 <= other[1] < self.rows):
+            return None
+        if (cell, other) in self.walls:
+            return None
+        return other
+
+def _search(layout, cell_cost):
+    """
+    A* over (cell, heading, last travel direction, arrived by a move, gates passed).
+    The robot starts in the centre of the start cell, having just driven forwards
+    into it. Returns the list of actions, ("move", +1 or -1) for one cell or
+    ("turn", +1 or -1) for 90 degrees left or right, or None if there is no route.
+    """
+    gate_bits = {}
+    for cell in layout.gates:
+        gate_bits[cell] = gate_bits.get(cell, 0) | 1 << len(gate_bits)
+    all_gates = (1 << len(gate_bits)) - 1
+    target = layout.target
+
+    def estimate(cell):
+        return (abs(cell[0] - target[0]) + abs(cell[1] - target[1])) * cell_cost
+
+    start = (layout.start, layout.start_heading, 1, True, gate_bits.get(layout.start, 0))
+    best = {start: 0}
+    came_from = {start: None}
+    order = 0  # Tie-break so states themselves are never compared
+    frontier = [(estimate(layout.start), order, 0, start)]
+    while frontier:
+        _, _, cost, state = heapq.heappop(frontier)
+        if cost > best[state]:
+            continue
+        cell, heading, last, moved, gates = state
+        if cell == target and moved and gates == all_gates:
+            actions = []
+            while came_from[state] is not None:
+                state, action = came_from[state]
+                actions.append(action)
+            actions.reverse()
+            return actions
+
+        options = []
+        for direction in (1, -1):
+            other = layout.neighbour(cell, heading, direction)
+            if other is not None:
+                step_cost = cell_cost + (REVERSE_COST if direction != last else 0)
+                options.append((("move", direction), step_cost,
+                                (other, heading, direction, True, gates | gate_bits.get(other, 0))))
+        for side in (1, -1):
+            options.append((("turn", side), TURN_COST,
+                            (cell, (heading + side) % 4, last, False, gates)))
+
+        for action, step_cost, following in options:
+            total = cost + step_cost
+            if total < best.get(following, total + 1):
+                best[following] = total
+                came_from[following] = (state, action)
+                order += 1
+                heapq.heappush(frontier, (total + estimate(following[0]), order, total, following))
+    return None
+
+def _steps(layout, actions, dowel_offset):
+    """
+    Turn single-cell actions into a move/turn sequence: runs of moves in one
+    direction become one move and consecutive turns one turn. The first move
+    also covers the entry from the start edge to the start cell's centre; the
+    last one stops with the dowel, dowel_offset cm ahead of the centre, on the
+    target's centre.
+    """
+    cell = layout.cell_cm
+    steps = [[cell / 2 + dowel_offset, "move"]]
+    for kind, sign in actions:
+        amount = sign * (cell if kind == "move" else 90)
+        last = steps[-1]
+        if last[1] == kind and (kind == "turn" or (last[0] > 0) == (sign > 0)):
+            last[0] += amount
+        else:
+            steps.append([amount, kind])
+    steps[-1][0] -= dowel_offset
+    return [(amount, kind) for amount, kind in steps if amount]
+
+def minimum_time(sequence, turn_time=0.36, pause=0.2, speed_cm_s=60):
+    """
+    Shortest time a sequence can run in: every move at speed_cm_s on average,
+    every turn taking turn_time and a pause after every step but the last.
+    """
+    moves = sum(abs(amount) for amount, kind in sequence if kind == "move")
+    turns = sum(1 for _, kind in sequence if kind == "turn")
+    return moves / speed_cm_s + turns * turn_time + max(0, len(sequence) - 1) * pause
+
+def plan(layout, dowel_offset=0, time_available=None, turn_time=0.36, pause=0.2, speed_cm_s=60):
+    """
+    Plan the route through every gate to the target with the fewest turns and
+    reversals, as a sequence for compile_route(). If it cannot be driven within
+    time_available seconds (see minimum_time()), distance is weighted more until
+    it can.
+    Raises ValueError if no route, or none that fits the time, exists.
+    """
+    weight = 1
+    while True:
+        actions = _search(layout, CELL_COST * weight)
+        if actions is None:
+            raise ValueError("no route passes every gate and reaches the target")
+        sequence = _steps(layout, actions, dowel_offset)
+        needed = minimum_time(sequence, turn_time, pause, speed_cm_s)
+        if time_available is None or needed <= time_available:
+            return sequence
+        # Once a cell outweighs every turn and reversal the route is already the shortest
+        if weight > 4 * (TURN_COST + REVERSE_COST) * layout.columns * layout.rows:
+            raise ValueError(f"shortest route needs {needed:.1f}s, only {time_available:.1f}s available")
+        weight *= 2
@@ -0,0 +1,135 @@
+from array import array
+import micropython
+from fastcore import GAIN_SHIFT
+
+# Precomputed adaptive PID gain schedule for move().
+# The gains only depend on the base speed, so instead of three fractional powers
+# and six clamps per iteration they are tabulated once, indexed by quantized
+# base speed, and looked up (optionally with linear interpolation).
+#
+# Tolerance: with the default STEP and interpolation on, every gain is within
+# 3% of exact_gains() (8% without interpolation), worst at the clamp corners; see
+# max_error(). Above the saturation speed (~470 with reference_speed 100, which
+# covers every speed move() normally commands) the table is exact.
+# table_q8 holds the same gains in fixed point for the integer control core.
+
+STEP = 2  # Base speed units between table entries
+INTERPOLATE = True
+
+# Interleaved kp, ki, kd per entry
+table = array("f")
+table_q8 = array("H")
+_size = 0
+_params = None  # (kp_base, ki_base, kd_base, reference_speed) the table was built for
+
+def exact_gains(base_speed, kp_base, ki_base, kd_base, reference_speed):
+    """
+    Adaptive PID gains for a base speed, computed directly.
+    Higher speeds need more aggressive correction, lower speeds need gentler correction.
+    """
+    speed_ratio = base_speed / reference_speed if reference_speed > 0 else 1
+
+    # Power function with root for smoother transition - softens impact at very high speeds
+    # while still providing stronger correction
+    kp = kp_base * (speed_ratio ** 0.75)  # Less aggressive scaling for P term
+    ki = ki_base * (speed_ratio ** 0.5)   # Even gentler for I term to prevent windup
+    kd = kd_base * (speed_ratio ** 0.9)   # Strong scaling for D to dampen at high speeds
+
+    # Safety caps on PID values to prevent extreme corrections
+    kp = max(min(kp, kp_base * 3), kp_base * 0.5)
+    ki = max(min(ki, ki_base * 2), ki_base * 0.3)
+    kd = max(min(kd, kd_base * 4), kd_base * 0.7)
+    return kp, ki, kd
+
+def build(kp_base, ki_base, kd_base, reference_speed, step=STEP):
+    """
+    Build the gain table for the given base gains.
+    The table stops where all three gains reach their upper caps, so any faster
+    base speed reads the last entry.
+    """
+    global table, table_q8, _size, _params, STEP
+    STEP = step
+    # Above these speed ratios each gain is clamped at its upper cap
+    saturation = max(3 ** (1 / 0.75), 2 ** (1 / 0.5), 4 ** (1 / 0.9))
+    max_speed = reference_speed * saturation if reference_speed > 0 else 0
+    _size = int(max_speed // step) + 2
+    table = array("f", [0] * (3 * _size))
+    for i in range(_size):
+        kp, ki, kd = exact_gains(i * step, kp_base, ki_base, kd_base, reference_speed)
+        table[3 * i] = kp
+        table[3 * i + 1] = ki
+        table[3 * i + 2] = kd
+    scale = 1 << GAIN_SHIFT
+    table_q8 = array("H", [int(g * scale + 0.5) for g in table])
+    _params = (kp_base, ki_base, kd_base, reference_speed)
+
+def ensure(kp_base, ki_base, kd_base, reference_speed):
+    """
+    Rebuild the table only if the base gains changed since the last build.
+    """
+    if _params != (kp_base, ki_base, kd_base, reference_speed):
+        build(kp_base, ki_base, kd_base, reference_speed)
+
+def lookup(base_speed, interpolate=None):
+    """
+    Return (kp, ki, kd) for a base speed from the table.
+    interpolate defaults to INTERPOLATE.
+    """
+    if interpolate is None:
+        interpolate = INTERPOLATE
+    position = abs(base_speed) / STEP
+    i = int(position)
+    if i >= _size - 1:
+        i = 3 * (_size - 1)
+        return table[i], table[i + 1], table[i + 2]
+    j = 3 * i
+    if not interpolate:
+        return table[j], table[j + 1], table[j + 2]
+    frac = position - i
+    return (table[j] + (table[j + 3] - table[j]) * frac,
+            table[j + 1] + (table[j + 4] - table[j + 1]) * frac,
+            table[j + 2] + (table[j + 5] - table[j + 2]) * frac)
+
+@micropython.native
+def lookup_q8(base_speed, out):
+    """
+    Integer version of lookup() for the control core: writes kp, ki, kd in Q8
+    to out (e.g. fastcore.gains) for an integer base speed. Never allocates.
+    """
+    t = table_q8
+    step = STEP
+    if base_speed < 0:
+        base_speed = -base_speed
+    i = base_speed // step
+    if i >= _size - 1:
+        j = 3 * (_size - 1)
+        out[0] = t[j]
+        out[1] = t[j + 1]
+        out[2] = t[j + 2]
+        return
+    j = 3 * i
+    if not INTERPOLATE:
+        out[0] = t[j]
+        out[1] = t[j + 1]
+        out[2] = t[j + 2]
+        return
+    frac = base_speed - i * step
+    out[0] = t[j] + (t[j + 3] - t[j]) * frac // step
+    out[1] = t[j + 1] + (t[j + 4] - t[j + 1]) * frac // step
+    out[2] = t[j + 2] + (t[j + 5] - t[j + 2]) * frac // step
+
+def max_error(samples=2000, interpolate=None):
+    """
+    Largest relative error of lookup() against exact_gains() over the table range.
+    For checking the tolerance after changing STEP; not for use in the loop.
+    """
+    kp_base, ki_base, kd_base, reference_speed = _params
+    top = (_size + 1) * STEP
+    worst = 0
+    for n in range(samples + 1):
+        speed = top * n / samples
+        exact = exact_gains(speed, kp_base, ki_base, kd_base, reference_speed)
+        approx = lookup(speed, interpolate)
+        for e, a in zip(exact, approx):
+            worst = max(worst, abs(a - e) / e)
+    return worst
@@ -0,0 +1,124 @@
+import math
+import time
+import hw
+import odometry
+
+# Gyro heading integration for holding a straight line.
+# The control loop calls update() once per period; it takes the newest yaw rate
+# from the IMU (if a new one is ready), removes the estimated bias and
+# integrates it over the loop period. The bias is estimated while the robot
+# stands still: before the start and in the executor's pauses.
+# Rates and angles are integers (millidegrees per second, millidegrees) so the
+# integration itself does not allocate. Reading the IMU through the driver
+# does: every new reading makes a tuple of float rates. Automatic collection is
+# held off inside segments, so that garbage waits for the next pause.
+# If the IMU stops answering, update() reports it and available() turns False,
+# so the segments fall back to the wheel counts.
+
+# The bias is only sampled once neither encoder has moved for STILL_MS; a wheel
+# moving by more than STILL_COUNTS (encoder noise) starts the wait and the average over
+STILL_MS = 100
+STILL_COUNTS = 1
+BIAS_WEIGHT = 0.3  # How far each pause moves the bias estimate towards what it measured
+
+# Left minus right wheel counts for one millidegree of heading change, in Q16
+COUNTS_PER_MDEG_Q16 = int(round(math.pi / 180000 * odometry.TRACK_WIDTH / odometry.CM_PER_COUNT * 65536))
+
+bias_mdps = 0
+calibrated = False
+failed = False  # The IMU stopped answering during the run
+rate_mdps = 0  # Newest bias-corrected yaw rate, positive = turning left
+turned_mdeg = 0  # Heading change since start()
+
+def available():
+    """
+    True if the IMU is there and working.
+    """
+    return not failed and hw.imu() is not None
+
+def start():
+    """
+    Start integrating from zero, e.g. at the start of a move.
+    """
+    global rate_mdps, turned_mdeg
+    rate_mdps = 0
+    turned_mdeg = 0
+
+def update(dt_us):
+    """
+    Integrate the yaw rate over the last dt_us. Returns the heading change since
+    start() in millidegrees, or None if the IMU did not answer (it is not used
+    again, see available()). A new reading allocates a few floats in the driver.
+    """
+    global rate_mdps, turned_mdeg, failed
+    gyro = hw.imu().gyro
+    previous = rate_mdps
+    try:
+        if gyro.data_ready():
+            gyro.read()
+            rate_mdps = int(gyro.last_reading_dps[2] * 1000) - bias_mdps
+    except OSError:
+        failed = True
+        return None
+    # Trapezoidal: the rate is only sampled once a period, and holding the newest
+    # sample over the whole period overstates every swing
+    turned_mdeg += (previous + rate_mdps) * dt_us // 2000000
+    return turned_mdeg
+
+def estimate_bias(duration_ms):
+    """
+    Average the yaw rate while standing still for duration_ms and fold it into
+    bias_mdps. Readings only count once the encoders have held still for
+    STILL_MS, so a robot still coasting out of the last segment does not pass
+    its rotation off as bias. The first estimate is taken as it is.
+    Returns the number of readings used; with none, the bias is left as it was.
+    """
+    global bias_mdps, calibrated, failed
+    end = time.ticks_add(time.ticks_ms(), duration_ms)
+    if duration_ms <= STILL_MS or not available():
+        time.sleep_ms(max(0, duration_ms))
+        return 0
+    gyro = hw.imu().gyro
+    encoders = hw.encoders()
+    still_left, still_right = encoders.get_counts()
+    still_since = time.ticks_ms()
+    total = 0
+    readings = 0
+    while time.ticks_diff(end, time.ticks_ms()) > 0:
+        left, right = encoders.get_counts()
+        if abs(left - still_left) > STILL_COUNTS or abs(right - still_right) > STILL_COUNTS:
+            # Still moving: wait again, and drop whatever was averaged meanwhile
+            still_left, still_right = left, right
+            still_since = time.ticks_ms()
+            total = 0
+            readings = 0
+        try:
+            ready = gyro.data_ready()
+            if ready:
+                gyro.read()
+        except OSError:
+            failed = True
+            time.sleep_ms(max(0, time.ticks_diff(end, time.ticks_ms())))
+            return 0
+        if ready and time.ticks_diff(time.ticks_ms(), still_since) >= STILL_MS:
+            total += gyro.last_reading_dps[2]
+            readings += 1
+        elif not ready:
+            time.sleep_ms(1)
+    if readings:
+        measured = int(total * 1000 / readings)
+        if calibrated:
+            bias_mdps += int((measured - bias_mdps) * BIAS_WEIGHT)
+        else:
+            bias_mdps = measured
+            calibrated = True
+    return readings
+
+def counts(turned):
+    """
+    A heading change in millidegrees as the left minus right count difference it
+    corresponds to, so the wheel-difference PID can use it unchanged.
+    Rounded to the nearest count: truncating would turn every small negative
+    angle into a full count of error and keep the robot weaving.
+    """
+    return -((turned * COUNTS_PER_MDEG_Q16 + 32768) >> 16)
@@ -0,0 +1,23 @@
+"""
+Host-side (PC) tools for the robot tour code.
+
+Nothing in this package is copied to the robot. Run the tools from the
+repository root, e.g. `python -m host.sim`, so the robot modules are importable.
+
+Importing the package installs a stand-in `micropython` module, so robot
+modules that use @micropython.native and @micropython.viper import as plain
+Python.
+"""
+
+import sys
+import types
+
+
+def _micropython():
+    module = types.ModuleType("micropython")
+    module.native = module.viper = lambda function: function
+    module.const = lambda value: value
+    return module
+
+
+sys.modules.setdefault("micropython", _micropython())
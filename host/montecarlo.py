@@ -0,0 +1,566 @@
+"""
+Vectorized Monte Carlo robustness analysis of the route in 1mainMove.py.
+
+Thousands of independent robots run in lock-step, one NumPy array element
+each, through the compiled route (planner.compile_route()). Every control
+period each robot runs the same integer velocity estimate, profile tracking,
+gain schedule and PID as move() (fastcore.velocity_update(), track_speed() and
+pid_step()), the same turn and arc loops as turn.py, and
+the same pauses and chaining as the executor. The plant is the lag model of
+host/sim.py, with per-robot encoder noise, wheel slip, motor gain mismatch
+and battery sag.
+
+Robots run the route as the executor plans it before the start, with every
+move and arc timed so the route ends on time (see executor.spread()). The
+executor's re-timing during the run, its odometry corrections and the final
+ultrasound approach are not modelled, so the numbers show how much the route
+itself spreads. Predictive stops use coast.py's default table; nothing is learned.
+
+Every control period runs the estimator, the PID and the plant as whole-array
+NumPy arithmetic over all robots, whatever segment each is in, and masks keep
+the results that apply. On one core of a desktop the route takes about 2 s for
+1000 robots and 13 s for the default 10,000, where the mean position error
+moves by less than 0.05 cm between seeds.
+
+Example (from the repository root):
+
+    python -m host.montecarlo
+    python -m host.montecarlo -n 1000 --corner-radius 10 --corner-radius 0
+
+or from Python:
+
+    from host import montecarlo
+    result = montecarlo.run(montecarlo.load_route())
+    print(montecarlo.summary(result))
+"""
+
+import argparse
+import math
+import time as _host_time
+
+import numpy as np
+
+from host import sim
+
+# Plant, matching host/sim.SimRobot's defaults
+PLANT = {
+    "cmd_per_cm_s": 39.0,
+    "deadband": 60,
+    "right_gain": 1 / 1.075,
+    "drive_lag": 0.05,
+    "brake_lag": 0.02,
+    "coast_lag": 0.03,
+    "track_width": 8.4,
+}
+
+# Spread of the disturbances, per robot
+NOISE = {
+    "encoder_noise": 0.3,  # Counts, standard deviation of every read
+    "slip": 0.01,  # Relative, standard deviation of ground travel per period
+    "gain_mismatch": 0.02,  # Relative, standard deviation of each motor's gain
+    "battery_sag": 0.05,  # Gain lost by the end of the run, uniform from 0 to this
+}
+
+# Per-robot phase
+RUNNING, PAUSED, DONE = 0, 1, 2
+
+
+def load_route(chain=None, corner_radius=None):
+    """
+    Compile the route from 1mainMove.py (through the simulator, so the robot
+    modules import). chain and corner_radius override 1mainMove's settings.
+    Returns (route, modules) where modules holds the loaded robot modules.
+    """
+    sim.install()
+    main = sim.load("1mainMove")
+    if chain is not None:
+        main.chain_moves = chain
+    if corner_radius is not None:
+        main.corner_radius = corner_radius or None
+    route = main.load_route()
+    modules = {name: sim.load(name) for name in ("move", "turn", "executor", "gain_schedule", "fastcore")}
+    modules["main"] = main
+    return route, modules
+
+
+# Per-segment table entries each robot keeps a copy of for the segment it is in
+_SEGMENT_FIELDS = ("kind", "target", "direction", "hand_over", "time_us", "tail", "tail_rate", "offset",
+                   "timed", "turning_left", "left_q10", "right_q10", "arc_base", "arc_rate")
+
+
+class _Tables:
+    """Per-segment constants as arrays, indexed by segment number."""
+
+    def __init__(self, route, modules):
+        move, turn, control_loop = modules["move"], modules["turn"], sim.load("control_loop")
+        self.period_us = control_loop.PERIOD_US
+        # fastcore._alpha_beta()'s period in units of 100 us and updates per second in those units
+        self.period_centi_ms = self.period_us // 100
+        self.per_period = 10000 // self.period_centi_ms
+        count = len(route)
+        self.count = count
+        self.kind = np.array([{"move": 0, "turn": 1, "arc": 2}[s.kind] for s in route])
+        self.chain = np.array([bool(getattr(s, "chain", False)) for s in route])
+        self.hand_over = np.array([s.kind == "move" and s.v_exit > 0 for s in route])
+        self.v_entry = np.array([s.kind == "move" and s.v_entry > 0 for s in route])
+        self.target = np.zeros(count, np.int64)
+        self.direction = np.ones(count, np.int64)
+        self.time_us = np.zeros(count, np.int64)
+        self.tail = np.zeros(count, np.int64)
+        self.tail_rate = np.zeros(count, np.int64)
+        self.entry_rate = np.zeros(count, np.int64)
+        self.offset = np.zeros(count, np.int64)
+        self.left_q10 = np.zeros(count, np.int64)
+        self.right_q10 = np.zeros(count, np.int64)
+        self.arc_base = np.zeros(count, np.int64)
+        self.arc_rate = np.zeros(count, np.int64)
+        self.turning_left = np.zeros(count, bool)
+        self.timed = np.zeros(count, bool)
+        # Move feedforward profiles (with their planned position and speed) and timed
+        # turn angle profiles (with their feedforward) back to back, each starting at
+        # its segment's offset
+        profiles = []
+        feedforwards = []
+        planned = []
+        planned_rates = []
+        used = 0
+        for i, s in enumerate(route):
+            if s.kind == "move":
+                self.target[i] = s.target_counts
+                self.direction[i] = s.direction
+                self.time_us[i] = int(s.time_expected * 1000000)
+                self.tail[i] = s.tail_speed
+                self.tail_rate[i] = s.tail_rate
+                self.entry_rate[i] = s.direction * int(s.v_entry * move.counts_per_cm() + 0.5)
+                samples = int(s.time_expected * 1000000 / s.period_us) + 2
+                self.offset[i] = used
+                profiles.append(np.asarray(s.profile[:samples], np.int64))
+                feedforwards.append(np.zeros(samples, np.int64))
+                planned.append(np.asarray(s.planned[:samples], np.int64))
+                planned_rates.append(np.asarray(s.planned_rate[:samples], np.int64))
+                used += samples
+            elif s.kind == "turn":
+                self.target[i] = s.target_counts
+                self.turning_left[i] = s.turning_left
+                if s.time_expected is not None:
+                    self.timed[i] = True
+                    self.time_us[i] = int(s.time_expected * 1000000)
+                    self.right_q10[i] = s.right_q10
+                    samples = int(s.time_expected * 1000000 / s.period_us) + 2
+                    self.offset[i] = used
+                    profiles.append(np.asarray(s.profile[:samples], np.int64))
+                    feedforwards.append(np.asarray(s.feedforward[:samples], np.int64))
+                    planned.append(np.zeros(samples, np.int64))
+                    planned_rates.append(np.zeros(samples, np.int64))
+                    used += samples
+            else:
+                self.target[i] = s.target_diff
+                self.turning_left[i] = s.turning_left
+                self.left_q10[i] = s.left_q10
+                self.right_q10[i] = s.right_q10
+                self.arc_base[i] = s.base_speed
+                self.arc_rate[i] = s.planned_rate
+        self.profile = np.concatenate(profiles + [np.zeros(1, np.int64)])
+        self.feedforward = np.concatenate(feedforwards + [np.zeros(1, np.int64)])
+        self.planned = np.concatenate(planned + [np.zeros(1, np.int64)])
+        self.planned_rate = np.concatenate(planned_rates + [np.zeros(1, np.int64)])
+
+        schedule = modules["gain_schedule"]
+        schedule.ensure(move.kp_base, move.ki_base, move.kd_base, move.reference_speed)
+        self.gain_table = np.asarray(schedule.table_q8, np.int64).reshape(-1, 3)
+        self.gain_step = schedule.STEP
+        self.interpolate = schedule.INTERPOLATE
+        self.right_q10_move = int(move.right_wheel_factor * (1 << modules["fastcore"].RIGHT_SHIFT) + 0.5)
+        self.integral_limit_us = int(move.integral_limit * 1000000)
+        shift = modules["fastcore"].GAIN_SHIFT
+        self.kx_q8 = int(move.track_kx * (1 << shift) + 0.5)
+        self.kv_q8 = int(move.track_kv * (1 << shift) + 0.5)
+        self.max_base = move.max_base_speed
+        coast = sim.load("coast")
+        # coast.predict() for every rate up to the last bin, past which it holds
+        table = np.asarray(coast.table, np.int64).reshape(coast.KINDS, coast.BINS)
+        rate = np.arange((coast.BINS - 1) * coast.RATE_STEP + 1)
+        i = rate // coast.RATE_STEP
+        j = np.minimum(i + 1, coast.BINS - 1)
+        frac = rate - i * coast.RATE_STEP
+        self.coast_by_rate = (table[:, i] + (table[:, j] - table[:, i]) * frac // coast.RATE_STEP) >> coast.SHIFT
+        self.move_stop, self.turn_stop = coast.BRAKE, coast.TURN  # The executor brakes moves to a stop
+        self.max_turn = turn.MAX_TURN_SPEED
+        self.min_turn = turn.MIN_TURN_SPEED
+        self.timed_kp = turn.TIMED_TURN_KP
+        self.timed_min = turn.TIMED_MIN_SPEED
+        self.max_motor = turn.MAX_MOTOR_SPEED
+        self.arc_kp = turn.ARC_KP
+        self.pause_ticks = int(round(modules["executor"].pause * 1000000 / self.period_us))
+        self.counts_per_cm = move.encoder_count / (move.wheel_diameter * math.pi)
+        top = self.max_base
+        self.kp, self.ki, self.kd = self._gains(np.arange(top + 1)).T  # Indexed by base speed
+
+    def coast(self, kind, rate):
+        """Vectorized coast.predict() for one stop kind."""
+        table = self.coast_by_rate[kind]
+        return table.take(np.minimum(np.abs(rate), len(table) - 1))
+
+    def _gains(self, base):
+        """Vectorized gain_schedule.lookup_q8(): (n, 3) Q8 gains."""
+        table = self.gain_table
+        last = len(table) - 1
+        i = np.minimum(base // self.gain_step, last)
+        if not self.interpolate:
+            return table[i]
+        j = np.minimum(i + 1, last)
+        frac = (base - i * self.gain_step)[:, None]
+        return table[i] + (table[j] - table[i]) * frac // self.gain_step
+
+
+def _clip(a, low, high):
+    """np.clip() without the overhead of its wrapper, which adds up over every period."""
+    return np.minimum(np.maximum(a, low), high)
+
+
+def _velocity_update(wheel_count, wheel_rate, counts, hold, tab, fastcore):
+    """
+    Vectorized fastcore.velocity_update() for every robot but those indexed by
+    hold, which have just entered a segment and so have no period to update
+    over. Robots that are not in a segment update too: entering one resets
+    their estimate. Returns every robot's mean wheel rate.
+    """
+    held = wheel_count[hold], wheel_rate[hold]
+    predicted = wheel_rate * tab.period_centi_ms
+    predicted //= 10000
+    predicted += wheel_count
+    residual = counts << fastcore.GAIN_SHIFT
+    residual -= predicted
+    np.right_shift(residual * fastcore.ALPHA, fastcore.GAIN_SHIFT, out=wheel_count)
+    wheel_count += predicted
+    residual *= fastcore.BETA
+    residual >>= fastcore.GAIN_SHIFT
+    residual *= tab.per_period
+    wheel_rate += residual
+    wheel_count[hold], wheel_rate[hold] = held
+    return (wheel_rate[:, 0] + wheel_rate[:, 1]) >> (fastcore.GAIN_SHIFT + 1)
+
+
+def _noise(rng, shape, std):
+    """Zero-mean uniform noise with standard deviation std; far cheaper to draw than normal."""
+    noise = rng.random(shape, np.float32)
+    noise -= 0.5
+    noise *= std * math.sqrt(12)
+    return noise
+
+
+def run(route_and_modules, n=10000, noise=None, plant=None, seed=0, max_time_s=200):
+    """
+    Run n robots through the route. route_and_modules is what load_route() returns.
+    Returns a dict of per-robot arrays: x, y (cm), heading (deg), time (s, route
+    only, pauses included), finished (bool), plus the nominal end pose.
+    """
+    route, modules = route_and_modules
+    noise = dict(NOISE, **(noise or {}))
+    plant = dict(PLANT, **(plant or {}))
+    rng = np.random.default_rng(seed)
+    tab = _Tables(route, modules)
+    fastcore = modules["fastcore"]
+    dt = tab.period_us / 1e6
+    idx = np.arange(n)
+
+    # Per-robot disturbances
+    gain = np.column_stack((
+        (1 + rng.normal(0, noise["gain_mismatch"], n)),
+        (1 + rng.normal(0, noise["gain_mismatch"], n)) * plant["right_gain"]))
+    sag = rng.uniform(0, noise["battery_sag"], n)
+    drive = gain / plant["cmd_per_cm_s"]
+    lag = np.array((plant["drive_lag"], plant["brake_lag"], plant["coast_lag"]))  # Driven, braking, off
+    decay = np.exp(-dt / lag)
+    lag_gain = lag * (1 - decay)
+    nominal_s = sum(getattr(s, "time_expected", 0.36) for s in route) + tab.pause_ticks * dt * len(route)
+
+    # Plant state
+    x = np.zeros(n)
+    y = np.zeros(n)
+    theta = np.zeros(n)
+    velocity = np.zeros((n, 2))
+    wheel_cm = np.zeros((n, 2))
+    command = np.zeros((n, 2))
+    motors_off = np.ones(n, bool)
+    offset = np.zeros((n, 2), np.int64)  # Encoder reset point
+
+    # Executor and loop state
+    seg = np.zeros(n, np.int64)
+    phase = np.full(n, RUNNING)
+    entering = np.ones(n, bool)
+    tick = np.zeros(n, np.int64)  # Ticks into the current segment or pause
+    start = np.zeros((n, 2), np.int64)  # Counts at a segment's start; moves reset them to 0
+    target = np.zeros(n, np.int64)
+    carry = np.zeros(n, np.int64)
+    # The current segment's entry in each of the tables, copied on entry so the
+    # loop does not index the tables every period
+    current = {name: np.zeros(n, getattr(tab, name).dtype) for name in _SEGMENT_FIELDS}
+    # fastcore.pid_step() state
+    integral = np.zeros(n, np.int64)
+    last_error = np.zeros(n, np.int64)
+    history = np.zeros((n, fastcore.SMOOTHING), np.int64)
+    history_at = idx * fastcore.SMOOTHING  # Each robot's history in the flat array
+    next_slot = np.roll(np.arange(fastcore.SMOOTHING), -1)
+    slot = np.zeros(n, np.int64)
+    history_sum = np.zeros(n, np.int64)
+    # fastcore.velocity_update() state: estimated count and rate per wheel, Q8
+    wheel_count = np.zeros((n, 2), np.int64)
+    wheel_rate = np.zeros((n, 2), np.int64)
+    finish_tick = np.full(n, -1)
+
+    # Every robot runs the same arithmetic each period, whatever it is doing, and
+    # masks pick the results that apply; with the robots mostly in step, that is
+    # far cheaper than gathering and scattering the ones in each kind of segment
+    kind = current["kind"]
+    direction = current["direction"]
+    time_us = current["time_us"]
+    offset_k = current["offset"]
+    timed = current["timed"]
+    turning_left = current["turning_left"]
+    left_q10 = current["left_q10"]
+    right_q10 = current["right_q10"]
+    arc_rate = current["arc_rate"]
+    total_ticks = 0
+    while total_ticks * dt < max_time_s:
+        active = phase != DONE
+        if not active.any():
+            break
+        raw = np.rint(wheel_cm * tab.counts_per_cm
+                      + _noise(rng, (n, 2), noise["encoder_noise"])).astype(np.int64)
+
+        # Segment entry
+        e = idx[active & entering & (phase == RUNNING)]
+        if len(e):
+            s = seg[e]
+            for name in _SEGMENT_FIELDS:
+                current[name][e] = getattr(tab, name)[s]
+            is_move = tab.kind[s] == 0
+            mover = e[is_move]
+            offset[mover] = raw[mover]
+            start[mover] = 0
+            target[e] = tab.target[s]
+            target[mover] -= np.where(tab.v_entry[seg[mover]], carry[mover], 0)
+            integral[mover] = 0
+            last_error[mover] = 0
+            history[mover] = 0
+            slot[mover] = 0
+            history_sum[mover] = 0
+            wheel_count[mover] = 0
+            wheel_rate[mover] = (tab.entry_rate[seg[mover]] << fastcore.GAIN_SHIFT)[:, None]
+            other = e[~is_move]
+            start[other] = raw[other] - offset[other]
+            wheel_count[other] = 0
+            # Arcs are entered at their hand-over speed, turns from rest
+            wheel_rate[other] = (np.where(tab.kind[s[~is_move]] == 2, tab.arc_rate[s[~is_move]], 0)
+                                 << fastcore.GAIN_SHIFT)[:, None]
+            tick[e] = 0
+            entering[e] = False
+        counts = raw - offset
+
+        running = phase == RUNNING
+        in_move = running & (kind == 0)
+        in_turn = running & (kind == 1)
+        in_arc = running & (kind == 2)
+        first = tick == 0
+        wheels = counts - start
+        # Turns estimate the speed of how far each wheel has gone, whichever way
+        estimated = wheels.copy()
+        turning = idx[in_turn]
+        estimated[turning] = np.abs(estimated[turning])
+        rate = _velocity_update(wheel_count, wheel_rate, estimated, e, tab, fastcore)
+        inside = tick * tab.period_us < time_us
+        # Where a move's or a timed turn's profile is, this period
+        k = np.where(inside, offset_k + tick, 0)
+        exiting = np.zeros(n, bool)
+
+        # Moves (run_move)
+        if in_move.any():
+            left, right = counts[:, 0], counts[:, 1]
+            avg = np.abs((left + right) // 2)
+            move_rate = direction * rate
+            # A move that stops cuts the motors early by the predicted coast (coast.predict())
+            hand_over = current["hand_over"]
+            done = in_move & (avg >= target - np.where(hand_over, 0, tab.coast(tab.move_stop, move_rate)))
+            exiting |= done
+            carry = np.where(done, np.where(hand_over, avg - target, 0), carry)
+            go = in_move & ~done
+            # Profile tracking (fastcore.track_speed()); loop times are whole
+            # periods, so the profile lookup lands on a sample
+            carried = current["target"] - target
+            feedforward = np.where(inside, tab.profile[k], current["tail"])
+            track_lag = np.where(inside, tab.planned[k] - (avg + carried), target - avg)
+            rate_error = np.where(inside, tab.planned_rate[k], current["tail_rate"]) - move_rate
+            base = _clip(feedforward + ((tab.kx_q8 * track_lag + tab.kv_q8 * rate_error) >> fastcore.GAIN_SHIFT),
+                         0, tab.max_base)
+            error = direction * (left - right)
+            i_us = _clip(integral + np.where(first, 0, error * tab.period_us),
+                         -tab.integral_limit_us, tab.integral_limit_us)
+            derivative = np.where(first, 0, (error - last_error) * 1000000 // tab.period_us)
+            correction = (tab.kp[base] * error + tab.ki[base] * (i_us // 1000) // 1000
+                          + tab.kd[base] * derivative) >> fastcore.GAIN_SHIFT
+            cap = base * 3 // 10
+            correction = _clip(correction, -cap, cap)
+            np.copyto(integral, i_us, where=go)
+            np.copyto(last_error, error, where=go)
+            at = history_at + slot
+            previous = history.take(at)
+            total = history_sum - previous + correction
+            history.put(at, np.where(go, correction, previous))
+            np.copyto(history_sum, total, where=go)
+            np.copyto(slot, next_slot.take(slot), where=go)
+            smoothed = total // fastcore.SMOOTHING
+            limit = base * 3 // 2
+            left_cmd = _clip(base - smoothed, 0, limit) * direction
+            right_cmd = _clip(((base + smoothed) * tab.right_q10_move) >> fastcore.RIGHT_SHIFT,
+                              0, limit) * direction
+            np.copyto(command[:, 0], left_cmd, where=go)
+            np.copyto(command[:, 1], right_cmd, where=go)
+            motors_off &= ~go
+
+        # Turns (run_turn)
+        if in_turn.any():
+            moved = estimated[:, 0] + estimated[:, 1]
+            remaining = 2 * target - moved
+            done = in_turn & (remaining <= np.maximum(2, 2 * tab.coast(tab.turn_stop, rate)))
+            # A timed turn that got there early stops and waits out its time
+            waiting = done & timed & inside
+            exiting |= done & ~waiting
+            if waiting.any():
+                command[waiting] = 0
+                motors_off |= waiting
+            go = in_turn & ~done
+            speed = np.where(remaining > target, tab.max_turn,
+                             np.maximum(tab.max_turn * remaining // np.maximum(target, 1), tab.min_turn))
+            right_speed = speed
+            if (go & timed).any():
+                lag = np.where(inside, tab.profile[k] - moved, remaining)
+                feedforward = np.where(inside, tab.feedforward[k], 0)
+                timed_speed = _clip(feedforward + tab.timed_kp * lag,
+                                    np.where(lag > 0, tab.timed_min, 0), tab.max_motor)
+                speed = np.where(timed, timed_speed, speed)
+                right_speed = np.where(timed, (speed * right_q10) >> fastcore.RIGHT_SHIFT, speed)
+            sign = np.where(turning_left, 1, -1)
+            np.copyto(command[:, 0], -sign * speed, where=go)
+            np.copyto(command[:, 1], sign * right_speed, where=go)
+            motors_off &= ~go
+
+        # Arcs (run_arc)
+        if in_arc.any():
+            left, right = wheels[:, 0], wheels[:, 1]
+            diff = np.where(turning_left, right - left, left - right)
+            done = in_arc & (diff >= target)
+            exiting |= done
+            carry[done] = 0
+            go = in_arc & ~done
+            lag = arc_rate * (tick * tab.period_us // 1000) // 1000 - ((left + right) >> 1)
+            base = _clip(current["arc_base"] + ((tab.kx_q8 * lag + tab.kv_q8 * (arc_rate - rate))
+                                                >> fastcore.GAIN_SHIFT), 0, tab.max_base)
+            correction = (tab.arc_kp * (left * right_q10 - right * left_q10)) >> 10
+            right_base = (base * right_q10 >> 10) * tab.right_q10_move >> fastcore.RIGHT_SHIFT
+            np.copyto(command[:, 0], (base * left_q10 >> 10) - correction, where=go)
+            np.copyto(command[:, 1], right_base + correction, where=go)
+            motors_off &= ~go
+
+        # Segment exits: stop unless handing over, then pause unless chained
+        e = idx[exiting]
+        if len(e):
+            s = seg[e]
+            keep = tab.hand_over[s] | ((tab.kind[s] == 2) & tab.chain[s])
+            stop = e[~keep]
+            command[stop] = 0
+            motors_off[stop[tab.kind[seg[stop]] == 1]] = True  # turn() uses motors.off()
+            chained = tab.chain[s]
+            seg[e[chained]] += 1
+            entering[e[chained]] = True
+            phase[e[~chained]] = PAUSED
+            tick[e[~chained]] = 0
+            last = e[chained & (seg[e] >= tab.count)]
+            phase[last] = DONE
+            finish_tick[last] = total_ticks
+
+        # Pauses
+        p = idx[phase == PAUSED]
+        if len(p):
+            over = p[tick[p] >= tab.pause_ticks]
+            seg[over] += 1
+            entering[over] = True
+            phase[over] = RUNNING
+            finished = over[seg[over] >= tab.count]
+            phase[finished] = DONE
+            finish_tick[finished] = total_ticks
+
+        # Plant: first-order lag per wheel, integrated exactly over the period
+        level = 1 - sag * min(1.0, total_ticks * dt / nominal_s)
+        braking = np.abs(command) <= plant["deadband"]
+        target_v = command * drive
+        target_v *= level[:, None]
+        target_v[braking] = 0  # Also covers motors_off, which always comes with a zero command
+        mode = braking.astype(np.int8)
+        mode[motors_off] = 2
+        gap = velocity - target_v
+        travel = target_v * dt + gap * lag_gain.take(mode)
+        velocity = target_v + gap * decay.take(mode)
+        wheel_cm += travel
+        if noise["slip"]:
+            travel *= 1 + _noise(rng, (n, 2), noise["slip"])
+        ds = (travel[:, 0] + travel[:, 1]) / 2
+        dtheta = (travel[:, 1] - travel[:, 0]) / plant["track_width"]
+        mid = theta + dtheta / 2
+        x += ds * np.cos(mid)
+        y += ds * np.sin(mid)
+        theta += dtheta
+
+        tick += 1
+        total_ticks += 1
+
+    poses = modules["executor"].nominal_poses(route)
+    finished = finish_tick >= 0
+    return {
+        "x": x, "y": y, "heading": np.degrees(theta),
+        "time": np.where(finished, finish_tick * dt, np.nan), "finished": finished,
+        "nominal": (poses[-3], poses[-2], math.degrees(poses[-1])),
+    }
+
+
+def summary(result):
+    """Text table of the final pose error and route time distributions."""
+    nx, ny, nh = result["nominal"]
+    ok = result["finished"]
+    error = np.hypot(result["x"] - nx, result["y"] - ny)[ok]
+    heading = ((result["heading"] - nh + 180) % 360 - 180)[ok]
+    columns = (("pos err cm", error), ("x cm", result["x"][ok]), ("y cm", result["y"][ok]),
+               ("heading err", heading), ("time s", result["time"][ok]))
+    lines = [f"{ok.sum()} of {len(ok)} finished; nominal end ({nx:.1f}, {ny:.1f}, {nh:.1f} deg)",
+             f"{'':12s} {'mean':>9s} {'std':>9s} {'p5':>9s} {'p50':>9s} {'p95':>9s}"]
+    for name, values in columns:
+        if not len(values):
+            continue
+        p5, p50, p95 = np.percentile(values, (5, 50, 95))
+        lines.append(f"{name:12s} {values.mean():9.2f} {values.std():9.2f} {p5:9.2f} {p50:9.2f} {p95:9.2f}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-n", type=int, default=10000, help="robots per variant")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corner-radius", type=float, action="append",
+                        help="route variant with this corner radius (0 for spin turns); repeatable")
+    parser.add_argument("--no-chain", action="store_true", help="pause after every step")
+    for name, value in NOISE.items():
+        parser.add_argument("--" + name.replace("_", "-"), type=float, default=value)
+    args = parser.parse_args(argv)
+
+    noise = {name: getattr(args, name) for name in NOISE}
+    for radius in args.corner_radius or [None]:
+        wall = _host_time.perf_counter()
+        result = run(load_route(False if args.no_chain else None, radius), args.n, noise, seed=args.seed)
+        wall = _host_time.perf_counter() - wall
+        label = "as configured" if radius is None else f"corner radius {radius:g}"
+        print(f"== {label}: {args.n} runs in {wall:.1f}s")
+        print(summary(result))
+
+
+if __name__ == "__main__":
+    main()
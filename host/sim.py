@@ -0,0 +1,619 @@
+"""
+Host-side stand-in for the robot hardware.
+
+Installs fake `pololu_3pi_2040_robot.robot`, `machine` and `time` modules that
+are backed by a differential-drive model running on a virtual clock, so
+move(), turn() and the full main() sequence can run on a PC much faster than
+real time. Time only advances when the robot code sleeps or touches hardware,
+so runs are deterministic for a given seed.
+
+Example (from the repository root):
+
+    from host import sim
+    bot = sim.install()
+    move = sim.load("move")
+    move.move(50, 1.5)
+    print(bot.pose(), bot.now_s())
+
+or `python -m host.sim` to run the route in 1mainMove.py.
+"""
+
+import heapq
+import importlib
+import math
+import os
+import random
+import sys
+import time as _host_time
+import types
+
+# Modules that are imported from the robot side and must be reloaded whenever
+# a new simulated robot is installed (they bind hardware at import time).
+ROBOT_MODULES = []
+
+# Rough per-call costs in microseconds of virtual time. Tune against hardware.
+DEFAULT_COSTS = {
+    "show": 2500,  # full-frame display push
+    "text": 150,  # one framebuf text() call
+    "fill": 100,
+    "get_counts": 30,
+    "set_speeds": 40,
+    "pin": 1,  # one Pin.value() read, i.e. one iteration of a busy-wait
+    "button": 5,
+    "imu": 150,  # one gyro read over I2C
+    "adc": 2,
+}
+
+MAX_MOTOR_SPEED = 6000  # pololu Motors.set_speeds range
+
+
+class SimRobot:
+    """
+    Differential-drive model of the 3pi+ 2040 driven by a virtual clock.
+
+    Wheel speed follows the motor command through a first-order lag, with a
+    separate (slower) time constant when the motors are off and coasting.
+    `left_gain`/`right_gain` scale the command to model mismatched motors; the
+    default right gain mirrors the 1.075 correction used in move().
+    `ground_scale` is the ground travel per encoded cm of each wheel, e.g. a
+    worn tyre, which the encoders cannot see but the gyro can.
+    """
+
+    def __init__(self, seed=0, step_us=1000, wheel_diameter=3.235,
+                 counts_per_rotation=358.2, track_width=8.4,
+                 cmd_per_cm_s=39.0, deadband=60, left_gain=1.0,
+                 right_gain=1 / 1.075, drive_lag=0.05, brake_lag=0.02,
+                 coast_lag=0.03, encoder_noise=0.0, slip=0.0,
+                 ground_scale=(1.0, 1.0), gyro_bias=0.0, gyro_noise=0.0,
+                 gyro_rate_hz=833, imu=True, field=None, sensor_offset=4.0,
+                 range_noise=0.0, range_dropout=0.0, range_outlier=0.0,
+                 air_temperature=20.0, chip_heating=5.0,
+                 start_pose=(0.0, 0.0, 0.0), costs=None):
+        self.rng = random.Random(seed)
+        self.step_us = step_us
+        self.counts_per_cm = counts_per_rotation / (wheel_diameter * math.pi)
+        self.track_width = track_width
+        self.cmd_per_cm_s = cmd_per_cm_s
+        self.deadband = deadband
+        self.gain = [left_gain, right_gain]
+        self.drive_lag = drive_lag
+        self.brake_lag = brake_lag
+        self.coast_lag = coast_lag
+        self.encoder_noise = encoder_noise
+        self.slip = slip
+        self.ground_scale = ground_scale
+        self.gyro_bias = gyro_bias  # deg/s
+        self.gyro_noise = gyro_noise  # deg/s std per reading
+        self.gyro_period_us = int(1_000_000 / gyro_rate_hz)
+        self.imu = imu
+        self.field = field  # (xmin, ymin, xmax, ymax) walls in cm, or None
+        self.sensor_offset = sensor_offset
+        self.range_noise = range_noise
+        self.range_dropout = range_dropout  # Chance a ping gets no echo at all
+        self.range_outlier = range_outlier  # Chance of a stray echo at a random distance
+        self.air_temperature = air_temperature  # C, sets the speed of sound
+        self.chip_heating = chip_heating  # How much warmer the RP2040 runs than the air
+        self.costs = dict(DEFAULT_COSTS)
+        if costs:
+            self.costs.update(costs)
+
+        self.now_us = 0
+        self._events = []
+        self._event_seq = 0
+        self._in_event = False  # interrupt handlers run in zero virtual time
+
+        self.x, self.y, self.theta = start_pose
+        self.command = [0, 0]
+        self.motors_off = True
+        self.velocity = [0.0, 0.0]  # cm/s per wheel
+        self.yaw_rate = 0.0  # rad/s, low-pass filtered over one gyro output period like the chip's filter
+        self.wheel_cm = [0.0, 0.0]  # distance measured at the encoder
+        self.encoder_offset = [0, 0]
+        self.pins = {}
+        self.buttons = {"A": [], "B": [], "C": []}
+        self.frames = []  # every frame pushed with Display.show()
+        self.stats = {"show": 0, "set_speeds": 0, "get_counts": 0}
+
+    # ----- clock -----
+    def now_s(self):
+        return self.now_us / 1_000_000
+
+    def schedule(self, at_us, callback):
+        """Run callback() when the virtual clock reaches at_us."""
+        self._event_seq += 1
+        heapq.heappush(self._events, (at_us, self._event_seq, callback))
+
+    def advance(self, us):
+        """Advance the virtual clock by us microseconds, stepping the model."""
+        end = self.now_us + max(0, int(us))
+        while self.now_us < end:
+            next_stop = min(end, self.now_us + self.step_us)
+            if self._events and self._events[0][0] < next_stop:
+                next_stop = max(self.now_us, self._events[0][0])
+            self._step((next_stop - self.now_us) / 1_000_000)
+            self.now_us = next_stop
+            while self._events and self._events[0][0] <= self.now_us:
+                callback = heapq.heappop(self._events)[2]
+                self._in_event = True
+                try:
+                    callback()
+                finally:
+                    self._in_event = False
+
+    def cost(self, name):
+        if not self._in_event:
+            self.advance(self.costs.get(name, 0))
+
+    # ----- model -----
+    def _step(self, dt):
+        if dt <= 0:
+            return
+        for i in (0, 1):
+            cmd = self.command[i]
+            if self.motors_off:
+                target, lag = 0.0, self.coast_lag
+            elif abs(cmd) <= self.deadband:
+                target, lag = 0.0, self.brake_lag
+            else:
+                target, lag = self.gain[i] * cmd / self.cmd_per_cm_s, self.drive_lag
+            self.velocity[i] += (target - self.velocity[i]) * min(1.0, dt / lag)
+
+        left, right = (v * dt for v in self.velocity)
+        self.wheel_cm[0] += left
+        self.wheel_cm[1] += right
+        left *= self.ground_scale[0]
+        right *= self.ground_scale[1]
+        if self.slip:
+            # Ground travel differs from what the encoders see
+            left *= 1 + self.rng.gauss(0, self.slip)
+            right *= 1 + self.rng.gauss(0, self.slip)
+        ds = (left + right) / 2
+        dtheta = (right - left) / self.track_width
+        mid = self.theta + dtheta / 2
+        self.x += ds * math.cos(mid)
+        self.y += ds * math.sin(mid)
+        self.theta += dtheta
+        self.yaw_rate += (dtheta / dt - self.yaw_rate) * min(1.0, dt * 1_000_000 / self.gyro_period_us)
+
+    def set_command(self, left, right):
+        self.command = [max(-MAX_MOTOR_SPEED, min(MAX_MOTOR_SPEED, left)),
+                        max(-MAX_MOTOR_SPEED, min(MAX_MOTOR_SPEED, right))]
+        self.motors_off = False
+
+    def raw_counts(self):
+        counts = []
+        for i in (0, 1):
+            c = self.wheel_cm[i] * self.counts_per_cm
+            if self.encoder_noise:
+                c += self.rng.gauss(0, self.encoder_noise)
+            counts.append(int(round(c)))
+        return counts
+
+    def gyro_dps(self):
+        """Yaw rate (deg/s, positive = left) as the gyro reports it."""
+        rate = math.degrees(self.yaw_rate) + self.gyro_bias
+        if self.gyro_noise:
+            rate += self.rng.gauss(0, self.gyro_noise)
+        return rate
+
+    def pose(self):
+        """Return (x_cm, y_cm, heading_deg) of the wheel axle centre."""
+        return self.x, self.y, math.degrees(self.theta)
+
+    def range_cm(self):
+        """Distance from the ultrasonic sensor to the field wall it faces."""
+        if self.field is None:
+            return None
+        xmin, ymin, xmax, ymax = self.field
+        c, s = math.cos(self.theta), math.sin(self.theta)
+        sx = self.x + self.sensor_offset * c
+        sy = self.y + self.sensor_offset * s
+        hits = []
+        if c > 1e-9:
+            hits.append((xmax - sx) / c)
+        elif c < -1e-9:
+            hits.append((xmin - sx) / c)
+        if s > 1e-9:
+            hits.append((ymax - sy) / s)
+        elif s < -1e-9:
+            hits.append((ymin - sy) / s)
+        d = min(hits)
+        if self.range_noise:
+            d += self.rng.gauss(0, self.range_noise)
+        return max(d, 0.0)
+
+    # ----- inputs -----
+    def press(self, button, at_s, duration_s=0.2):
+        """Schedule a button press (button is "A", "B" or "C")."""
+        start = int(at_s * 1_000_000)
+        self.buttons[button].append((start, start + int(duration_s * 1_000_000)))
+
+    def button_pressed(self, button):
+        return any(a <= self.now_us < b for a, b in self.buttons[button])
+
+
+# HC-SR04 timing: echo goes high ~450 us after the trigger, and a pulse with no
+# target stays high for ~38 ms.
+ECHO_DELAY_US = 450
+ECHO_NO_TARGET_US = 38000
+SPEED_OF_SOUND_CM_US = 0.0343  # At 20 C
+SOUND_PER_C = 0.606 / 343.4  # Relative change per degree
+TRIG_PIN = 27
+ECHO_PIN = 28
+
+
+class _PinState:
+    def __init__(self, pin_id):
+        self.id = pin_id
+        self.level = 0
+        self.rise_us = 0
+        self.handler = None
+        self.trigger = 0
+        self.pin = None
+
+
+def _make_machine(bot):
+    machine = types.ModuleType("machine")
+
+    class Pin:
+        IN = 0
+        OUT = 1
+        OPEN_DRAIN = 2
+        PULL_UP = 1
+        PULL_DOWN = 2
+        IRQ_FALLING = 4
+        IRQ_RISING = 8
+
+        def __init__(self, pin_id, mode=-1, pull=-1, value=None):
+            self._state = bot.pins.setdefault(pin_id, _PinState(pin_id))
+            if value is not None:
+                self._state.level = 1 if value else 0
+
+        def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+            self._state.handler = handler
+            self._state.trigger = trigger
+            self._state.pin = self
+
+        def value(self, v=None):
+            state = self._state
+            if v is None:
+                bot.cost("pin")
+                return state.level
+            level = 1 if v else 0
+            if state.id == TRIG_PIN and state.level and not level:
+                if bot.now_us - state.rise_us >= 10:
+                    _start_echo(bot)
+            if level and not state.level:
+                state.rise_us = bot.now_us
+            state.level = level
+            return None
+
+        def on(self):
+            self.value(1)
+
+        def off(self):
+            self.value(0)
+
+        def __call__(self, v=None):
+            return self.value(v)
+
+    class Timer:
+        ONE_SHOT = 0
+        PERIODIC = 1
+
+        def __init__(self, id=-1, **kwargs):
+            self._generation = 0
+            if kwargs:
+                self.init(**kwargs)
+
+        def init(self, mode=PERIODIC, period=-1, freq=-1, callback=None):
+            self._generation += 1
+            period_us = int(1_000_000 / freq) if freq > 0 else period * 1000
+            generation = self._generation
+
+            def fire():
+                if generation != self._generation:
+                    return  # deinit() or re-init() since this was scheduled
+                if mode == Timer.PERIODIC:
+                    bot.schedule(bot.now_us + period_us, fire)
+                callback(self)
+
+            bot.schedule(bot.now_us + period_us, fire)
+
+        def deinit(self):
+            self._generation += 1
+
+    class ADC:
+        def __init__(self, channel):
+            self.channel = channel
+
+        def read_u16(self):
+            bot.cost("adc")
+            if self.channel != 4:
+                return 0
+            # RP2040 temperature sensor: 0.706 V at 27 C, -1.721 mV per degree
+            volts = 0.706 - 0.001721 * (bot.air_temperature + bot.chip_heating - 27)
+            return int(volts / 3.3 * 65535 + 0.5)
+
+    machine.Pin = Pin
+    machine.Timer = Timer
+    machine.ADC = ADC
+    machine.freq = lambda *a: 125_000_000
+    return machine
+
+
+def _set_level(bot, pin_id, level):
+    state = bot.pins.setdefault(pin_id, _PinState(pin_id))
+    if state.level == level:
+        return
+    state.level = level
+    edge = 8 if level else 4  # Pin.IRQ_RISING / Pin.IRQ_FALLING
+    if state.handler is not None and state.trigger & edge:
+        state.handler(state.pin)
+
+
+def _start_echo(bot):
+    distance = bot.range_cm()
+    if bot.range_dropout and bot.rng.random() < bot.range_dropout:
+        distance = None
+    elif bot.range_outlier and bot.rng.random() < bot.range_outlier:
+        distance = bot.rng.uniform(3, 300)
+    if distance is None or distance > 400:
+        width = ECHO_NO_TARGET_US
+    else:
+        speed = SPEED_OF_SOUND_CM_US * (1 + SOUND_PER_C * (bot.air_temperature - 20))
+        width = int(2 * distance / speed)
+    rise = bot.now_us + ECHO_DELAY_US
+    bot.schedule(rise, lambda: _set_level(bot, ECHO_PIN, 1))
+    bot.schedule(rise + width, lambda: _set_level(bot, ECHO_PIN, 0))
+
+
+def _make_time(bot):
+    t = types.ModuleType("time")
+    t.ticks_us = lambda: bot.now_us
+    t.ticks_ms = lambda: bot.now_us // 1000
+    t.ticks_cpu = lambda: bot.now_us
+    t.ticks_diff = lambda a, b: a - b
+    t.ticks_add = lambda a, b: a + b
+    t.sleep = lambda s: bot.advance(s * 1_000_000)
+    t.sleep_ms = lambda ms: bot.advance(ms * 1000)
+    t.sleep_us = lambda us: bot.advance(us)
+    t.time = lambda: bot.now_us // 1_000_000
+    t.time_ns = lambda: bot.now_us * 1000
+    return t
+
+
+def _make_robot(bot):
+    mod = types.ModuleType("pololu_3pi_2040_robot.robot")
+
+    class Motors:
+        def set_speeds(self, left, right):
+            bot.cost("set_speeds")
+            bot.stats["set_speeds"] += 1
+            bot.set_command(left, right)
+
+        def set_left_speed(self, speed):
+            self.set_speeds(speed, bot.command[1])
+
+        def set_right_speed(self, speed):
+            self.set_speeds(bot.command[0], speed)
+
+        def off(self):
+            bot.cost("set_speeds")
+            bot.command = [0, 0]
+            bot.motors_off = True
+
+    class Encoders:
+        def get_counts(self, reset=False):
+            bot.cost("get_counts")
+            bot.stats["get_counts"] += 1
+            raw = bot.raw_counts()
+            counts = (raw[0] - bot.encoder_offset[0], raw[1] - bot.encoder_offset[1])
+            if reset:
+                bot.encoder_offset = raw
+            return counts
+
+    class Display:
+        width = 128
+        height = 64
+
+        def __init__(self):
+            self.rows = {}
+
+        def fill(self, color):
+            bot.cost("fill")
+            self.rows = {}
+
+        def fill_rect(self, x, y, w, h, color):
+            for row in list(self.rows):
+                if y <= row < y + h:
+                    del self.rows[row]
+
+        def text(self, s, x, y, color=1):
+            bot.cost("text")
+            self.rows[y] = str(s)
+
+        def rect(self, *args):
+            pass
+
+        def hline(self, *args):
+            pass
+
+        def vline(self, *args):
+            pass
+
+        def line(self, *args):
+            pass
+
+        def pixel(self, *args):
+            pass
+
+        def show(self):
+            bot.cost("show")
+            bot.stats["show"] += 1
+            bot.frames.append((bot.now_us, [self.rows[y] for y in sorted(self.rows)]))
+
+        def lines(self):
+            return [self.rows[y] for y in sorted(self.rows)]
+
+    def _button(name):
+        class Button:
+            def is_pressed(self):
+                bot.cost("button")
+                return bot.button_pressed(name)
+
+        Button.__name__ = "Button" + name
+        return Button
+
+    class YellowLED:
+        def __init__(self):
+            self.state = 0
+
+        def value(self, v=None):
+            if v is None:
+                return self.state
+            self.state = 1 if v else 0
+
+        def on(self):
+            self.state = 1
+
+        def off(self):
+            self.state = 0
+
+    class Gyro:
+        def __init__(self):
+            self.last_reading_dps = (0.0, 0.0, 0.0)
+            self.read_us = -bot.gyro_period_us
+
+        def data_ready(self):
+            return bot.now_us - self.read_us >= bot.gyro_period_us
+
+        def read(self):
+            bot.cost("imu")
+            self.read_us = bot.now_us
+            self.last_reading_dps = (0.0, 0.0, bot.gyro_dps())
+
+    class IMU:
+        def __init__(self):
+            if not bot.imu:
+                raise OSError(19)  # ENODEV, as when the I2C device does not answer
+            self.gyro = Gyro()
+
+        def reset(self):
+            pass
+
+        def enable_default(self):
+            pass
+
+    mod.Motors = Motors
+    mod.Encoders = Encoders
+    mod.Display = Display
+    mod.ButtonA = _button("A")
+    mod.ButtonB = _button("B")
+    mod.ButtonC = _button("C")
+    mod.YellowLED = YellowLED
+    mod.IMU = IMU
+    return mod
+
+
+_current = None
+_fake_time = None
+
+
+def install(**kwargs):
+    """
+    Create a simulated robot and install the fake hardware modules.
+
+    Keyword arguments are passed to SimRobot. Robot modules loaded for a
+    previous simulator are dropped so they rebind to the new hardware.
+    """
+    global _current, _fake_time
+    bot = SimRobot(**kwargs)
+    package = types.ModuleType("pololu_3pi_2040_robot")
+    package.robot = _make_robot(bot)
+    sys.modules["pololu_3pi_2040_robot"] = package
+    sys.modules["pololu_3pi_2040_robot.robot"] = package.robot
+    sys.modules["machine"] = _make_machine(bot)
+    for name in ROBOT_MODULES:
+        sys.modules.pop(name, None)
+    del ROBOT_MODULES[:]
+    _current = bot
+    _fake_time = _make_time(bot)
+    load("hw").autostart = False  # Scripts are imported for their functions, not booted
+    return bot
+
+
+def load(name):
+    """
+    Import robot module `name` (e.g. "move", "1mainMove") against the simulator.
+
+    The fake `time` module is only visible while the import runs, so the host's
+    own libraries keep the real one.
+    """
+    if _current is None:
+        raise RuntimeError("call sim.install() first")
+    host_time = sys.modules["time"]
+    sys.modules["time"] = _fake_time
+    try:
+        module = importlib.import_module(name)
+    finally:
+        sys.modules["time"] = host_time
+    for loaded in list(sys.modules):
+        if loaded not in ROBOT_MODULES and _is_robot_module(sys.modules[loaded]):
+            ROBOT_MODULES.append(loaded)
+    return module
+
+
+_ROBOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _is_robot_module(module):
+    # Robot modules bind the fake time, or keep state of their own (e.g. coast.py's
+    # learned table) that must not leak from one simulated robot into the next
+    if getattr(module, "time", None) is _fake_time:
+        return True
+    path = getattr(module, "__file__", None)
+    return path is not None and os.path.dirname(os.path.abspath(path)) == _ROBOT_DIR
+
+
+def current():
+    return _current
+
+
+def run_route(telemetry_file=None, coast_file=None, **kwargs):
+    """
+    Run 1mainMove.py on a fresh simulator the way its boot code does, up to
+    button A being pressed, and return the robot. The boot code itself waits
+    for the buttons, so this repeats its steps: load the coast table and the
+    route, hw.ready(), the gyro bias and the ultrasound temperature, then
+    hw.mark_start() and main().
+
+    The learned coast table is only loaded and saved, and the telemetry dump
+    only written, if coast_file and telemetry_file are given.
+    """
+    bot = install(**kwargs)
+    main = load("1mainMove")
+    main.telemetry_file = telemetry_file
+    main.coast_file = coast_file
+    main.check_hot_path()
+    if coast_file:
+        main.coast.load(coast_file)
+    route = main.load_route()
+    main.hw.ready()
+    main.gyro.estimate_bias(1000)
+    main.ranging.set_temperature(main.hw.temperature_c())
+    main.hw.mark_start()
+    main.gyro.estimate_bias(500)
+    main.main(route)
+    return bot
+
+
+if __name__ == "__main__":
+    wall_start = _host_time.perf_counter()
+    bot = run_route()
+    wall = _host_time.perf_counter() - wall_start
+    x, y, heading = bot.pose()
+    print(f"final pose: x={x:.1f}cm y={y:.1f}cm heading={heading:.1f}deg")
+    print(f"virtual time: {bot.now_s():.3f}s  wall time: {wall:.2f}s")
+    if bot.frames:
+        print("display:", " | ".join(bot.frames[-1][1]))
@@ -0,0 +1,205 @@
+"""
+Parallel parameter sweep over simulated full runs.
+
+Every sample sets tuning parameters on the real robot modules, runs main()
+from 1mainMove.py against host/sim.py and scores the result by how far the
+robot ends from the planned end point and how far the displayed time is from
+target_time. Samples are spread over a process pool, one simulator per worker.
+
+Example (from the repository root):
+
+    python -m host.sweep --grid kp_base=10,20,30 kd_base=5,10,20
+    python -m host.sweep --random 200 kp_base=10:40 ki_base=0:2 --seeds 3
+    python -m host.sweep --random 100 --refine 3 kp_base=10:40 kd_base=0:30
+
+Parameters (see PARAMETERS) are set on move.py or turn.py by name; a grid takes
+comma-separated values, random sampling takes low:high ranges. --refine runs
+further rounds that resample around the best samples so far with shrinking
+ranges (a cross-entropy search).
+"""
+
+import argparse
+import csv
+import itertools
+import math
+import multiprocessing
+import os
+import random
+import re
+
+from host import sim
+
+# Tunable name -> module it lives in
+PARAMETERS = {
+    "kp_base": "move",
+    "ki_base": "move",
+    "kd_base": "move",
+    "integral_limit": "move",
+    "reference_speed": "move",
+    "min_speed": "move",
+    "track_kx": "move",
+    "track_kv": "move",
+    "max_base_speed": "move",
+    "TIMED_TURN_KP": "turn",
+    "TIMED_MIN_SPEED": "turn",
+    # Untimed turns only: the default route times its turns (timed_turns in 1mainMove.py),
+    # so these only change anything with timed_turns = False
+    "MAX_TURN_SPEED": "turn",
+    "MIN_TURN_SPEED": "turn",
+}
+
+INTEGER = {"max_base_speed", "TIMED_TURN_KP", "TIMED_MIN_SPEED", "MAX_TURN_SPEED",
+           "MIN_TURN_SPEED"}  # Used in integer loop math
+
+FIELD = (-37, -500, 1000, 500)  # Walls that put the final ultrasound reading in range
+TIME_WEIGHT = 10  # cm of position error that count as much as 1 s of time error
+DEFAULT_NOISE = {"encoder_noise": 0.3, "slip": 0.01}
+
+
+def target_point(main, route, field=FIELD):
+    """
+    Where a perfect robot ends: the planned end of the route, then the final
+    approach main() would compute from an exact ultrasound reading there.
+    """
+    executor = main.executor
+    poses = executor.nominal_poses(route)
+    x, y, theta = poses[-3], poses[-2], poses[-1]
+    probe = sim.SimRobot(field=field, start_pose=(x, y, theta))
+    approach = main.ranging.to_true_cm(probe.range_cm()) + 0.3175 - 173.5
+    return x + approach * math.cos(theta), y + approach * math.sin(theta)
+
+
+def _displayed_time(bot):
+    for _, lines in reversed(bot.frames):
+        for line in lines:
+            match = re.match(r"time: ([-\d.]+)s", line)
+            if match:
+                return float(match.group(1))
+    return math.nan
+
+
+def evaluate(params, seed=0, noise=None, field=FIELD):
+    """
+    Run main() once with params (name -> value) on a fresh simulator.
+    Returns (position error cm, time deviation s).
+    """
+    bot = sim.install(seed=seed, field=field, **(noise or {}))
+    main = sim.load("1mainMove")
+    main.telemetry_file = None
+    modules = {"move": sim.load("move"), "turn": sim.load("turn")}
+    for name, value in params.items():
+        setattr(modules[PARAMETERS[name]], name, round(value) if name in INTEGER else value)
+    if "min_speed" in params:
+        main.executor.min_speed_cm_s = 2 * params["min_speed"]
+
+    route = main.load_route()
+    target = target_point(main, route, field)
+    main.main(route)
+    x, y, _ = bot.pose()
+    return math.hypot(x - target[0], y - target[1]), _displayed_time(bot) - main.target_time
+
+
+def _evaluate_sample(job):
+    params, seeds, noise = job
+    errors = [evaluate(params, seed, noise) for seed in range(seeds)]
+    position = sum(e[0] for e in errors) / seeds
+    timing = sum(abs(e[1]) for e in errors) / seeds
+    return params, position, timing, position + TIME_WEIGHT * timing
+
+
+def run(samples, seeds=1, noise=None, processes=None):
+    """
+    Evaluate every params dict in samples in parallel, each averaged over seeds.
+    Returns (params, position error, |time deviation|, score) rows, best first.
+    """
+    jobs = [(params, seeds, noise) for params in samples]
+    with multiprocessing.Pool(processes) as pool:
+        rows = pool.map(_evaluate_sample, jobs, chunksize=1)
+    return sorted(rows, key=lambda row: row[3])
+
+
+def grid(spec):
+    """All combinations of {name: [values]}."""
+    names = list(spec)
+    return [dict(zip(names, values)) for values in itertools.product(*(spec[n] for n in names))]
+
+
+def random_samples(ranges, count, rng):
+    """count samples drawn uniformly from {name: (low, high)}."""
+    return [{name: rng.uniform(low, high) for name, (low, high) in ranges.items()}
+            for _ in range(count)]
+
+
+def refine(rows, ranges, count, rng, elite=0.2):
+    """
+    Resample around the best rows: per parameter, a normal distribution with the
+    mean and spread of the elite samples, clipped to the original range.
+    """
+    best = [row[0] for row in rows[:max(2, int(len(rows) * elite))]]
+    samples = []
+    for _ in range(count):
+        sample = {}
+        for name, (low, high) in ranges.items():
+            values = [params[name] for params in best]
+            mean = sum(values) / len(values)
+            spread = math.sqrt(sum((v - mean) ** 2 for v in values) / len(values)) or (high - low) / 20
+            sample[name] = min(high, max(low, rng.gauss(mean, spread)))
+        samples.append(sample)
+    return samples
+
+
+def _parse(specs, ranged):
+    parsed = {}
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        if name not in PARAMETERS:
+            raise SystemExit(f"unknown parameter {name!r}; choose from {', '.join(PARAMETERS)}")
+        if ranged:
+            low, _, high = values.partition(":")
+            parsed[name] = (float(low), float(high))
+        else:
+            parsed[name] = [float(v) for v in values.split(",")]
+    return parsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("params", nargs="+", help="name=v1,v2,... (grid) or name=low:high (random)")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--grid", action="store_true", help="evaluate every combination")
+    mode.add_argument("--random", type=int, metavar="N", help="evaluate N random samples")
+    parser.add_argument("--refine", type=int, default=0, metavar="ROUNDS",
+                        help="with --random, resample around the best samples this many times")
+    parser.add_argument("--seeds", type=int, default=1, help="simulator seeds per sample")
+    parser.add_argument("--clean", action="store_true", help="no encoder noise or wheel slip")
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--top", type=int, default=10, help="rows to print")
+    parser.add_argument("--csv", help="write every row to this file")
+    args = parser.parse_args(argv)
+
+    noise = None if args.clean else DEFAULT_NOISE
+    if args.grid:
+        rows = run(grid(_parse(args.params, False)), args.seeds, noise, args.processes)
+    else:
+        ranges = _parse(args.params, True)
+        rng = random.Random(0)
+        rows = run(random_samples(ranges, args.random, rng), args.seeds, noise, args.processes)
+        for _ in range(args.refine):
+            more = run(refine(rows, ranges, args.random, rng), args.seeds, noise, args.processes)
+            rows = sorted(rows + more, key=lambda row: row[3])
+
+    names = list(rows[0][0]) if rows else []
+    print(" ".join(f"{n:>15s}" for n in names) + "   pos cm  |dt| s   score")
+    for params, position, timing, score in rows[:args.top]:
+        print(" ".join(f"{params[n]:15.4g}" for n in names)
+              + f" {position:8.2f} {timing:7.3f} {score:7.2f}")
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(names + ["position_cm", "time_s", "score"])
+            for params, position, timing, score in rows:
+                writer.writerow([params[n] for n in names] + [position, timing, score])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+System identification from recorded runs.
+
+Fits the calibration constants in constants.py from telemetry dumps (see
+telemetry.py and host/telemetry.py) and writes a new constants.py:
+
+- per-wheel motor models: first-order lag with a deadband, from the commanded
+  and measured wheel speeds of consecutive loop samples
+- the right-wheel factor, from the ratio of the two motor gains
+- the turn fudges, from ground truth measured by hand, since the encoders
+  cannot see wheel slip
+- the ultrasound correction table, from test.py's calibration captures (see
+  host/ultrasound.py) or from distances measured by hand
+
+Example (from the repository root):
+
+    python -m host.sysid run1.bin run2.bin --truth truth.json -o constants.py
+    python -m host.sysid run1.bin --ultrasound ultrasound.txt -o constants.py
+
+truth.json is optional and may hold either list:
+
+    {"turns": [[requested_deg, measured_deg], ...],
+     "ultrasound": [[reading_cm, true_cm], ...]}
+
+Turns must have been run with the fudges currently in constants.py.
+Constants that have no data keep their current value, so e.g.
+
+    python -m host.sysid --ultrasound ultrasound.txt -o constants.py
+
+only refits the ultrasound table.
+"""
+
+import argparse
+import datetime
+import json
+
+import numpy as np
+
+import constants as current
+import odometry
+from host import telemetry, ultrasound
+
+CM_PER_COUNT = odometry.CM_PER_COUNT
+
+
+def wheel_samples(traces):
+    """
+    Per-wheel samples over all loop samples of all traces, for fit_motor(): the
+    command at sample k and the two before it, the mean wheel speed (cm/s) over the
+    period from k-2 to k-1 and over the period from k to k+1, and the period (s).
+    Speeds come from count differences inside each segment. The two speeds share
+    no encoder reading, so their read noise is independent.
+    Returns ((cmd, cmd_1, cmd_2, v_before, v_after, dt) left, (...) right).
+    """
+    out = [tuple([] for _ in range(6)) for _ in range(2)]
+    for trace in traces:
+        t = trace["t_us"] / 1e6
+        for _, a, b in telemetry.segments(trace):
+            if b - a < 5:
+                continue
+            dt = np.diff(t[a:b])
+            for wheel, (counts, cmd) in enumerate((("left", "left_cmd"), ("right", "right_cmd"))):
+                v = np.diff(trace[counts][a:b]) * CM_PER_COUNT / dt  # v[i]: sample a+i to a+i+1
+                u = trace[cmd][a:b]
+                n = b - a - 3  # k runs over a+2 .. b-2
+                columns = (u[2:2 + n], u[1:1 + n], u[:n], v[:n], v[2:2 + n], dt[2:2 + n])
+                for column, values in zip(out[wheel], columns):
+                    column.append(values)
+    return [tuple(np.concatenate(x) if x else np.zeros(0) for x in wheel) for wheel in out]
+
+
+def fit_motor(cmd, cmd_1, cmd_2, v_before, v_after, dt):
+    """
+    Least-squares fit of a first-order lag, speed' = (gain * (cmd - deadband * sign(cmd))
+    - speed) / tau, to mean speeds over periods (see wheel_samples()). With the
+    command held over each period the means obey
+    v_after = alpha^2 * v_before + p * cmd + q * cmd_1 + s * cmd_2 + r * sign(cmd),
+    with alpha = exp(-dt / tau) and p + q + s = (1 - alpha^2) * gain.
+    Only samples with the motor driven throughout are used. A motor cannot drive
+    with less than no command, so a negative deadband is clamped to 0 and the
+    gain and tau are refit without it.
+    Returns (gain cm/s per unit, tau s, deadband units, rms residual cm/s), or None.
+    """
+    driven = (cmd != 0) & (cmd_1 != 0) & (cmd_2 != 0)
+    if np.count_nonzero(driven) < 10:
+        return None
+    design = np.column_stack((v_before, cmd, cmd_1, cmd_2, np.sign(cmd)))[driven]
+    coefficients, *_ = np.linalg.lstsq(design, v_after[driven], rcond=None)
+    alpha2, p, q, s, r = coefficients
+    if r > 0 and p + q + s > 0:
+        design = design[:, :4]
+        coefficients, *_ = np.linalg.lstsq(design, v_after[driven], rcond=None)
+        (alpha2, p, q, s), r = coefficients, 0.0
+    total = p + q + s
+    if not 0 < alpha2 < 1 or total <= 0:
+        return None
+    tau = -2 * np.mean(dt[driven]) / np.log(alpha2)
+    gain = total / (1 - alpha2)
+    deadband = max(0.0, -r / total)
+    rms = float(np.sqrt(np.mean((design @ coefficients - v_after[driven]) ** 2)))
+    return float(gain), float(tau), float(deadband), rms
+
+
+def fit_turn_fudges(pairs, previous=(current.TURN_FUDGE_LEFT, current.TURN_FUDGE_RIGHT)):
+    """
+    New (left, right) fudges from (requested, measured) turns run with the previous
+    fudges: each moves by the mean shortfall of its direction.
+    """
+    pairs = np.asarray(pairs, dtype=float).reshape(-1, 2)
+    fudges = list(previous)
+    for i, side in enumerate((pairs[:, 0] > 0, pairs[:, 0] < 0)):
+        if np.any(side):
+            fudges[i] = float(previous[i] + np.mean(pairs[side, 0] - pairs[side, 1]))
+    return tuple(fudges)
+
+
+def identify(traces, truth=None, captures=None):
+    """
+    Fit everything from decoded traces, optional ground truth and optional
+    ultrasound captures (positions decoded by host/ultrasound.py).
+    Returns (values, notes): values maps the constants.py names to their new
+    values, notes is a list of lines describing the fits.
+    """
+    truth = truth or {}
+    notes = [f"{len(traces)} run(s)"]
+    values = {
+        "RIGHT_WHEEL_FACTOR": current.RIGHT_WHEEL_FACTOR,
+        "TURN_FUDGE_LEFT": current.TURN_FUDGE_LEFT,
+        "TURN_FUDGE_RIGHT": current.TURN_FUDGE_RIGHT,
+        "ULTRASOUND_TABLE": tuple(current.ULTRASOUND_TABLE),
+        "ULTRASOUND_TEMPERATURE_C": current.ULTRASOUND_TEMPERATURE_C,
+        "LEFT_MOTOR": tuple(current.LEFT_MOTOR),
+        "RIGHT_MOTOR": tuple(current.RIGHT_MOTOR),
+    }
+
+    if traces:
+        models = []
+        for name, samples in zip(("LEFT_MOTOR", "RIGHT_MOTOR"), wheel_samples(traces)):
+            model = fit_motor(*samples)
+            models.append(model)
+            if model is None:
+                notes.append(f"{name}: not enough samples, kept")
+                continue
+            gain, tau, deadband, rms = model
+            values[name] = (gain, tau, deadband)
+            notes.append(f"{name}: {len(samples[0])} samples, rms {rms:.1f} cm/s")
+        if all(models):
+            values["RIGHT_WHEEL_FACTOR"] = models[0][0] / models[1][0]
+    else:
+        notes.append("motors, RIGHT_WHEEL_FACTOR: no runs, kept")
+
+    if truth.get("turns"):
+        values["TURN_FUDGE_LEFT"], values["TURN_FUDGE_RIGHT"] = fit_turn_fudges(truth["turns"])
+        notes.append(f"TURN_FUDGE_*: {len(truth['turns'])} measured turns")
+    if captures:
+        positions, source = captures, "captured positions"
+    else:
+        positions, source = ultrasound.from_pairs(truth.get("ultrasound", [])), "measured distances"
+    if positions:
+        table, reference_c, rows = ultrasound.fit(positions)
+        values["ULTRASOUND_TABLE"] = table
+        values["ULTRASOUND_TEMPERATURE_C"] = reference_c
+        errors = np.array([fitted - true for true, _, _, _, fitted in rows])
+        notes.append(f"ULTRASOUND_TABLE: {len(positions)} {source}, "
+                     f"rms {np.sqrt(np.nanmean(errors ** 2)):.1f} mm")
+    return values, notes
+
+
+def _format(value):
+    if value is None:
+        return "None"
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, tuple):
+        return "(" + ", ".join(_format(v) for v in value) + ")"
+    return f"{value:.6g}"
+
+
+def render(values, notes):
+    """Text of a generated constants.py."""
+    lines = [
+        "# Calibration constants.",
+        f"# Generated by host/sysid.py on {datetime.date.today().isoformat()}; "
+        "regenerate rather than edit.",
+    ]
+    lines += [f"#   {note}" for note in notes]
+    lines += [
+        "",
+        "# Right motor is weaker; its command is scaled up by this",
+        f"RIGHT_WHEEL_FACTOR = {_format(values['RIGHT_WHEEL_FACTOR'])}",
+        "",
+        "# Degrees added to every requested turn: left (positive) and right (negative) turns",
+        f"TURN_FUDGE_LEFT = {_format(values['TURN_FUDGE_LEFT'])}",
+        f"TURN_FUDGE_RIGHT = {_format(values['TURN_FUDGE_RIGHT'])}",
+        "",
+        "# Ultrasound correction: (first, shift, points), the true distance in mm at echo widths",
+        "# first + i * 2**shift us, linear in between and extended past both ends.",
+        "# Fit from test.py's calibration mode with `python -m host.sysid --ultrasound`",
+        f"ULTRASOUND_TABLE = {_format(values['ULTRASOUND_TABLE'])}",
+        "# Chip temperature (C, from hw.temperature_c()) the table was measured at; widths",
+        "# are scaled by the speed of sound from there. None: no temperature compensation",
+        f"ULTRASOUND_TEMPERATURE_C = {_format(values['ULTRASOUND_TEMPERATURE_C'])}",
+        "",
+        "# Per-wheel motor response: (cm/s per motor unit, time constant s, deadband motor units)",
+        f"LEFT_MOTOR = {_format(values['LEFT_MOTOR'])}",
+        f"RIGHT_MOTOR = {_format(values['RIGHT_MOTOR'])}",
+        "",
+    ]
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("dumps", nargs="*", help="telemetry dumps or serial captures")
+    parser.add_argument("--truth", help="JSON file with measured turns and ultrasound distances")
+    parser.add_argument("--ultrasound", nargs="+", default=[],
+                        help="ultrasound calibration captures from test.py")
+    parser.add_argument("--start-cm", type=float,
+                        help="distance to the wall at the first captured position, if not the one in the capture")
+    parser.add_argument("-o", "--output", help="write constants.py here (default: print it)")
+    args = parser.parse_args(argv)
+
+    traces = [telemetry.load(path) for path in args.dumps]
+    truth = None
+    if args.truth:
+        with open(args.truth) as f:
+            truth = json.load(f)
+    captures = [p for path in args.ultrasound for p in ultrasound.load(path, args.start_cm)]
+    text = render(*identify(traces, truth, captures))
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text, end="")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Decoder for the binary telemetry dumps written by telemetry.py on the robot.
+
+Accepts either the file written by telemetry.dump() (copied off the robot with
+e.g. `mpremote cp :telemetry.bin .`) or a capture of the USB serial output of
+telemetry.dump_serial(). Example (from the repository root):
+
+    from host import telemetry
+    trace = telemetry.load("telemetry.bin")
+    trace["t_us"], trace["left"], trace["correction"], ...
+
+or `python -m host.telemetry telemetry.bin` for a per-segment summary.
+"""
+
+import base64
+import sys
+
+import numpy as np
+
+import telemetry as _robot  # the robot module, for the format constants
+
+TICKS_PERIOD = 1 << 30  # MicroPython's ticks_us() wraps at this
+HEADER_BYTES = len(_robot.MAGIC) + 2 + 4
+
+KIND_NAMES = {_robot.KIND_MOVE: "move", _robot.KIND_TURN: "turn", _robot.KIND_ARC: "arc"}
+EXIT_NAMES = {_robot.EXIT_NONE: "", _robot.EXIT_DISTANCE: "distance",
+              _robot.EXIT_ULTRASOUND: "ultrasound", _robot.EXIT_HEADER: "header"}
+
+
+def extract(raw):
+    """
+    Return the binary dump from raw, which is either the dump itself or a serial
+    capture containing the base64 lines between BEGIN and END.
+    """
+    if raw.startswith(_robot.MAGIC):
+        return raw
+    lines = raw.decode(errors="replace").splitlines()
+    try:
+        begin = next(i for i, line in enumerate(lines) if line.strip() == _robot.BEGIN)
+        end = next(i for i in range(begin + 1, len(lines)) if lines[i].strip() == _robot.END)
+    except StopIteration:
+        raise ValueError("no telemetry dump found") from None
+    return b"".join(base64.b64decode(line.strip()) for line in lines[begin + 1:end])
+
+
+def decode(raw):
+    """
+    Decode a dump into a dict of NumPy arrays, one entry per sample:
+    t_us (int64, unwrapped, from the first sample), every field in
+    telemetry.FIELDS, plus kind and exit split out of tag.
+    """
+    raw = extract(raw)
+    magic = _robot.MAGIC
+    if raw[:len(magic)] != magic:
+        raise ValueError("not a telemetry dump")
+    version = raw[len(magic)]
+    width = raw[len(magic) + 1]
+    if version != _robot.VERSION or width != _robot.WIDTH:
+        raise ValueError(f"unsupported dump: version {version}, {width} fields")
+    count = int.from_bytes(raw[len(magic) + 2:HEADER_BYTES], "little")
+    expected = HEADER_BYTES + count * (4 + 2 * width)
+    if len(raw) < expected:
+        raise ValueError(f"truncated dump: {len(raw)} of {expected} bytes")
+
+    ticks = np.frombuffer(raw, "<u4", count, HEADER_BYTES).astype(np.int64)
+    data = np.frombuffer(raw, "<i2", count * width, HEADER_BYTES + 4 * count).reshape(count, width)
+
+    trace = {"t_us": np.concatenate(([0], np.cumsum(np.diff(ticks) % TICKS_PERIOD)))
+             if count else np.zeros(0, np.int64)}
+    for i, name in enumerate(_robot.FIELDS):
+        trace[name] = data[:, i].astype(np.int32)
+    trace["kind"] = trace["tag"] & 0x0F
+    trace["exit"] = trace["tag"] >> 4
+    return trace
+
+
+def load(path):
+    """Read and decode a dump file or serial capture."""
+    with open(path, "rb") as f:
+        return decode(f.read())
+
+
+def segments(trace):
+    """
+    Split a trace into segments. Returns (header, start, stop) per segment:
+    the index of its header sample (-1 if it was lost to the ring buffer) and
+    the range of its loop samples. A segment ends at a sample with an exit
+    reason, before a header, or where the kind changes.
+    """
+    kind = trace["kind"]
+    exit_code = trace["exit"]
+    count = len(kind)
+    is_header = exit_code == _robot.EXIT_HEADER
+    result = []
+    i = 0
+    while i < count:
+        header = -1
+        if is_header[i]:
+            header = i
+            i += 1
+        start = i
+        while (i < count and not is_header[i] and kind[i] == kind[start]
+               and exit_code[i] == _robot.EXIT_NONE):
+            i += 1
+        if i < count and not is_header[i] and kind[i] == kind[start]:
+            i += 1  # The sample carrying the exit reason
+        if header >= 0 or i > start:
+            result.append((header, start, i))
+    return result
+
+
+def header_fields(trace, header):
+    """
+    The header sample of a segment as a dict, scaled back to cm, s and degrees.
+    See telemetry.py for the layout.
+    """
+    values = [int(trace[name][header]) for name in _robot.FIELDS[:-1]]
+    kind = int(trace["kind"][header])
+    if kind == _robot.KIND_MOVE:
+        return {"distance_cm": values[0] / 10, "time_s": values[1] / 1000,
+                "dynamic_constant": values[2] / 100, "target_counts": values[3],
+                "v_entry": values[4] / 10, "v_exit": values[5] / 10,
+                "target_ultrasound": values[6] / 10 if values[6] >= 0 else None}
+    if kind == _robot.KIND_TURN:
+        return {"angle": values[0] / 100, "target_counts": values[3],
+                "time_s": values[1] / 1000 if values[1] > 0 else None}
+    return {"angle": values[0] / 100, "time_s": values[1] / 1000, "base_speed": values[2],
+            "target_diff": values[3], "radius_cm": values[4] / 10}
+
+
+def summary(trace):
+    """One line of text per segment: kind, samples, duration, mean period, exit."""
+    lines = []
+    t = trace["t_us"]
+    for n, (header, a, b) in enumerate(segments(trace)):
+        kind = KIND_NAMES.get(int(trace["kind"][header if header >= 0 else a]), "?")
+        if b <= a:
+            lines.append(f"{n:3d} {kind:5s}     0 samples")
+            continue
+        duration = (t[b - 1] - t[a]) / 1000
+        period = duration / (b - a - 1) if b - a > 1 else 0
+        exit_reason = EXIT_NAMES.get(int(trace["exit"][b - 1]), "?")
+        worst = int(np.abs(trace["correction"][a:b]).max())
+        lines.append(f"{n:3d} {kind:5s} {b - a:5d} samples {duration:8.1f}ms "
+                     f"period {period:5.2f}ms max|cor| {worst:4d} {exit_reason}")
+    return lines
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("usage: python -m host.telemetry <dump or serial capture>")
+    trace = load(sys.argv[1])
+    print(f"{len(trace['t_us'])} samples over {trace['t_us'][-1] / 1e6:.3f}s"
+          if len(trace["t_us"]) else "empty dump")
+    for line in summary(trace):
+        print(line)
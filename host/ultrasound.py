@@ -0,0 +1,234 @@
+"""
+Ultrasound correction table from calibration captures.
+
+test.py's calibration mode steps the robot towards a wall by encoder-measured
+distances and pings many times at every position. This fits the table in
+constants.ULTRASOUND_TABLE to such captures: the true distance in mm at evenly
+spaced echo widths, linear in between (see ranging.true_mm()). Every width is
+first scaled to the speed of sound at one reference temperature, which becomes
+constants.ULTRASOUND_TEMPERATURE_C, so the robot can scale its own widths the
+same way at whatever temperature it runs.
+
+Accepts the capture file (copied off the robot with e.g.
+`mpremote cp :ultrasound.txt .`) or a capture of the USB serial output.
+Example (from the repository root):
+
+    python -m host.ultrasound ultrasound.txt --start-cm 180.4
+
+prints the fit and its residuals at every position;
+`python -m host.sysid run.bin --ultrasound ultrasound.txt -o constants.py`
+writes it into constants.py.
+"""
+
+import argparse
+import math
+
+import numpy as np
+
+# The capture format, as written by test.py
+BEGIN = "ULTRASOUND CAPTURE BEGIN"
+END = "ULTRASOUND CAPTURE END"
+
+SOUND_CM_PER_US = 0.0343  # ultrasonic.SOUND_CM_PER_US: what the robot calls a raw cm
+SOUND_M_S_AT_0C = 331.3  # As ranging.py
+SOUND_M_S_PER_C = 0.606
+OUTLIER_MADS = 3  # As ranging.filter_widths()
+MIN_SPREAD_US = 30
+MAX_POINTS = 16  # Most table entries the robot keeps
+SMOOTHING = 0.1  # Weight of the second-difference penalty, per sample, against 1 mm residuals
+
+
+def extract(text):
+    """
+    The lines between BEGIN and END, from a capture file or serial capture.
+    """
+    lines = [line.strip() for line in text.splitlines()]
+    try:
+        begin = lines.index(BEGIN)
+        end = lines.index(END, begin + 1)
+    except ValueError:
+        raise ValueError("no ultrasound capture found") from None
+    return lines[begin + 1:end]
+
+
+def decode(text, start_cm=None):
+    """
+    Decode a capture into a list of positions, one dict each: true_mm (start
+    distance minus the distance driven), temperature_c, pings (requested) and
+    widths (the echoes received, us). start_cm overrides the start distance
+    the robot was told.
+    """
+    lines = extract(text)
+    if not lines or not lines[0].startswith("start "):
+        raise ValueError("capture has no start line")
+    start_mm = start_cm * 10 if start_cm is not None else int(lines[0].split()[1])
+    positions = []
+    for line in lines[1:]:
+        values = [int(v) for v in line.split()]
+        driven_mm, temperature, pings = values[:3]
+        positions.append({"true_mm": start_mm - driven_mm, "temperature_c": temperature / 10,
+                          "pings": pings, "widths": np.array(values[3:], dtype=float)})
+    return positions
+
+
+def load(path, start_cm=None):
+    """Read and decode a capture file or serial capture."""
+    with open(path, errors="replace") as f:
+        return decode(f.read(), start_cm)
+
+
+def sound_m_s(celsius):
+    """Speed of sound in air at celsius, in m/s."""
+    return SOUND_M_S_AT_0C + SOUND_M_S_PER_C * celsius
+
+
+def inliers(widths):
+    """The widths that agree with their median, like ranging.filter_widths()."""
+    if len(widths) == 0:
+        return widths
+    median = np.median(widths)
+    spread = max(MIN_SPREAD_US, 1.4826 * np.median(np.abs(widths - median)))
+    return widths[np.abs(widths - median) <= OUTLIER_MADS * spread]
+
+
+def reference_temperature(positions):
+    """Mean temperature over the positions, to 0.1 C, or None if none has one."""
+    temperatures = [p["temperature_c"] for p in positions if p.get("temperature_c") is not None]
+    if not temperatures:
+        return None
+    return round(float(np.mean(temperatures)), 1)
+
+
+def samples(positions, reference_c):
+    """
+    (widths, true mm, position index) over the agreeing echoes of every position,
+    with the widths scaled to the speed of sound at reference_c.
+    """
+    widths, truth, index = [], [], []
+    for i, position in enumerate(positions):
+        good = inliers(position["widths"])
+        if position.get("temperature_c") is not None and reference_c is not None:
+            good = good * sound_m_s(position["temperature_c"]) / sound_m_s(reference_c)
+        widths.append(good)
+        truth.append(np.full(len(good), float(position["true_mm"])))
+        index.append(np.full(len(good), i))
+    return np.concatenate(widths), np.concatenate(truth), np.concatenate(index)
+
+
+def choose_grid(widths, max_points=MAX_POINTS):
+    """
+    (first, shift) for a table over the range of widths: points 2**shift us apart,
+    at least twice the usual spacing of the positions so every interval holds
+    data, and no more than max_points of them.
+    """
+    low, high = float(np.min(widths)), float(np.max(widths))
+    centres = np.unique(np.round(widths, -1))
+    spacing = np.median(np.diff(centres)) if len(centres) > 1 else high - low
+    shift = max(1, math.ceil(math.log2(max(2 * spacing, 2))))
+    while (int(high) >> shift) - (int(low) >> shift) + 2 > max_points:
+        shift += 1
+    return (int(low) >> shift) << shift, shift
+
+
+def lookup(table, widths):
+    """ranging.true_mm() for an array of widths already at the table's temperature."""
+    first, shift, points = table
+    points = np.asarray(points, dtype=float)
+    w = np.asarray(widths, dtype=float) - first
+    i = np.clip(np.floor(w / (1 << shift)).astype(int), 0, len(points) - 2)
+    return points[i] + (points[i + 1] - points[i]) * (w - i * (1 << shift)) / (1 << shift)
+
+
+def fit_table(widths, true_mm, max_points=MAX_POINTS):
+    """
+    Least-squares piecewise-linear fit of true_mm against widths on an even grid,
+    with a light penalty on bends so sparse intervals stay straight.
+    Returns (first, shift, points) with the points rounded to mm.
+    Raises ValueError if there are too few distances or the fit does not rise.
+    """
+    widths = np.asarray(widths, dtype=float)
+    true_mm = np.asarray(true_mm, dtype=float)
+    if len(np.unique(true_mm)) < 2:
+        raise ValueError("need echoes from at least two distances")
+    first, shift = choose_grid(widths, max_points)
+    step = 1 << shift
+    count = int((np.max(widths) - first) // step) + 2
+    w = widths - first
+    i = np.minimum((w // step).astype(int), count - 2)
+    share = w / step - i
+    design = np.zeros((len(widths), count))
+    rows = np.arange(len(widths))
+    design[rows, i] = 1 - share
+    design[rows, i + 1] = share
+    bends = np.zeros((max(0, count - 2), count))
+    for k in range(count - 2):
+        bends[k, k:k + 3] = (1, -2, 1)
+    weight = math.sqrt(SMOOTHING * len(widths))
+    points, *_ = np.linalg.lstsq(np.vstack((design, weight * bends)),
+                                 np.concatenate((true_mm, np.zeros(len(bends)))), rcond=None)
+    points = tuple(int(round(p)) for p in points)
+    if any(b <= a for a, b in zip(points, points[1:])):
+        raise ValueError("fitted distances do not rise with the echo width; check the capture")
+    return first, shift, points
+
+
+def fit(positions):
+    """
+    Fit the table to decoded positions (from one or more captures).
+    Returns (table, reference temperature C or None, per-position rows): each row
+    is (true mm, echoes used, pings, median width, fitted mm at that width).
+    """
+    reference_c = reference_temperature(positions)
+    widths, truth, index = samples(positions, reference_c)
+    table = fit_table(widths, truth)
+    rows = []
+    for i, position in enumerate(positions):
+        used = widths[index == i]
+        median = float(np.median(used)) if len(used) else math.nan
+        fitted = float(lookup(table, [median])[0]) if len(used) else math.nan
+        rows.append((position["true_mm"], len(used), position["pings"], median, fitted))
+    return table, reference_c, rows
+
+
+def from_pairs(pairs):
+    """
+    Positions from measured (reading cm, true cm) pairs, e.g. the "ultrasound"
+    list of host/sysid.py's truth file; readings taken at an unknown temperature.
+    """
+    return [{"true_mm": true * 10, "temperature_c": None, "pings": 1,
+             "widths": np.array([reading * 2 / SOUND_CM_PER_US])}
+            for reading, true in np.asarray(pairs, dtype=float).reshape(-1, 2)]
+
+
+def summary(table, reference_c, rows):
+    """Text report of a fit."""
+    first, shift, points = table
+    temperature = "none" if reference_c is None else f"{reference_c:.1f} C"
+    lines = [f"{len(points)} points from {first} us, {1 << shift} us apart; temperature {temperature}",
+             "  true mm  echoes  width us  fitted mm  error mm"]
+    errors = []
+    for true, used, pings, median, fitted in rows:
+        errors.append(fitted - true)
+        lines.append(f"{true:9.0f}  {used:3d}/{pings:<3d}{median:9.0f}  {fitted:9.1f}  {fitted - true:8.1f}")
+    errors = np.array(errors)
+    errors = errors[~np.isnan(errors)]
+    lines.append(f"rms {np.sqrt(np.mean(errors ** 2)):.1f} mm, worst {np.max(np.abs(errors)):.1f} mm")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("captures", nargs="+", help="capture files or serial captures from test.py")
+    parser.add_argument("--start-cm", type=float,
+                        help="distance to the wall at the first position, if not the one in the capture")
+    args = parser.parse_args(argv)
+
+    positions = [p for path in args.captures for p in load(path, args.start_cm)]
+    table, reference_c, rows = fit(positions)
+    print(summary(table, reference_c, rows))
+    print(f"ULTRASOUND_TABLE = {table}")
+    print(f"ULTRASOUND_TEMPERATURE_C = {reference_c}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import time
+
+# Shared hardware context.
+# Every driver is created the first time it is asked for and then shared, so
+# importing move and turn together builds one Motors and one Encoders, and a
+# script that only needs the display never builds the motor drivers.
+# ready() builds the drivers a run needs before the start button, so none of
+# them is constructed inside the timed run, and records how long startup took.
+
+# ticks_ms counts from power-on, so these are times since boot
+import_ms = time.ticks_ms()  # When this module was first imported
+ready_ms = -1  # When ready() finished
+start_latency_us = -1  # From mark_start() to the first motor command, once measured
+
+# The launcher imports a script by name, so its boot code (which waits for the
+# buttons forever) runs at import. Host tools that drive a script's functions
+# themselves clear this first (see host/sim.py) to import it without booting
+autostart = True
+
+_drivers = {}
+_pins = {}
+_start_us = 0
+
+def _driver(name):
+    driver = _drivers.get(name)
+    if driver is None:
+        from pololu_3pi_2040_robot import robot
+        driver = getattr(robot, name)()
+        _drivers[name] = driver
+    return driver
+
+def motors():
+    """
+    The shared robot.Motors.
+    """
+    return _driver("Motors")
+
+def encoders():
+    """
+    The shared robot.Encoders.
+    """
+    return _driver("Encoders")
+
+def display():
+    """
+    The shared robot.Display.
+    """
+    return _driver("Display")
+
+def yellow_led():
+    """
+    The shared robot.YellowLED.
+    """
+    return _driver("YellowLED")
+
+def button_a():
+    """
+    The shared robot.ButtonA.
+    """
+    return _driver("ButtonA")
+
+def button_b():
+    """
+    The shared robot.ButtonB.
+    """
+    return _driver("ButtonB")
+
+def button_c():
+    """
+    The shared robot.ButtonC.
+    """
+    return _driver("ButtonC")
+
+def imu():
+    """
+    The shared robot.IMU, reset and running at its default rates, or None if it
+    does not answer.
+    """
+    if "IMU" not in _drivers:
+        try:
+            from pololu_3pi_2040_robot import robot
+            driver = robot.IMU()
+            driver.reset()
+            driver.enable_default()
+        except OSError:
+            driver = None
+        _drivers["IMU"] = driver
+    return _drivers["IMU"]
+
+def pin(pin_id, mode):
+    """
+    The shared machine.Pin for pin_id, configured with mode when first created.
+    """
+    p = _pins.get(pin_id)
+    if p is None:
+        import machine
+        p = machine.Pin(pin_id, mode)
+        _pins[pin_id] = p
+    return p
+
+def temperature_c(samples=16):
+    """
+    Temperature of the RP2040 in degrees C from its internal sensor (ADC input 4),
+    averaged over samples. The chip runs a few degrees above the air, but by
+    about the same amount from one run to the next.
+    """
+    sensor = _drivers.get("ADC")
+    if sensor is None:
+        import machine
+        sensor = machine.ADC(4)
+        _drivers["ADC"] = sensor
+    total = 0
+    for _ in range(samples):
+        total += sensor.read_u16()
+    volts = total / samples * 3.3 / 65535
+    return 27 - (volts - 0.706) / 0.001721
+
+def ready():
+    """
+    Build every driver the run uses and record ready_ms. Call it once the route
+    is loaded, just before waiting for the start button.
+    """
+    global ready_ms
+    motors()
+    encoders()
+    display()
+    yellow_led()
+    button_a()
+    button_b()
+    imu()
+    ready_ms = time.ticks_ms()
+    return ready_ms
+
+def mark_start():
+    """
+    Call when the start button is seen. The next motor command records
+    start_latency_us; until then set_speeds() goes through a wrapper on the
+    shared Motors, which removes itself after that one call.
+    """
+    global _start_us, start_latency_us
+    _start_us = time.ticks_us()
+    start_latency_us = -1
+    driver = motors()
+
+    def first_command(left, right):
+        global start_latency_us
+        start_latency_us = time.ticks_diff(time.ticks_us(), _start_us)
+        del driver.set_speeds
+        driver.set_speeds(left, right)
+
+    driver.set_speeds = first_command
+
+def report():
+    """
+    Startup timings as display rows.
+    """
+    go = f"{start_latency_us // 1000}ms" if start_latency_us >= 0 else "-"
+    return f"boot: {import_ms}/{ready_ms}ms", f"go: {go}"
@@ -1,11 +1,23 @@
-from pololu_3pi_2040_robot import robot
-import time
-import machine
+from array import array
+import coast
+import constants
+import control_loop
+import fastcore
+import gain_schedule
+import gyro
+import hw
+import odometry
+import ranging
+import screen
+import telemetry
+import ultrasonic
+from ultrasonic import measure_distance
 
 # Robot parameters
 wheel_diameter = 3.235  # Diameter of the robot's wheels in cm
 encoder_count = 358.2  # Number of encoder counts per revolution
 min_speed = 13.75  # Minimum speed in encoder counts per second
+right_wheel_factor = constants.RIGHT_WHEEL_FACTOR  # Right motor is weaker; its command is scaled up by this
 
 # PID constants - base values for reference speed
 kp_base = 20  # Proportional gain
@@ -16,59 +28,22 @@ integral_limit = 50  # Limit for integral term to prevent windup
 # Reference speed for PID scaling
 reference_speed = 100  # Speed at which the base PID values are calibrated
 
-# Ultrasonic sensor pins
-TRIG_PIN = 27  # GP27
-ECHO_PIN = 28  # GP28
+# Hold the heading with the IMU gyro instead of the wheel count difference, when the IMU works
+gyro_hold = True
 
-# Configure ultrasonic pins
-trigger = machine.Pin(TRIG_PIN, machine.Pin.OUT)
-echo = machine.Pin(ECHO_PIN, machine.Pin.IN)
+# Tracking of the planned motion: the base speed is the motor feedforward for the
+# planned speed plus these corrections
+track_kx = 8  # Motor units per count the wheels lag the planned position
+track_kv = 0.4  # Motor units per count/s the wheels are slower than planned
+max_base_speed = 4000  # Highest base speed; the faster wheel gets up to 50% more
 
-motors = robot.Motors()
-encoders = robot.Encoders()
-display = robot.Display()
-button_a = robot.ButtonA()
-button_b = robot.ButtonB()
-button_c = robot.ButtonC()
+# Oldest ultrasonic reading (ms) the control loop will act on
+max_ultrasound_age = 100
 
-def measure_distance():
-    """
-    Measure distance using HC-SR04 ultrasonic sensor.
-    Returns distance in centimeters.
-    """
-    # Ensure trigger is low
-    trigger.value(0)
-    time.sleep_us(2)
-    
-    # Send 10us pulse to trigger
-    trigger.value(1)
-    time.sleep_us(10)
-    trigger.value(0)
-    
-    # Wait for echo to go high
-    timeout = 0
-    while echo.value() == 0:
-        timeout += 1
-        if timeout > 30000:  # Timeout after ~30ms
-            return -1  # Error - no echo received
-    
-    # Measure the time the echo pin stays high
-    start = time.ticks_us()
-    timeout = 0
-    
-    while echo.value() == 1:
-        timeout += 1
-        if timeout > 30000:  # Timeout after ~30ms
-            return -2  # Error - echo too long
-    
-    end = time.ticks_us()
-    
-    # Calculate distance: Time * speed of sound / 2 (roundtrip)
-    # Speed of sound is ~343m/s or 0.0343cm/µs
-    duration = time.ticks_diff(end, start)
-    distance = (duration * 0.0343) / 2
-    
-    return distance
+# Counts travelled past the end of the last segment that handed over while moving
+carry_counts = 0
+
+gain_schedule.build(kp_base, ki_base, kd_base, reference_speed)
 
 def cm_to_encoder_counts(cm):
     wheel_circumference = wheel_diameter * 3.14159
@@ -78,41 +53,143 @@ def encoder_counts_to_cm(counts):
     wheel_circumference = wheel_diameter * 3.14159
     return (counts / encoder_count) * wheel_circumference
 
-def calculate_dynamic_constant(distance_cm, time_expected):
-    """
-    Calculate the dynamic constant using the updated quadratic function:
-    y = -0.07577x^2 + 0.61921x + 39.11896
-    where x = scaled seconds = time_expected * (distance_cm / 120).
-    """
-    # Scale the time to adjust for the given distance
-    scaled_seconds = time_expected * (abs(distance_cm) / 120)  # Use absolute distance
-    # Use the quadratic function
-    return -0.07577 * (scaled_seconds**2) + 0.61921 * scaled_seconds + 39.11896 + 0.05
+def counts_per_cm():
+    return encoder_count / (wheel_diameter * 3.14159)
 
-def trapezoidal_velocity(current_time, total_time, distance_cm, dynamic_constant):
+def trapezoidal_velocity(current_time, total_time, distance_cm, dynamic_constant, v_entry=0, v_exit=0):
     """
     Calculate velocity using a trapezoidal profile with a perfect isosceles triangle.
     Adjusted with a dynamic constant.
+    v_entry/v_exit (cm/s) let a chained segment start and end moving; with both at 0
+    this is the original triangle.
     """
-    # Calculate v_max and acceleration rate
-    v_max = (2 * abs(distance_cm)) / total_time  # Use absolute distance
-    acceleration_rate = v_max / (total_time / 2)
+    # Calculate v_max so the area under the profile is still the distance
+    v_max = (4 * abs(distance_cm) / total_time - v_entry - v_exit) / 2  # Use absolute distance
+    half_time = total_time / 2
 
-    if current_time < total_time / 2:
+    if current_time < half_time:
         # Acceleration phase
-        current_speed = acceleration_rate * current_time
+        current_speed = v_entry + (v_max - v_entry) * current_time / half_time
     elif current_time < total_time:
         # Deceleration phase
-        current_speed = v_max - acceleration_rate * (current_time - total_time / 2)
+        current_speed = v_max + (v_exit - v_max) * (current_time - half_time) / half_time
     else:
-        # Stop
-        current_speed = 0
+        # Stop, or hand over to the next segment
+        current_speed = v_exit
 
     # Ensure current speed does not drop below minimum speed
     current_speed = max(current_speed, min_speed if current_speed > 0 else 0)
 
     return dynamic_constant * current_speed
 
+def trapezoidal_position(current_time, total_time, distance_cm, v_entry=0, v_exit=0):
+    """
+    Distance (cm) covered by current_time along trapezoidal_velocity()'s profile,
+    without its minimum speed. Past total_time it carries on at v_exit.
+    """
+    distance_cm = abs(distance_cm)
+    v_max = (4 * distance_cm / total_time - v_entry - v_exit) / 2
+    half_time = total_time / 2
+    if current_time < half_time:
+        return v_entry * current_time + (v_max - v_entry) * current_time ** 2 / (2 * half_time)
+    if current_time < total_time:
+        t = current_time - half_time
+        return (v_entry + v_max) * half_time / 2 + v_max * t + (v_exit - v_max) * t ** 2 / (2 * half_time)
+    return distance_cm + v_exit * (current_time - total_time)
+
+class MoveSegment:
+    """
+    Pre-baked setpoints for one straight move.
+    Everything move() used to recompute every iteration (target counts, trapezoidal
+    profile, motor feedforward) is computed here once, so running the segment only
+    does table lookups.
+    """
+    def __init__(self, distance_cm, time_expected, target_ultrasound=None, v_entry=0, v_exit=0):
+        self.kind = "move"
+        self.distance_cm = distance_cm
+        self.target_ultrasound = target_ultrasound
+        self.label = None  # Optional (line1, line2) status text set by the planner
+
+        # Speeds (cm/s) handed over from the previous segment and to the next one
+        self.v_entry = v_entry
+        self.v_exit = v_exit
+        self.chain = False  # Set by the planner when the next segment follows without a pause
+        self.range_seeded = False  # Set when ranging.burst() seeded the fused estimate for this move
+
+        # Determine direction of movement
+        self.direction = 1 if distance_cm > 0 else -1
+
+        # Use absolute distance for calculations
+        self.nominal_cm = distance_cm  # As planned, before any odometry correction
+        self.set_distance(distance_cm)
+
+        self.profile = array("h")  # Feedforward base speed, every control period
+        self.planned = array("i")  # Planned position (counts)
+        self.planned_rate = array("h")  # Planned speed (counts per second)
+        self.retime(time_expected)
+
+    def set_distance(self, distance_cm):
+        """
+        Change the distance (same direction), e.g. to correct from odometry.
+        Call retime() afterwards to re-bake the profile.
+        """
+        self.distance_cm = distance_cm
+        self.target_counts = cm_to_encoder_counts(abs(distance_cm))
+
+    def retime(self, time_expected):
+        """
+        Re-bake the planned motion for a new expected time: position and speed of
+        the trapezoidal profile every control period, with one extra sample past the
+        end so the loop can interpolate, and the feedforward that makes the left
+        motor model in constants.py (a first-order lag) follow that speed, so it
+        leads by the time constant.
+        The profile caps the hand-over speeds at the average speed, so its peak is
+        never below them. That leaves the neighbour of a chained move planning for
+        the uncapped speed, so re-time a chain as a whole instead (see
+        executor.retime_chain()).
+        Reuses the arrays when they are long enough.
+        """
+        self.time_expected = time_expected
+        abs_distance_cm = abs(self.distance_cm)
+        # A chained move given much longer would otherwise dip, or even plan to run backwards
+        average = abs_distance_cm / time_expected
+        v_entry = min(self.v_entry, average)
+        v_exit = min(self.v_exit, average)
+        left_gain, tau, deadband = constants.LEFT_MOTOR
+        scale = counts_per_cm()
+
+        # Motor units per cm/s; the motor model replaces the fitted dynamic constant
+        self.dynamic_constant = 1 / left_gain
+
+        # After expected time, carry on at min_speed
+        # (or keep the hand-over speed if the next segment continues the motion)
+        # Speeds are baked in integer motor units for the integer control core
+        tail_cm_s = max(min_speed, v_exit)
+        self.tail_speed = int(tail_cm_s / left_gain + deadband + 0.5)
+        self.tail_rate = int(tail_cm_s * scale + 0.5)
+
+        self.period_us = control_loop.PERIOD_US
+        samples = int(time_expected * 1000000 / self.period_us) + 2
+        if len(self.profile) < samples:
+            self.profile = array("h", [0] * samples)
+            self.planned = array("i", [0] * samples)
+            self.planned_rate = array("h", [0] * samples)
+        half_time = time_expected / 2
+        v_max = (4 * abs_distance_cm / time_expected - v_entry - v_exit) / 2
+        for i in range(samples):
+            t = i * self.period_us / 1000000
+            speed = trapezoidal_velocity(t, time_expected, abs_distance_cm, 1, v_entry, v_exit)
+            if t < half_time:
+                accel = (v_max - v_entry) / half_time
+            elif t < time_expected:
+                accel = (v_exit - v_max) / half_time
+            else:
+                accel = 0
+            self.planned[i] = int(trapezoidal_position(t, time_expected, abs_distance_cm,
+                                                       v_entry, v_exit) * scale + 0.5)
+            self.planned_rate[i] = int(speed * scale + 0.5)
+            self.profile[i] = int(max(0, speed + tau * accel) / left_gain + deadband + 0.5)
+
 def move(distance_cm, time_expected, stop_motors=True, target_ultrasound=None):
     """
     Move the robot a given distance within the expected time using PID to stay straight.
@@ -122,187 +199,264 @@ def move(distance_cm, time_expected, stop_motors=True, target_ultrasound=None):
     The acceleration curve will be identical whether or not ultrasound is used.
     Uses adaptive PID that scales with speed to ensure straight movement at all speeds.
     """
-    
-    # Determine direction of movement
-    direction = 1 if distance_cm > 0 else -1
-
-    # Use absolute distance for calculations
-    abs_distance_cm = abs(distance_cm)
-    target_counts = cm_to_encoder_counts(abs_distance_cm)
-    encoders.get_counts(reset=True)  # Reset encoder counts
-
-    # Calculate dynamic constant based on the intended distance and time
-    # This ensures consistent acceleration regardless of ultrasound usage
-    dynamic_constant = calculate_dynamic_constant(abs_distance_cm, time_expected)
-
-    start_time = time.ticks_ms()
-    integral = 0
-    last_error = 0
-    last_time = start_time
+    run_move(MoveSegment(distance_cm, time_expected, target_ultrasound), stop_motors)
+
+def run_move(segment, stop_motors=True):
+    """
+    Execute a pre-baked MoveSegment. See move() for the behaviour.
+    """
+    global carry_counts
+    direction = segment.direction
+    target_counts = segment.target_counts
+    carried = 0
+    if segment.v_entry > 0:
+        # Chained from a moving segment: its overshoot already counts towards this one
+        carried = carry_counts
+        target_counts -= carried
+    time_expected_us = int(segment.time_expected * 1000000)
+    target_ultrasound = segment.target_ultrasound
+    profile = segment.profile
+    planned = segment.planned
+    planned_rate = segment.planned_rate
+    period_us = segment.period_us
+    tail_speed = segment.tail_speed
+    tail_rate = segment.tail_rate
+    motors = hw.motors()
+    encoders = hw.encoders()
+    # Reset encoder counts; the counts since the last reset still go to the pose tracker
+    left_count, right_count = encoders.get_counts(reset=True)
+    odometry.update(left_count, right_count)
+    odometry.counts_reset()
+    # The robot is at rest after the pause: learn how far the last stop coasted
+    coast.observe(left_count, right_count)
+
+    # Rebuilds the gain table only if the base gains were changed since the last move
+    gain_schedule.ensure(kp_base, ki_base, kd_base, reference_speed)
+
+    # Everything the loop needs as integers, so an iteration does not allocate
+    fastcore.pid_reset()
+    gains = fastcore.gains
+    speeds = fastcore.speeds
+    right_q10 = int(right_wheel_factor * (1 << fastcore.RIGHT_SHIFT) + 0.5)
+    integral_limit_us = int(integral_limit * 1000000)
+    kx_q8 = int(track_kx * (1 << fastcore.GAIN_SHIFT) + 0.5)
+    kv_q8 = int(track_kv * (1 << fastcore.GAIN_SHIFT) + 0.5)
+    max_base = max_base_speed
+    # Wheel speeds start from the hand-over speed of a chained segment
+    entry_rate = direction * int(segment.v_entry * counts_per_cm() + 0.5)
+    fastcore.velocity_reset(0, 0, entry_rate, entry_rate)
+    max_age_ms = max_ultrasound_age
+    # Stopping at the end: cut the motors early by the distance they will coast,
+    # which depends on whether they are then switched off or set to zero
+    predicting = segment.v_exit == 0
+    stop_kind = coast.MOVE if stop_motors else coast.BRAKE
+    # The heading at the start of the segment is the one to hold; wheel slip does not
+    # move it, unlike the count difference
+    holding = gyro_hold and gyro.available()
+    gyro.start()
     looped = False
     exit_reason = "None"  # Track the exit reason
     
-    # Initial distance measurement if using ultrasound
-    initial_ultrasound = None
-    if target_ultrasound is not None:
-        initial_ultrasound = measure_distance()
-        if initial_ultrasound < 0:  # Error reading sensor
-            initial_ultrasound = None
-
-    # Debug display counter
-    display_counter = 0
-    display_freq = 2  # Update display every 2 iterations to reduce overhead
-
-    # For averaging correction values to reduce jitter
-    correction_history = [0] * 3
-    correction_idx = 0
-
-    while True:
-        # Update encoder counts
+    # Start background ranging if using ultrasound; the loop fuses every new echo
+    # with the distance driven and compares the estimate with the width for the
+    # target distance
+    sensing = target_ultrasound is not None
+    target_width = 0
+    if sensing:
+        target_width = ultrasonic.cm_to_width(target_ultrasound)
+        if not segment.range_seeded:
+            ranging.fuse_reset()
+        ultrasonic.start()
+    seen = ultrasonic.readings
+
+    telemetry.header(telemetry.KIND_MOVE, int(segment.distance_cm * 10), time_expected_us // 1000,
+                     int(segment.dynamic_constant * 100), target_counts,
+                     int(segment.v_entry * 10), int(segment.v_exit * 10),
+                     int(target_ultrasound * 10) if sensing else -1)
+
+    # Values kept after the loop for the completion display
+    avg_count = 0
+    elapsed = 0
+    width = -1
+    rate = 0
+    cut_left = 0
+    cut_right = 0
+
+    def step(elapsed_us, dt_us):
+        """
+        One control iteration; integer microseconds in, no heap allocation unless
+        the display is due or, when holding the heading, a new gyro reading came in
+        (the IMU driver returns floats). Returns True to stop.
+        """
+        nonlocal looped, exit_reason, avg_count, elapsed, width, rate, cut_left, cut_right, seen, holding
+
+        # Update encoder counts and the wheel speed estimate
         left_count, right_count = encoders.get_counts()
+        odometry.update(left_count, right_count)
         avg_count = abs((left_count + right_count) // 2)
-
-        # Calculate time information
-        current_time_ms = time.ticks_ms()
-        current_time = time.ticks_diff(current_time_ms, start_time) / 1000.0
-        dt = time.ticks_diff(current_time_ms, last_time) / 1000.0  # Time since last iteration in seconds
-        last_time = current_time_ms
+        elapsed = elapsed_us
+        rate = direction * fastcore.velocity_update(left_count, right_count, dt_us)
+        cut_left = left_count
+        cut_right = right_count
 
         # Check ultrasound ONLY for exit condition, if enabled
-        current_ultrasound = None
-        if target_ultrasound is not None:
-            current_ultrasound = measure_distance()
+        if sensing:
+            # Fused estimate: moved by the distance driven, corrected by each new echo
+            ranging.fuse_travel(direction * avg_count)
+            if ultrasonic.readings != seen:
+                seen = ultrasonic.readings
+                ranging.fuse_reading(ultrasonic.fresh_width(max_age_ms))
+            width = ranging.fused_width()
+            # When stopping, the wheels coast on for a while after the cut
+            coast_width = 0
+            if predicting:
+                coast_width = coast.predict(stop_kind, rate) * ranging.width_per_count_q12 >> 12
             
             # Check if we've reached target ultrasound distance
-            if current_ultrasound > 0:  # Valid reading
+            if width > 0:  # There is an estimate
                 if direction > 0:  # Moving forward
                     # Exit if ultrasound distance is less than or equal to target
-                    if current_ultrasound <= target_ultrasound:
+                    if width - coast_width <= target_width:
                         exit_reason = "Ultrasound"
-                        break
+                        return True
                 else:  # Moving backward
                     # Exit if ultrasound distance is greater than or equal to target
-                    if current_ultrasound >= target_ultrasound:
+                    if width + coast_width >= target_width:
                         exit_reason = "Ultrasound"
-                        break
-
-        # Check if target distance is reached based on encoders
-        if avg_count >= target_counts:
+                        return True
+
+        # Check if target distance is reached based on encoders; when stopping, it is
+        # reached once the wheels would coast the rest of the way
+        stop_at = target_counts
+        if predicting:
+            stop_at -= coast.predict(stop_kind, rate)
+        if avg_count >= stop_at:
             exit_reason = "Distance"
-            break
+            return True
 
-        # Calculate velocity using trapezoidal profile based on elapsed time
+        # Follow the planned position and speed from the trapezoidal profile, based on elapsed time
         # This is ALWAYS calculated based on distance and time, not ultrasound
-        if current_time < time_expected:
-            base_speed = trapezoidal_velocity(current_time, time_expected, abs_distance_cm, dynamic_constant)
+        # Looked up from the pre-baked profile, interpolating between samples
+        if elapsed_us < time_expected_us:
+            feedforward = fastcore.profile_speed(profile, elapsed_us, period_us)
+            lag = fastcore.profile_speed(planned, elapsed_us, period_us) - (avg_count + carried)
+            rate_error = fastcore.profile_speed(planned_rate, elapsed_us, period_us) - rate
         else:
-            # After expected time, use min_speed with the dynamic constant
-            base_speed = min_speed * dynamic_constant
-
-        # Calculate encoder counts per second (actual speed)
-        counts_per_loop = abs(left_count + right_count) / 2  # Average counts in this loop
-        counts_per_second = counts_per_loop / current_time if current_time > 0 else 0
-
-        # Scale PID constants based on current speed
-        # Higher speeds need more aggressive correction, lower speeds need gentler correction
-        speed_ratio = base_speed / reference_speed if reference_speed > 0 else 1
-        
-        # Calculate adaptive PID constants
-        # Power function with root for smoother transition - softens impact at very high speeds
-        # while still providing stronger correction
-        kp = kp_base * (speed_ratio ** 0.75)  # Less aggressive scaling for P term
-        ki = ki_base * (speed_ratio ** 0.5)   # Even gentler for I term to prevent windup
-        kd = kd_base * (speed_ratio ** 0.9)   # Strong scaling for D to dampen at high speeds
-        
-        # Safety caps on PID values to prevent extreme corrections
-        kp = max(min(kp, kp_base * 3), kp_base * 0.5)
-        ki = max(min(ki, ki_base * 2), ki_base * 0.3)
-        kd = max(min(kd, kd_base * 4), kd_base * 0.7)
-
-        # Calculate the PID error and correction
-        error = direction * (left_count - right_count)  # Adjust error by direction
-        
-        # Scale integral and derivative calculations by dt for consistent behavior
-        integral += error * dt
-        integral = max(min(integral, integral_limit), -integral_limit)  # Clamp the integral term
-        
-        # Calculate derivative with respect to time for consistent behavior regardless of loop speed
-        derivative = (error - last_error) / dt if dt > 0 else 0
-        
-        # Calculate correction with the adaptive PID constants
-        correction = kp * error + ki * integral + kd * derivative
-        
-        # Apply a non-linear correction curve to prevent overcorrection at low speeds
-        # and undercorrection at high speeds
-        correction_magnitude = abs(correction)
-        correction_sign = 1 if correction > 0 else -1
-        if correction_magnitude > 0:
-            # Apply a soft cap to prevent excessive corrections
-            correction = correction_sign * min(correction_magnitude, base_speed * 0.3)
-        
-        # Add to history for smoothing
-        correction_history[correction_idx] = correction
-        correction_idx = (correction_idx + 1) % len(correction_history)
-        
-        # Use average correction for smoother response
-        smoothed_correction = sum(correction_history) / len(correction_history)
-
-        # Adjust motor speeds based on PID correction and direction
-        left_speed = direction * (base_speed - smoothed_correction)
-        right_speed = 1.075 * direction * (base_speed + smoothed_correction)
-        
-        # Apply safety limits to prevent any motor from going negative or too fast
-        speed_limit = base_speed * 1.5  # 50% higher than base speed
-        left_speed = max(min(left_speed, speed_limit), 0) if direction > 0 else min(max(left_speed, -speed_limit), 0)
-        right_speed = max(min(right_speed, speed_limit), 0) if direction > 0 else min(max(right_speed, -speed_limit), 0)
+            # After expected time, carry on at min_speed and make up what is left
+            feedforward = tail_speed
+            lag = target_counts - avg_count
+            rate_error = tail_rate - rate
+        base_speed = fastcore.track_speed(feedforward, lag, rate_error, kx_q8, kv_q8, max_base)
+
+        # Adaptive PID constants scaled by current speed, from the precomputed gain schedule
+        gain_schedule.lookup_q8(base_speed, gains)
+
+        # PID on the difference between the wheels (adjusted by direction); writes
+        # the smoothed, capped and limited motor commands to speeds
+        # With the gyro, the heading change stands in for the difference it would cause
+        turned = gyro.update(dt_us) if holding else None
+        if turned is not None:
+            error = direction * gyro.counts(turned)
+        else:
+            # No IMU, or it stopped answering: hold with the wheel counts from here on
+            holding = False
+            error = direction * (left_count - right_count)
+        smoothed_correction = fastcore.pid_step(error, dt_us, base_speed, direction,
+                                                right_q10, integral_limit_us)
 
         # Set motor speeds
-        motors.set_speeds(left_speed, right_speed)
-
-        # Update display less frequently to reduce overhead
-        display_counter += 1
-        if display_counter >= display_freq:
-            display_counter = 0
-            display.fill(0)
-            
-            if target_ultrasound is not None and current_ultrasound > 0:
-                display.text(f"Ultra: {current_ultrasound:.1f}cm", 0, 0)
-                display.text(f"Target: {target_ultrasound}cm", 0, 10)
+        motors.set_speeds(speeds[0], speeds[1])
+        telemetry.record(left_count, right_count, base_speed, smoothed_correction,
+                         speeds[0], speeds[1], ultrasonic.width_to_mm(width), telemetry.KIND_MOVE)
+
+        # Post status for the display service; it redraws at a capped rate
+        if screen.due():
+            if sensing and width > 0:
+                screen.post(0, f"Ultra: {ultrasonic.width_to_cm(width):.1f}cm")
+                screen.post(1, f"Target: {target_ultrasound}cm")
             else:
-                display.text(f"Dist: {encoder_counts_to_cm(avg_count):.1f}cm", 0, 0)
-                display.text(f"Speed: {base_speed:.1f}", 0, 10)
+                screen.post(0, f"Dist: {encoder_counts_to_cm(avg_count):.1f}cm")
+                screen.post(1, f"Speed: {base_speed}")
             
-            display.text(f"kP: {kp:.1f} E: {error}", 0, 20)
-            display.text(f"Cor: {smoothed_correction:.1f}", 0, 30)
-            display.text(f"L:{left_speed:.0f} R:{right_speed:.0f}", 0, 40)
-            display.show()
+            screen.post(2, f"kP: {gains[0] / 256:.1f} E: {error}")
+            screen.post(3, f"Cor: {smoothed_correction}")
+            screen.post(4, f"L:{speeds[0]} R:{speeds[1]}")
 
-        # Update last error
-        last_error = error
         looped = True
+        return False
+
+    # Run the control loop at a fixed period; the display is serviced in the slack time
+    control_loop.run(step, idle=screen.service, idle_us=screen.SHOW_US)
 
-        time.sleep(0.01)  # Faster loop for more responsive control
+    if sensing:
+        ultrasonic.stop()
+    if looped:
+        telemetry.mark_exit(telemetry.EXIT_ULTRASOUND if exit_reason == "Ultrasound"
+                            else telemetry.EXIT_DISTANCE)
 
+    carry_counts = 0
+    if segment.v_exit > 0 and exit_reason == "Distance":
+        # Hand over to the next segment while still moving; leave the motors running
+        carry_counts = avg_count - target_counts
     # When exiting the loop, stop motors if required
-    if stop_motors:
+    elif stop_motors:
         motors.off()
+        if looped:
+            coast.cut(coast.MOVE, rate, cut_left, cut_right)
     else:
         # Just set the speeds to 0 but don't turn off
         motors.set_speeds(0, 0)
+        if looped:
+            coast.cut(coast.BRAKE, rate, cut_left, cut_right)
     
     # Display completion
-    if looped:
-        display.fill(0)
-        display.text(f"Dist: {encoder_counts_to_cm(avg_count):.2f}cm", 0, 0)
-        if target_ultrasound is not None and current_ultrasound > 0:
-            display.text(f"Ultra: {current_ultrasound:.1f}cm", 0, 10)
-        display.text(f"Time: {current_time:.2f}s", 0, 20)
-        display.text(f"Exit: {exit_reason}", 0, 30)
-        display.show()
+    if looped and not screen.silent and segment.v_exit == 0:
+        screen.clear()
+        screen.post(0, f"Dist: {encoder_counts_to_cm(avg_count):.2f}cm")
+        if sensing and width > 0:
+            screen.post(1, f"Ultra: {ultrasonic.width_to_cm(width):.1f}cm")
+        screen.post(2, f"Time: {elapsed / 1000000:.2f}s")
+        screen.post(3, f"Exit: {exit_reason}")
+        screen.service(force=True)
+
+def check_hot_path(iterations=100):
+    """
+    Assert that the integer control core run_move() uses (profile lookup, velocity
+    estimate, tracking, gain lookup, PID, odometry and telemetry) does not allocate, on synthetic counts.
+    Call at boot, not during a run; it resets the odometry pose and the telemetry.
+    Returns None on the host, where gc.mem_alloc() does not exist.
+    """
+    segment = MoveSegment(50, 1.5)
+    profile = segment.profile
+    planned = segment.planned
+    period_us = segment.period_us
+    gains = fastcore.gains
+    right_q10 = int(right_wheel_factor * (1 << fastcore.RIGHT_SHIFT) + 0.5)
+    integral_limit_us = int(integral_limit * 1000000)
+    kx_q8 = int(track_kx * (1 << fastcore.GAIN_SHIFT) + 0.5)
+    kv_q8 = int(track_kv * (1 << fastcore.GAIN_SHIFT) + 0.5)
+    fastcore.pid_reset()
+    fastcore.velocity_reset(0, 0)
+
+    def step(i):
+        rate = fastcore.velocity_update(5 * i, 5 * i + i % 3, period_us)
+        lag = fastcore.profile_speed(planned, i * period_us, period_us) - 5 * i
+        base_speed = fastcore.track_speed(fastcore.profile_speed(profile, i * period_us, period_us),
+                                          lag, 500 - rate, kx_q8, kv_q8, max_base_speed)
+        gain_schedule.lookup_q8(base_speed, gains)
+        correction = fastcore.pid_step(i % 7 - 3, period_us, base_speed, 1, right_q10, integral_limit_us)
+        odometry.update(5 * i, 5 * i + i % 3)
+        telemetry.record(5 * i, 5 * i + i % 3, base_speed, correction, fastcore.speeds[0],
+                         fastcore.speeds[1], -1, telemetry.KIND_MOVE)
+
+    grown = fastcore.assert_no_alloc(step, iterations)
+    odometry.reset()
+    telemetry.clear()
+    return grown
 
 
 # Main program loop
 # while True:
-#     if button_a.is_pressed():
+#     if hw.button_a().is_pressed():
 #         time.sleep(0.5)
 #         move(70, 2.2)  # Move 70 cm backward in 2.2 seconds
\ No newline at end of file
@@ -0,0 +1,81 @@
+import math
+from array import array
+import micropython
+
+# Incremental odometry pose tracker.
+# The control loops feed it the encoder counts every iteration; it integrates the
+# wheel deltas into (x, y, theta) for the whole route, across encoder resets.
+# update() runs in integers (micrometres, binary angle, sine table) so it does not
+# allocate inside the loops; get_pose() converts to cm and degrees.
+
+WHEEL_DIAMETER = 3.235  # Same wheel size as move.py, in cm
+COUNTS_PER_ROTATION = 358.2
+# Effective distance between the wheels in move.py's units; matches turn.py's calibrated
+# WHEEL_BASE (8.6) and WHEEL_CIRCUMFERENCE (3.315 * pi)
+TRACK_WIDTH = 8.6 * 3.235 / 3.315
+
+CM_PER_COUNT = WHEEL_DIAMETER * math.pi / COUNTS_PER_ROTATION
+
+ANGLE_BITS = 24  # Heading as a binary angle: 2**24 per full turn
+TABLE_BITS = 10  # Sine table entries: 2**10 per full turn (0.35 degrees apart)
+UM_PER_CM = 10000
+
+_FULL_TURN = 1 << ANGLE_BITS
+_TABLE_SIZE = 1 << TABLE_BITS
+_TABLE_MASK = _TABLE_SIZE - 1
+_TABLE_SHIFT = ANGLE_BITS - TABLE_BITS
+_TABLE_ROUND = 1 << (_TABLE_SHIFT - 1)
+_QUARTER = _TABLE_SIZE // 4
+_SIN = array("h", [int(round(16384 * math.sin(2 * math.pi * i / _TABLE_SIZE))) for i in range(_TABLE_SIZE)])
+
+# Half the travel per count in micrometres, in Q8: ds = (dl + dr) * _HALF_UM_Q8 >> 8
+_HALF_UM_Q8 = int(round(CM_PER_COUNT * UM_PER_CM * 128))
+# Heading change per count of difference between the wheels
+_ANGLE_PER_COUNT = int(round(_FULL_TURN * CM_PER_COUNT / (2 * math.pi * TRACK_WIDTH)))
+
+# x (um), y (um), heading (binary angle, positive = left, not wrapped) and the
+# counts at the previous update; preallocated so update() only writes
+state = array("i", [0] * 5)
+
+def reset(x=0, y=0, heading_deg=0, left_count=0, right_count=0):
+    """
+    Set the pose, e.g. at the start of the route. left_count and right_count are
+    what the encoders read now, so counts from before the reset are not travel.
+    """
+    state[0] = int(round(x * UM_PER_CM))
+    state[1] = int(round(y * UM_PER_CM))
+    state[2] = int(round(heading_deg * _FULL_TURN / 360))
+    state[3] = left_count
+    state[4] = right_count
+
+def counts_reset():
+    """
+    Call right after the encoders were reset so the next update starts from zero.
+    """
+    state[3] = 0
+    state[4] = 0
+
+@micropython.native
+def update(left_count, right_count):
+    """
+    Integrate the wheel travel since the last update. Fixed cost, integers only.
+    """
+    s = state
+    dl = left_count - s[3]
+    dr = right_count - s[4]
+    s[3] = left_count
+    s[4] = right_count
+
+    ds = ((dl + dr) * _HALF_UM_Q8) >> 8
+    dtheta = (dr - dl) * _ANGLE_PER_COUNT
+    # Midpoint heading for the arc travelled, rounded to the nearest table entry
+    i = ((s[2] + (dtheta >> 1) + _TABLE_ROUND) >> _TABLE_SHIFT) & _TABLE_MASK
+    s[0] += (ds * _SIN[(i + _QUARTER) & _TABLE_MASK]) >> 14
+    s[1] += (ds * _SIN[i]) >> 14
+    s[2] += dtheta
+
+def get_pose():
+    """
+    Return (x_cm, y_cm, heading_deg).
+    """
+    return state[0] / UM_PER_CM, state[1] / UM_PER_CM, state[2] * 360 / _FULL_TURN
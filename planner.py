@@ -0,0 +1,141 @@
+import math
+import routes
+from move import MoveSegment
+from turn import TurnSegment, ArcSegment, turn_time
+
+corner_margin = 5  # cm of straight move that must remain on each side of a rounded corner
+
+def compile_route(records, time_per_cm, chain=False, corner_radius=None, timed_turns=False):
+    """
+    Compile a whole packed route (see routes.pack()) into pre-baked segments.
+    Run this when the route is loaded, before the start button, so the timed run
+    only executes tables.
+    If chain is True, consecutive moves are linked (see chain_moves()).
+    If corner_radius is given, turns between forward moves become arcs of that
+    radius (see round_corners()).
+    If timed_turns is True, turns follow an angle profile over turn_time() of
+    their angle, so they take a known time (see TurnSegment).
+    """
+    segments = []
+    value = routes.value
+    for i in range(0, len(records), routes.WIDTH):
+        op = records[i]
+        if op == routes.OP_MOVE:
+            distance = value(records[i + 1])
+            action_time = abs(distance) * time_per_cm
+
+            if records[i + 2] != routes.NO_TARGET:
+                target_ultrasound = value(records[i + 2])
+                segment = MoveSegment(distance, action_time, target_ultrasound)
+                segment.label = (f"Move: {distance}cm", f"Ultra: {target_ultrasound}cm")
+            else:
+                segment = MoveSegment(distance, action_time)
+                segment.label = (f"Move: {distance}cm", f"Time: {action_time:.2f}s")
+
+        elif op == routes.OP_TURN:
+            angle = value(records[i + 1])
+            segment = TurnSegment(angle, turn_time(angle) if timed_turns else None)
+            segment.label = (f"Turn: {angle}°", "Turning...")
+
+        else:
+            raise ValueError(f"unknown opcode {op} in step {i // routes.WIDTH}")
+
+        segments.append(segment)
+
+    if corner_radius:
+        segments = round_corners(segments, corner_radius)
+    if chain:
+        chain_moves(segments)
+    return segments
+
+def round_corners(segments, radius_cm):
+    """
+    Replace move, turn, move with a shorter move, an arc and a shorter move where
+    the route allows it: both moves go forward, the turn is less than 180 degrees,
+    each move is longer than the tangent length (see _tangent()) plus
+    corner_margin, and the first one does not end on an ultrasound target.
+    The arc is tangent to both moves, so the robot ends exactly where the
+    original second move ended. The three segments run back to back at the
+    combined average speed of the two moves.
+    Returns the new segment list.
+    """
+    result = []
+    for segment in segments:
+        result.append(segment)
+        if len(result) < 3 or not _can_round(result[-3], result[-2], result[-1], radius_cm):
+            continue
+        second = result.pop()
+        corner = result.pop()
+        first = result.pop()
+        speed = ((abs(first.distance_cm) + abs(second.distance_cm))
+                 / (first.time_expected + second.time_expected))
+
+        tangent = _tangent(corner.angle, radius_cm)
+        before = _shortened(first, tangent)
+        before.v_exit = speed
+        before.chain = True
+        before.retime(before.time_expected)
+
+        arc = ArcSegment(corner.angle, radius_cm, speed)
+        arc.label = (f"Arc: {corner.angle}°", f"R: {radius_cm}cm")
+        arc.chain = True
+
+        # May itself become the first move of the next corner
+        after = _shortened(second, tangent)
+        after.v_entry = speed
+        after.retime(after.time_expected)
+
+        result.extend((before, arc, after))
+    return result
+
+def _tangent(angle, radius_cm):
+    """
+    How far before and after the corner an arc of radius_cm through angle degrees
+    meets the straight moves: radius_cm for a right angle, less for a shallower turn.
+    """
+    return round(radius_cm * math.tan(math.radians(abs(angle)) / 2), 2)
+
+def _can_round(first, corner, second, radius_cm):
+    if first.kind != "move" or corner.kind != "turn" or second.kind != "move":
+        return False
+    if abs(corner.angle) >= 180:
+        return False  # An about-turn has no tangent arc
+    tangent = _tangent(corner.angle, radius_cm)
+    return (first.direction > 0 and second.direction > 0
+            and first.target_ultrasound is None
+            and first.distance_cm - tangent >= corner_margin
+            and second.distance_cm - tangent >= corner_margin)
+
+def _shortened(segment, length_cm):
+    """
+    Copy of a move segment with length_cm taken off, keeping its speeds and average pace.
+    """
+    distance = segment.distance_cm - length_cm
+    time_expected = segment.time_expected * distance / segment.distance_cm
+    shorter = MoveSegment(distance, time_expected, segment.target_ultrasound,
+                          segment.v_entry, segment.v_exit)
+    shorter.label = (f"Move: {distance:g}cm", f"Time: {time_expected:.2f}s")
+    return shorter
+
+def chain_moves(segments):
+    """
+    Link consecutive moves so they run without the stop and pause between them.
+    Collinear moves in the same direction hand over at their combined average speed,
+    so the robot does not slow to a stop and accelerate again. A move followed by a
+    reverse still meets at zero speed but skips the pause.
+    Moves that end on an ultrasound target are never chained, since where they end
+    is not known in advance.
+    """
+    for i in range(len(segments) - 1):
+        first = segments[i]
+        second = segments[i + 1]
+        if first.kind != "move" or second.kind != "move" or first.target_ultrasound is not None:
+            continue
+        if first.direction == second.direction:
+            handover = ((abs(first.distance_cm) + abs(second.distance_cm))
+                        / (first.time_expected + second.time_expected))
+            first.v_exit = handover
+            second.v_entry = handover
+            first.retime(first.time_expected)
+            second.retime(second.time_expected)
+        first.chain = True
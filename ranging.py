@@ -0,0 +1,238 @@
+import time
+from array import array
+import micropython
+import constants
+import odometry
+import ultrasonic
+
+# Robust ultrasonic ranging for approaching a wall.
+# burst() takes several background pings while the robot stands still, drops
+# error codes and echoes that disagree with the rest (median/MAD) and returns
+# the distance with a confidence, within a fixed time.
+# While a move with an ultrasound target runs, fuse_*() keep a one-dimensional
+# Kalman estimate of the echo width: the encoders move it by the distance
+# driven every period and each new echo corrects it, unless it is too far off
+# to be believed. The move compares that estimate with its target instead of
+# the raw echo, so one stray echo or timeout no longer ends it early or late.
+# Estimates are echo widths in microseconds, like ultrasonic.fresh_width(), so
+# the loop stays in integers.
+# Widths become distances through the correction table in constants.py, fit from
+# test.py's calibration captures. The table holds true distances at evenly spaced
+# widths, so a lookup is a shift, an index and one interpolation in integers;
+# the widths are first scaled to the speed of sound at the temperature the table
+# was measured at (see set_temperature()).
+
+BURST_PINGS = 7
+BURST_BUDGET_MS = 450  # A burst never takes longer than this
+OUTLIER_MADS = 3  # Echoes further than this many (scaled) MADs from the median are dropped
+MIN_SPREAD_US = 30  # ~0.5 cm: floor for the MAD, so identical echoes do not reject a close one
+MIN_CONFIDENCE = 0.3  # Below this share of agreeing pings a burst is not used
+
+READING_VARIANCE = 3400  # us^2, one good echo (~1 cm std)
+TRAVEL_VARIANCE = 1  # us^2 added per encoder count driven
+GATE = 3  # Echoes more than this many standard deviations from the estimate are rejected
+MAX_REJECTS = 3  # After this many rejected echoes in a row the estimate starts over from the next
+
+SOUND_M_S_AT_0C = 331.3  # Speed of sound in air at 0 C
+SOUND_M_S_PER_C = 0.606  # and how much it rises per degree
+
+# True distance (mm) at echo widths TABLE_FIRST_US + (i << TABLE_SHIFT), see constants.ULTRASOUND_TABLE
+TABLE_FIRST_US, TABLE_SHIFT, _points = constants.ULTRASOUND_TABLE
+table = array("h", _points)
+_LAST = len(table) - 2  # Last interval
+_HALF_STEP = 1 << (TABLE_SHIFT - 1)  # Rounds the interpolation to the nearest mm
+
+temperature_c = constants.ULTRASOUND_TEMPERATURE_C  # The table's, or None
+width_scale_q12 = 4096  # Echo widths now to widths at temperature_c, in Q12
+width_per_count_q12 = 0  # Echo width change per encoder count driven, in Q12; see set_temperature()
+
+# Estimate (us, -1 until the first echo), its variance (us^2), the rejected echoes
+# in a row and the position (counts) the estimate was last moved to
+_WIDTH = 0
+_VARIANCE = 1
+_REJECTS = 2
+_POSITION = 3
+state = array("i", [-1, 0, 0, 0])
+
+def sound_m_s(celsius):
+    """
+    Speed of sound in air at celsius, in m/s.
+    """
+    return SOUND_M_S_AT_0C + SOUND_M_S_PER_C * celsius
+
+def set_temperature(celsius):
+    """
+    Compensate echo widths for the speed of sound at celsius, read from the same
+    sensor as the table's temperature (hw.temperature_c()), so the chip running
+    warmer than the air cancels out. Without a table temperature, or with celsius
+    None, widths are used as they are.
+    """
+    global width_scale_q12, width_per_count_q12
+    width_scale_q12 = 4096
+    if temperature_c is not None and celsius is not None:
+        width_scale_q12 = int(4096 * sound_m_s(celsius) / sound_m_s(temperature_c) + 0.5)
+    # Over the whole table, in the widths measured now
+    mm_per_us = (table[_LAST + 1] - table[0]) / ((_LAST + 1) << TABLE_SHIFT)
+    width_per_count_q12 = int(odometry.CM_PER_COUNT * 10 / mm_per_us * 4096 * 4096 / width_scale_q12 + 0.5)
+
+@micropython.native
+def true_mm(width):
+    """
+    True distance in mm for an echo width in us, through the correction table.
+    Error readings (negative) pass through. Integers only.
+    """
+    if width < 0:
+        return width
+    w = (width * width_scale_q12 >> 12) - TABLE_FIRST_US
+    i = w >> TABLE_SHIFT
+    if i < 0:
+        i = 0
+    elif i > _LAST:
+        i = _LAST
+    t = table
+    a = t[i]
+    return a + (((t[i + 1] - a) * (w - (i << TABLE_SHIFT)) + _HALF_STEP) >> TABLE_SHIFT)
+
+def to_true_cm(raw_cm):
+    """
+    Distance in cm for a raw sensor reading (ultrasonic.width_to_cm() of the
+    echo width), through the correction table.
+    """
+    return true_mm(ultrasonic.cm_to_width(raw_cm)) / 10
+
+def to_raw_cm(true_cm):
+    """
+    The raw sensor reading expected at a distance, the inverse of to_true_cm().
+    """
+    mm = true_cm * 10
+    i = 0
+    while i < _LAST and table[i + 1] < mm:
+        i += 1
+    a = table[i]
+    width = TABLE_FIRST_US + (i << TABLE_SHIFT) + (mm - a) * (1 << TABLE_SHIFT) / (table[i + 1] - a)
+    return ultrasonic.width_to_cm(width * 4096 / width_scale_q12)
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+def burst_widths(pings=BURST_PINGS, budget_ms=BURST_BUDGET_MS):
+    """
+    Collect up to pings background echo widths, stopping at budget_ms.
+    Error readings are left out. Pinging is started for the burst if it was off,
+    and left as it was found.
+    """
+    started = not ultrasonic.running()
+    ultrasonic.start()
+    deadline = time.ticks_add(time.ticks_ms(), budget_ms)
+    seen = ultrasonic.readings
+    widths = []
+    taken = 0
+    while taken < pings and time.ticks_diff(deadline, time.ticks_ms()) > 0:
+        if ultrasonic.readings == seen:
+            time.sleep_ms(2)
+            continue
+        seen = ultrasonic.readings
+        taken += 1
+        width = ultrasonic.fresh_width(ultrasonic.PING_INTERVAL_MS)
+        if width > 0:
+            widths.append(width)
+    if started:
+        ultrasonic.stop()
+    return widths
+
+def filter_widths(widths):
+    """
+    The echo widths that agree with the median, within OUTLIER_MADS scaled MADs.
+    """
+    if not widths:
+        return []
+    median = _median(widths)
+    spread = max(MIN_SPREAD_US, 1.4826 * _median([abs(w - median) for w in widths]))
+    return [w for w in widths if abs(w - median) <= OUTLIER_MADS * spread]
+
+def burst(pings=BURST_PINGS, budget_ms=BURST_BUDGET_MS):
+    """
+    Range with a burst of pings, within budget_ms.
+    Returns (distance_cm, confidence): the calibrated distance from the agreeing
+    echoes, and the share of the requested pings that agreed (0 to 1). With no
+    usable echo the distance is -1 and the confidence 0.
+    Also seeds the fused estimate (see fuse_reset()) for a move that follows.
+    """
+    good = filter_widths(burst_widths(pings, budget_ms))
+    if not good:
+        fuse_reset()
+        return -1, 0
+    width = sum(good) / len(good)
+    spread = sum((w - width) ** 2 for w in good) / len(good)
+    fuse_reset(int(width + 0.5), int(max(READING_VARIANCE / len(good), spread / len(good))))
+    return true_mm(int(width + 0.5)) / 10, len(good) / pings
+
+def fuse_reset(width=-1, variance=READING_VARIANCE):
+    """
+    Start the fused estimate from width (us) with variance (us^2), or with no
+    estimate until the first echo if width is -1.
+    """
+    state[_WIDTH] = width
+    state[_VARIANCE] = variance
+    state[_REJECTS] = 0
+    state[_POSITION] = 0
+
+@micropython.native
+def fuse_travel(position):
+    """
+    Move the estimate to position: the counts driven towards the wall since
+    fuse_reset() (negative: away from it).
+    """
+    s = state
+    last = s[_POSITION]
+    s[_POSITION] = position
+    if s[_WIDTH] < 0:
+        return
+    # Converted from the totals, so the fractions of a microsecond are not lost every period
+    s[_WIDTH] -= (position * width_per_count_q12 >> 12) - (last * width_per_count_q12 >> 12)
+    if s[_WIDTH] < 0:
+        s[_WIDTH] = 0
+    driven = position - last
+    s[_VARIANCE] += (driven if driven > 0 else -driven) * TRAVEL_VARIANCE
+
+@micropython.native
+def fuse_reading(width):
+    """
+    Correct the estimate with one echo width; error readings (negative) are
+    ignored. Returns True if the echo was used.
+    """
+    s = state
+    if width < 0:
+        return False
+    if s[_WIDTH] < 0:
+        s[_WIDTH] = width
+        s[_VARIANCE] = READING_VARIANCE
+        return True
+    innovation = width - s[_WIDTH]
+    total = s[_VARIANCE] + READING_VARIANCE
+    if innovation * innovation > GATE * GATE * total:
+        s[_REJECTS] += 1
+        if s[_REJECTS] >= MAX_REJECTS:
+            # The estimate is what is off: start again from this echo
+            s[_WIDTH] = width
+            s[_VARIANCE] = READING_VARIANCE
+            s[_REJECTS] = 0
+            return True
+        return False
+    s[_REJECTS] = 0
+    gain = (s[_VARIANCE] << 8) // total
+    s[_WIDTH] += innovation * gain >> 8
+    s[_VARIANCE] = s[_VARIANCE] * (256 - gain) >> 8
+    return True
+
+def fused_width():
+    """
+    The fused echo width estimate in us, or -1 if there is none yet.
+    """
+    return state[_WIDTH]
+
+set_temperature(None)
@@ -0,0 +1,117 @@
+from array import array
+
+# Packed routes.
+# A route is an array("i") of fixed-size records, one per step:
+#   opcode, amount x100 (cm for a move, degrees for a turn),
+#   ultrasound target x100 (cm, NO_TARGET if none)
+# pack() builds one from a sequence in the 1mainMove.py format and
+# planner.compile_route() runs through the records directly.
+#
+# Several named routes can be stored side by side in one file on flash:
+#   header: MAGIC, version (u8), number of routes (u8)
+#   route:  name length (u8), name (utf-8), number of steps (u16), records (i32)
+# all little-endian. Write the file with save(), on the robot or on the host,
+# and copy it over with e.g. `mpremote cp routes.bin :`.
+
+MAGIC = b"RTRO"
+VERSION = 1
+
+OP_MOVE = 1
+OP_TURN = 2
+
+WIDTH = 3  # Values per record
+SCALE = 100
+NO_TARGET = -1
+
+def pack(sequence):
+    """
+    Pack a move/turn sequence, e.g. [(50, "move"), (90, "turn"), (30, "move", 17.2)],
+    into route records.
+    """
+    records = array("i", [0] * (len(sequence) * WIDTH))
+    for i, step in enumerate(sequence):
+        if step[1] == "move":
+            op = OP_MOVE
+        elif step[1] == "turn":
+            op = OP_TURN
+        else:
+            raise ValueError(f"unknown step: {step}")
+        j = i * WIDTH
+        records[j] = op
+        records[j + 1] = round(step[0] * SCALE)
+        records[j + 2] = round(step[2] * SCALE) if len(step) > 2 else NO_TARGET
+    return records
+
+def value(packed):
+    """
+    A packed amount as a number: an int when it is whole, otherwise a float.
+    """
+    return packed // SCALE if packed % SCALE == 0 else packed / SCALE
+
+def unpack(records):
+    """
+    The sequence a route was packed from, e.g. to print it.
+    """
+    sequence = []
+    for i in range(0, len(records), WIDTH):
+        kind = "move" if records[i] == OP_MOVE else "turn"
+        step = (value(records[i + 1]), kind)
+        if records[i + 2] != NO_TARGET:
+            step += (value(records[i + 2]),)
+        sequence.append(step)
+    return sequence
+
+def totals(records):
+    """
+    (steps, moves, turns, total move distance in cm) in one pass over a route.
+    """
+    moves = 0
+    turns = 0
+    distance = 0
+    for i in range(0, len(records), WIDTH):
+        if records[i] == OP_MOVE:
+            moves += 1
+            distance += abs(records[i + 1])
+        else:
+            turns += 1
+    return moves + turns, moves, turns, distance / SCALE
+
+def save(named_routes, path="routes.bin"):
+    """
+    Write [(name, records), ...] to a file.
+    """
+    with open(path, "wb") as f:
+        header = bytearray(MAGIC)
+        header.append(VERSION)
+        header.append(len(named_routes))
+        f.write(header)
+        for name, records in named_routes:
+            name = name.encode()
+            header = bytearray()
+            header.append(len(name))
+            header.extend(name)
+            header.extend((len(records) // WIDTH).to_bytes(2, "little"))
+            f.write(header)
+            f.write(records)
+
+def load(path="routes.bin"):
+    """
+    Read a file written by save(). Returns [(name, records), ...], or an empty
+    list if there is no such file.
+    """
+    try:
+        f = open(path, "rb")
+    except OSError:
+        return []
+    with f:
+        header = f.read(len(MAGIC) + 2)
+        if header[:len(MAGIC)] != MAGIC or header[len(MAGIC)] != VERSION:
+            raise ValueError(f"not a version {VERSION} route file: {path}")
+        named_routes = []
+        for _ in range(header[len(MAGIC) + 1]):
+            name = f.read(f.read(1)[0]).decode()
+            steps = int.from_bytes(f.read(2), "little")
+            records = array("i", [0] * (steps * WIDTH))
+            f.readinto(records)
+            named_routes.append((name, records))
+    return named_routes
@@ -0,0 +1,71 @@
+import time
+import hw
+
+# Status display service.
+# Control loops post text rows without drawing; service() redraws only the rows
+# that changed, at most once every refresh_ms, so a full-frame push never runs on
+# every loop iteration.
+
+ROWS = 6  # Text rows at y = 0, 10, ... 50
+ROW_HEIGHT = 10  # Matches the 10px row pitch used throughout the code
+WIDTH = 128
+SHOW_US = 4000  # Rough cost of one redraw; loops only service the display with this much slack
+
+refresh_ms = 100  # Cap redraws at 10 Hz
+silent = False  # When True, nothing is drawn (silent run mode)
+
+_lines = [""] * ROWS  # What the callers want shown
+_shown = [""] * ROWS  # What is currently on the screen
+_last_show_ms = time.ticks_ms() - refresh_ms
+
+def due():
+    """
+    Return True if service() would redraw now.
+    Lets callers skip formatting status strings that would never be shown.
+    """
+    if silent:
+        return False
+    return time.ticks_diff(time.ticks_ms(), _last_show_ms) >= refresh_ms
+
+def post(row, text):
+    """
+    Set the text of one row. Never draws.
+    """
+    _lines[row] = text
+
+def clear():
+    """
+    Blank all rows. Never draws.
+    """
+    for row in range(ROWS):
+        _lines[row] = ""
+
+def service(force=False):
+    """
+    Redraw the rows that changed since the last redraw.
+    Rate limited to refresh_ms unless force is True. Does nothing in silent mode.
+    Returns True if the display was pushed.
+    """
+    global _last_show_ms
+    if silent:
+        return False
+    now = time.ticks_ms()
+    if not force and time.ticks_diff(now, _last_show_ms) < refresh_ms:
+        return False
+
+    display = hw.display()
+    dirty = False
+    for row in range(ROWS):
+        text = _lines[row]
+        if text != _shown[row]:
+            y = row * ROW_HEIGHT
+            display.fill_rect(0, y, WIDTH, ROW_HEIGHT, 0)
+            if text:
+                display.text(text, 0, y, 1)
+            _shown[row] = text
+            dirty = True
+
+    if dirty:
+        display.show()
+        _last_show_ms = now
+    return dirty
@@ -0,0 +1,148 @@
+import time
+from array import array
+import micropython
+
+# Full-rate trace of the control loops.
+# Every iteration writes one sample into preallocated arrays (a ring buffer that
+# keeps the newest CAPACITY samples). After the run, dump() writes them in a compact
+# binary format; host/telemetry.py loads a dump into NumPy arrays.
+#
+# Dump format, little-endian:
+#   header: MAGIC, version (u8), number of fields (u8), sample count (u32)
+#   times:  count x u32, ticks_us of each sample (wraps like ticks_us)
+#   data:   count x FIELDS x i16, one row per sample in FIELDS order
+# Over USB serial the same bytes are sent base64 encoded between BEGIN and END lines.
+#
+# Before its loop each segment writes a header sample (exit nibble EXIT_HEADER) with
+# what it was asked to do, in place of the loop fields:
+#   move: distance mm, expected time ms, feedforward motor units per cm/s x100, target counts,
+#         entry and exit speed x10 (cm/s), ultrasound target mm (-1 if none)
+#   turn: requested angle x100, expected time ms (0 if untimed), 0, target counts, 0, 0, -1
+#         (loop samples of a timed turn hold how far the wheels lag the profile in correction)
+#   arc:  angle x100, expected time ms, base speed, target count difference,
+#         radius x10 (cm), 0, -1
+
+MAGIC = b"RTTL"
+VERSION = 2
+CAPACITY = 2048  # ~20 s at 100 Hz, 20 bytes per sample
+
+FIELDS = ("left", "right", "base", "correction", "left_cmd", "right_cmd", "ultrasound_mm", "tag")
+WIDTH = len(FIELDS)
+
+# tag = kind | exit << 4
+KIND_MOVE = 1
+KIND_TURN = 2
+KIND_ARC = 3
+EXIT_NONE = 0  # Still running
+EXIT_DISTANCE = 1  # Reached its count target
+EXIT_ULTRASOUND = 2
+EXIT_HEADER = 15  # Not a loop sample; see header()
+
+BEGIN = "TELEMETRY BEGIN"
+END = "TELEMETRY END"
+
+enabled = True
+
+times = array("I", [0] * CAPACITY)
+data = array("h", [0] * (CAPACITY * WIDTH))
+_head = 0  # Next slot to write
+_count = 0
+
+def clear():
+    """
+    Forget all samples, e.g. at the start of a run.
+    """
+    global _head, _count
+    _head = 0
+    _count = 0
+
+@micropython.native
+def record(left, right, base, correction, left_cmd, right_cmd, ultrasound_mm, tag):
+    """
+    Append one sample stamped with ticks_us, overwriting the oldest when full.
+    All values must be integers in the int16 range. A few stores, no allocation.
+    """
+    global _head, _count
+    if not enabled:
+        return
+    head = _head
+    times[head] = time.ticks_us()
+    d = data
+    i = head * WIDTH
+    d[i] = left
+    d[i + 1] = right
+    d[i + 2] = base
+    d[i + 3] = correction
+    d[i + 4] = left_cmd
+    d[i + 5] = right_cmd
+    d[i + 6] = ultrasound_mm
+    d[i + 7] = tag
+    head += 1
+    _head = 0 if head == CAPACITY else head
+    if _count < CAPACITY:
+        _count += 1
+
+def header(kind, a, b, c, d, e, f, g):
+    """
+    Record the header sample for a segment of the given kind; see the layout above.
+    """
+    record(a, b, c, d, e, f, g, kind | EXIT_HEADER << 4)
+
+def mark_exit(exit_code):
+    """
+    Set the exit reason on the newest sample, after a loop has finished.
+    """
+    if _count:
+        i = ((_head - 1) % CAPACITY) * WIDTH + WIDTH - 1
+        data[i] = (data[i] & 0x0F) | (exit_code << 4)
+
+def count():
+    """
+    Number of samples held.
+    """
+    return _count
+
+def _chunks():
+    """
+    Yield the header, then the times and data in chronological order, as buffers.
+    """
+    start = (_head - _count) % CAPACITY
+    header = bytearray(MAGIC)
+    header.append(VERSION)
+    header.append(WIDTH)
+    header.extend(_count.to_bytes(4, "little"))
+    yield header
+    t = memoryview(times)
+    d = memoryview(data)
+    if start + _count <= CAPACITY:
+        yield t[start:start + _count]
+        yield d[start * WIDTH:(start + _count) * WIDTH]
+    else:
+        yield t[start:]
+        yield t[:_head]
+        yield d[start * WIDTH:]
+        yield d[:_head * WIDTH]
+
+def dump(path="telemetry.bin"):
+    """
+    Write the samples to a file on flash. Returns the number of samples written.
+    Copy it to the host with e.g. `mpremote cp :telemetry.bin .`.
+    """
+    with open(path, "wb") as f:
+        for chunk in _chunks():
+            f.write(chunk)
+    return _count
+
+def dump_serial(line_bytes=48):
+    """
+    Print the dump base64 encoded between BEGIN and END lines, for capturing
+    the USB serial output on the host. Returns the number of samples written.
+    """
+    import binascii
+    print(BEGIN)
+    for chunk in _chunks():
+        chunk = bytes(chunk)
+        for i in range(0, len(chunk), line_bytes):
+            print(binascii.b2a_base64(chunk[i:i + line_bytes]).decode().strip())
+    print(END)
+    return _count
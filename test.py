@@ -1,23 +1,51 @@
-from pololu_3pi_2040_robot import robot
 import time
 import machine
+import gyro
+import hw
+import odometry
+import ranging
+import ultrasonic
+from move import move
+
+# Ultrasonic sensor test. Button A shows live readings; button B runs the
+# calibration capture for host/ultrasound.py.
+#
+# Calibration: stand the robot CAL_START_CM (measured by hand, from where the
+# final approach measures, to the wall) in front of a flat wall, facing it, and
+# press B. It pings CAL_PINGS times, moves CAL_STEP_CM closer, and so on for
+# CAL_STEPS positions. How far it really got comes from the encoders, after it
+# has come to rest. Every position is written as one line
+#   <driven mm> <chip temperature C x10> <pings> <echo widths us ...>
+# after a "start <CAL_START_CM mm>" line, between CAPTURE_BEGIN and CAPTURE_END,
+# to CAPTURE_FILE and to the USB serial output.
+
+CAL_START_CM = 180
+CAL_STEP_CM = 10
+CAL_STEP_S = 1.0
+CAL_STEPS = 16
+CAL_PINGS = 25
+CAL_SETTLE_MS = 300  # Wait for the robot to stop rocking before reading the encoders
+CAPTURE_FILE = "ultrasound.txt"
+CAPTURE_BEGIN = "ULTRASOUND CAPTURE BEGIN"
+CAPTURE_END = "ULTRASOUND CAPTURE END"
 
 # Initialize robot display
-display = robot.Display()
-button_a = robot.ButtonA()
+display = hw.display()
+button_a = hw.button_a()
+button_b = hw.button_b()
 
 # Set up ultrasonic sensor pins
 TRIG_PIN = 27  # GP27
 ECHO_PIN = 28  # GP28
 
 # Configure pins
-trigger = machine.Pin(TRIG_PIN, machine.Pin.OUT)
-echo = machine.Pin(ECHO_PIN, machine.Pin.IN)
+trigger = hw.pin(TRIG_PIN, machine.Pin.OUT)
+echo = hw.pin(ECHO_PIN, machine.Pin.IN)
 
 def measure_distance():
     """
     Measure distance using HC-SR04 ultrasonic sensor.
-    Returns distance in centimeters.
+    Returns the calibrated distance in centimeters (see ranging.true_mm()).
     """
     # Ensure trigger is low
     trigger.value(0)
@@ -46,10 +74,10 @@ def measure_distance():
     
     end = time.ticks_us()
     
-    # Calculate distance: Time * speed of sound / 2 (roundtrip)
-    # Speed of sound is ~343m/s or 0.0343cm/µs
+    # Calculate distance through the calibrated table (speed of sound and sensor
+    # error included), so this shows what the route would measure
     duration = time.ticks_diff(end, start)
-    distance = (duration * 0.0343) / 2
+    distance = ranging.true_mm(duration) / 10
     
     return distance
 
@@ -79,6 +107,7 @@ def display_distance(distance):
 def main():
     print("Ultrasonic Distance Sensor Test")
     print("Press Button A to exit")
+    ranging.set_temperature(hw.temperature_c())  # As the route does before its start
     
     while not button_a.is_pressed():
         # Measure distance
@@ -95,8 +124,47 @@ def main():
     display.text("Program ended", 0, 0)
     display.show()
 
+def calibrate():
+    """
+    Run the calibration capture (see above) and return its lines.
+    """
+    gyro.estimate_bias(1000)  # Moves hold the heading with the gyro
+    lines = [CAPTURE_BEGIN, f"start {round(CAL_START_CM * 10)}"]
+    driven = 0.0
+    for step in range(CAL_STEPS):
+        if step:
+            move(CAL_STEP_CM, CAL_STEP_S)
+            time.sleep_ms(CAL_SETTLE_MS)
+            # move() reset the encoders at its start, so these are its counts
+            left, right = hw.encoders().get_counts()
+            driven += (left + right) / 2 * odometry.CM_PER_COUNT
+        temperature = hw.temperature_c()
+        widths = ranging.burst_widths(CAL_PINGS, 2 * CAL_PINGS * ultrasonic.PING_INTERVAL_MS)
+        row = [round(driven * 10), round(temperature * 10), CAL_PINGS] + widths
+        lines.append(" ".join(str(v) for v in row))
+        display.fill(0)
+        display.text("Calibrating", 0, 0)
+        display.text(f"{step + 1}/{CAL_STEPS}: {len(widths)} echoes", 0, 10)
+        display.text(f"{CAL_START_CM - driven:.1f} cm", 0, 20)
+        display.show()
+    lines.append(CAPTURE_END)
+    with open(CAPTURE_FILE, "w") as f:
+        for line in lines:
+            f.write(line + "\n")
+    for line in lines:
+        print(line)
+    display.fill(0)
+    display.text("Capture saved", 0, 0)
+    display.text(CAPTURE_FILE, 0, 10)
+    display.show()
+    return lines
+
 # Run the main program
-while True:
-    if robot.ButtonA().is_pressed():
-        time.sleep(0.5)  # Delay to ensure initialization
-        main()
+if hw.autostart:
+    while True:
+        if button_a.is_pressed():
+            time.sleep(0.5)  # Delay to ensure initialization
+            main()
+        if button_b.is_pressed():
+            time.sleep(0.5)  # Hands clear of the robot
+            calibrate()
@@ -1,12 +1,15 @@
 import time
-from pololu_3pi_2040_robot import robot
 import math
-
-# Initialize hardware
-motors = robot.Motors()
-encoders = robot.Encoders()
-display = robot.Display()
-yellow_led = robot.YellowLED()
+from array import array
+import coast
+import constants
+import control_loop
+import fastcore
+import hw
+import move
+import odometry
+import screen
+import telemetry
 
 # Robot Parameters
 MAX_TURN_SPEED = 1250  # Maximum turning speed
@@ -14,104 +17,376 @@ MIN_TURN_SPEED = 400   # Minimum turning speed
 WHEEL_BASE = 8.6  # Distance between wheels in cm
 WHEEL_CIRCUMFERENCE = 3.315 * math.pi  # Adjusted from 3.35 to 3.32 to compensate for underturn
 COUNTS_PER_ROTATION = 358.2  # Encoder counts per wheel rotation
+ARC_KP = 20  # Proportional gain keeping the wheel ratio on an arc
+
+# Timed turns (TurnSegment with a time_expected) follow an angle profile instead
+TURN_RATE = 250  # Degrees per second used to time a turn, see turn_time()
+MIN_TURN_TIME = 0.2  # Shortest time given to any turn (s)
+TURN_RAMP = 0.25  # Fraction of a timed turn spent speeding up, and again slowing down
+TIMED_TURN_KP = 4  # Motor units per count the wheels lag the profile (counts of both wheels)
+TIMED_MIN_SPEED = 100  # Slowest command of a timed turn, enough to overcome friction
+MAX_MOTOR_SPEED = 6000
 
-def turn(target_angle):
+def turn_time(angle):
+    """
+    Time given to a timed turn of angle degrees.
+    """
+    return max(MIN_TURN_TIME, abs(angle) / TURN_RATE)
+
+class TurnSegment:
+    """
+    Pre-computed target for one in-place turn.
+    Without time_expected the turn runs at full speed and slows down over its
+    second half, so how long it takes depends on the angle and the battery.
+    With time_expected it follows a pre-baked angle profile that ends at that time.
+    """
+    def __init__(self, target_angle, time_expected=None):
+        self.kind = "turn"
+        self.angle = target_angle  # As planned, before any odometry correction
+        self.label = None  # Optional (line1, line2) status text set by the planner
+        self.time_expected = time_expected
+        self.profile = array("h")  # Counts of both wheels, every control period
+        self.feedforward = array("h")  # Left wheel command, every control period
+        self.set_angle(target_angle)
+
+    def set_angle(self, target_angle):
+        """
+        Change the angle actually turned, e.g. to correct from odometry.
+        """
+        self.turn_angle = target_angle  # Requested, before the calibration fudge
+        # Calibration fudge: left turns overturn by TURN_FUDGE_LEFT degrees,
+        # right turns underturn by TURN_FUDGE_RIGHT
+        if target_angle < 0:
+            target_angle += constants.TURN_FUDGE_RIGHT
+        if target_angle > 0:
+            target_angle += constants.TURN_FUDGE_LEFT
+
+        # Calculate target encoder counts
+        arc_length = (abs(target_angle) / 360) * (math.pi * WHEEL_BASE)
+        self.target_counts = int((arc_length / WHEEL_CIRCUMFERENCE) * COUNTS_PER_ROTATION)
+
+        # Set turn direction
+        self.turning_left = target_angle > 0
+
+        if self.time_expected is not None:
+            self.retime(self.time_expected)
+
+    def retime(self, time_expected):
+        """
+        Bake the angle profile for a timed turn: a trapezoidal wheel speed that
+        ramps up over TURN_RAMP of the time, cruises and ramps down, sampled every
+        control period with one extra sample past the end. The feedforward is the
+        command that makes the left motor model in constants.py (a first-order
+        lag) follow the profile's speed, so it leads by the time constant; the
+        right wheel is scaled by the ratio of the two models.
+        Reuses the arrays when they are long enough.
+        """
+        self.time_expected = time_expected
+        self.period_us = control_loop.PERIOD_US
+        samples = int(time_expected * 1000000 / self.period_us) + 2
+        if len(self.profile) < samples:
+            self.profile = array("h", [0] * samples)
+            self.feedforward = array("h", [0] * samples)
+
+        left_gain, tau, left_deadband = constants.LEFT_MOTOR
+        right_gain = constants.RIGHT_MOTOR[0]
+        self.right_q10 = int(left_gain / right_gain * (1 << fastcore.RIGHT_SHIFT) + 0.5)
+        cm_per_count = WHEEL_CIRCUMFERENCE / COUNTS_PER_ROTATION
+
+        total = 2 * self.target_counts
+        ramp = TURN_RAMP * time_expected
+        peak = total / (time_expected - ramp)  # Counts of both wheels per second
+        for i in range(samples):
+            t = min(i * self.period_us / 1000000, time_expected)
+            if t < ramp:
+                done = peak * t * t / (2 * ramp)
+                rate = peak * t / ramp
+                accel = peak / ramp
+            elif t <= time_expected - ramp:
+                done = peak * (t - ramp / 2)
+                rate = peak
+                accel = 0
+            else:
+                left = time_expected - t
+                done = total - peak * left * left / (2 * ramp)
+                rate = peak * left / ramp
+                accel = -peak / ramp
+            self.profile[i] = int(done + 0.5)
+            wheel_cm_s = max(0, rate + tau * accel) / 2 * cm_per_count
+            self.feedforward[i] = int(wheel_cm_s / left_gain + (left_deadband if rate > 0 else 0) + 0.5)
+
+def turn(target_angle, time_expected=None):
     """
     Turn the robot in place using encoder counts.
     Positive angles turn left, negative angles turn right.
     
     :param target_angle: Angle to turn in degrees
+    :param time_expected: Seconds the turn should take, or None to turn as fast as possible
     """
-    # if turning left, overturn by 1 deg
-    if target_angle < 0:
-        target_angle += .25
-    if target_angle > 0:
-        target_angle += 1
+    return run_turn(TurnSegment(target_angle, time_expected))
+
+def run_turn(segment):
+    """
+    Execute a pre-computed TurnSegment. Returns the final count error.
+    """
+    target_counts = segment.target_counts
+    turning_left = segment.turning_left
+    motors = hw.motors()
+    encoders = hw.encoders()
+    yellow_led = hw.yellow_led()
 
-    
-    # Calculate target encoder counts
-    arc_length = (abs(target_angle) / 360) * (math.pi * WHEEL_BASE)
-    target_counts = int((arc_length / WHEEL_CIRCUMFERENCE) * COUNTS_PER_ROTATION)
-    
     # Get initial encoder values
     left_start, right_start = encoders.get_counts()
+    odometry.update(left_start, right_start)
+    # The robot is at rest after the pause: learn how far the last stop coasted
+    coast.observe(left_start, right_start)
     
-    
+    # Integers only inside the loop: counts are kept doubled instead of averaged
+    target_twice = 2 * target_counts
+    # Wheel speed estimate (counts per second) for stopping early by the coast distance
+    fastcore.velocity_reset(0, 0)
+    rate = 0
+    cut_left = left_start
+    cut_right = right_start
 
-    # Set turn direction
-    turning_left = target_angle > 0
-    
-    while True:
+    # A timed turn tracks its angle profile (counts of both wheels) until time_us
+    timed = segment.time_expected is not None
+    time_us = 0
+    if timed:
+        time_us = int(segment.time_expected * 1000000)
+        profile = segment.profile
+        feedforward = segment.feedforward
+        period_us = segment.period_us
+        right_q10 = segment.right_q10
+
+    telemetry.header(telemetry.KIND_TURN, int(segment.turn_angle * 100), time_us // 1000, 0,
+                     target_counts, 0, 0, -1)
+
+    def step(elapsed_us, dt_us):
+        """
+        One control iteration. Returns True once the turn is complete.
+        """
+        nonlocal rate, cut_left, cut_right
         # Get current encoder counts
         left_count, right_count = encoders.get_counts()
+        odometry.update(left_count, right_count)
         left_diff = abs(left_count - left_start)
         right_diff = abs(right_count - right_start)
+        rate = fastcore.velocity_update(left_diff, right_diff, dt_us)
+        cut_left = left_count
+        cut_right = right_count
         
-        # Use average of both wheels
-        avg_counts = (left_diff + right_diff) / 2
-        
-        # Calculate remaining counts
-        remaining_counts = target_counts - avg_counts
+        # Remaining counts, doubled: target minus the average of both wheels
+        remaining_twice = target_twice - (left_diff + right_diff)
         
-        # Check if turn is complete
-        if remaining_counts <= 1:
-            break
+        # Check if turn is complete: within a count, or close enough for the wheels
+        # to coast the rest of the way once the motors are cut
+        if remaining_twice <= max(2, 2 * coast.predict(coast.TURN, rate)):
+            return True
         
-        # Calculate speed based on remaining distance
-        if remaining_counts > target_counts * 0.5:
-            # First half: Full speed
-            turn_speed = MAX_TURN_SPEED
+        lag = 0
+        if timed:
+            # Feedforward from the profile plus a correction for how far behind it the
+            # wheels are; past the end, only the correction for what is left
+            if elapsed_us < time_us:
+                lag = fastcore.profile_speed(profile, elapsed_us, period_us) - (left_diff + right_diff)
+                turn_speed = fastcore.profile_speed(feedforward, elapsed_us, period_us)
+            else:
+                lag = remaining_twice
+                turn_speed = 0
+            # Brake (down to zero) when ahead of the profile; when behind, at least enough to move
+            turn_speed = max(TIMED_MIN_SPEED if lag > 0 else 0,
+                             min(turn_speed + TIMED_TURN_KP * lag, MAX_MOTOR_SPEED))
+            right_speed = (turn_speed * right_q10) >> fastcore.RIGHT_SHIFT
         else:
-            # Second half: Gradual slowdown
-            speed_factor = remaining_counts / (target_counts * 0.5)
-            turn_speed = MAX_TURN_SPEED * speed_factor
-            turn_speed = max(turn_speed, MIN_TURN_SPEED)
+            # Calculate speed based on remaining distance
+            if remaining_twice > target_counts:
+                # First half: Full speed
+                turn_speed = MAX_TURN_SPEED
+            else:
+                # Second half: Gradual slowdown
+                turn_speed = MAX_TURN_SPEED * remaining_twice // target_counts
+                turn_speed = max(turn_speed, MIN_TURN_SPEED)
+            right_speed = turn_speed
         
         # Set motor speeds based on direction
         if turning_left:
-            motors.set_speeds(-turn_speed, turn_speed)
+            motors.set_speeds(-turn_speed, right_speed)
+            telemetry.record(left_count, right_count, turn_speed, lag, -turn_speed, right_speed,
+                             -1, telemetry.KIND_TURN)
         else:
-            motors.set_speeds(turn_speed, -turn_speed)
+            motors.set_speeds(turn_speed, -right_speed)
+            telemetry.record(left_count, right_count, turn_speed, lag, turn_speed, -right_speed,
+                             -1, telemetry.KIND_TURN)
         
-        # Update display
-        display.fill(0)
-        display.text(f"Target: {target_counts}", 0, 0, 1)
-        display.text(f"Current: {int(avg_counts)}", 0, 10, 1)
-        display.text(f"Remain: {int(remaining_counts)}", 0, 20, 1)
-        display.text(f"Speed: {int(turn_speed)}", 0, 30, 1)
-        display.show()
+        # Post status for the display service; it redraws at a capped rate
+        if screen.due():
+            screen.post(0, f"Target: {target_counts}")
+            screen.post(1, f"Current: {(left_diff + right_diff) // 2}")
+            screen.post(2, f"Remain: {remaining_twice // 2}")
+            screen.post(3, f"Speed: {turn_speed}")
         
         yellow_led.value(1)
-        time.sleep(0.01)
+        return False
+
+    # Run the turn at a fixed period; the display is serviced in the slack time
+    start_us = time.ticks_us()
+    if control_loop.run(step, idle=screen.service, idle_us=screen.SHOW_US):
+        telemetry.mark_exit(telemetry.EXIT_DISTANCE)
     
     # Stop motors
     motors.off()
+    coast.cut(coast.TURN, rate, cut_left, cut_right)
     yellow_led.value(0)
+
+    # A timed turn that got there early waits out its time, so it always takes time_expected
+    if timed:
+        wait_us = time_us - time.ticks_diff(time.ticks_us(), start_us)
+        if wait_us > 0:
+            time.sleep_us(wait_us)
     
     # Calculate final error
     left_count, right_count = encoders.get_counts()
+    odometry.update(left_count, right_count)
     left_diff = abs(left_count - left_start)
     right_diff = abs(right_count - right_start)
     avg_counts = (left_diff + right_diff) / 2
     count_error = target_counts - avg_counts
     
     # Display final position
-    display.fill(0)
-    display.text("Turn complete", 0, 0, 1)
-    display.text(f"Target: {target_counts}", 0, 10, 1)
-    display.text(f"Final: {int(avg_counts)}", 0, 20, 1)
-    display.text(f"Error: {int(count_error)}", 0, 30, 1)
-    display.show()
+    if not screen.silent:
+        screen.clear()
+        screen.post(0, "Turn complete")
+        screen.post(1, f"Target: {target_counts}")
+        screen.post(2, f"Final: {int(avg_counts)}")
+        screen.post(3, f"Error: {int(count_error)}")
+        screen.service(force=True)
     
     return count_error
 
+class ArcSegment:
+    """
+    A turn made while driving forward along a circular arc, e.g. a rounded corner.
+    Both wheels keep moving at speed_cm_s (measured at the centre of the robot), so
+    there is no stop, spin and restart.
+    """
+    def __init__(self, target_angle, radius_cm, speed_cm_s):
+        self.kind = "arc"
+        self.angle = target_angle
+        self.radius_cm = radius_cm
+        self.label = None  # Optional (line1, line2) status text set by the planner
+        self.chain = False  # Set by the planner when the next segment follows without a pause
+
+        turn_radians = abs(target_angle) * math.pi / 180
+        self.length_cm = turn_radians * radius_cm  # Travelled by the centre of the robot
+
+        # Wheel speeds relative to the centre: inner wheel slower, outer faster
+        inner = (radius_cm - WHEEL_BASE / 2) / radius_cm
+        outer = (radius_cm + WHEEL_BASE / 2) / radius_cm
+        self.turning_left = target_angle > 0
+        if self.turning_left:
+            self.left_scale, self.right_scale = inner, outer
+        else:
+            self.left_scale, self.right_scale = outer, inner
+        # The same ratio in Q10 for the integer control loop
+        self.left_q10 = int(self.left_scale * 1024 + 0.5)
+        self.right_q10 = int(self.right_scale * 1024 + 0.5)
+
+        # The heading change shows up as a difference between the wheels' counts
+        self.target_diff = int((turn_radians * WHEEL_BASE / WHEEL_CIRCUMFERENCE) * COUNTS_PER_ROTATION)
+        self.retime(self.length_cm / speed_cm_s)
+
+    def retime(self, time_expected):
+        """
+        Drive the arc in time_expected at a constant speed. The moves either side
+        must be re-timed to hand over at the new v_entry/v_exit.
+        """
+        self.time_expected = time_expected
+        speed_cm_s = self.length_cm / time_expected
+        # Enter and leave at the same speed so neighbouring moves can hand over to it
+        self.v_entry = speed_cm_s
+        self.v_exit = speed_cm_s
+
+        # Centre speed: the motor feedforward for speed_cm_s, as in a move, and the
+        # rate of the mean wheel count that the loop tracks it with
+        left_gain, _, deadband = constants.LEFT_MOTOR
+        self.base_speed = int(speed_cm_s / left_gain + deadband + 0.5)
+        self.planned_rate = int(speed_cm_s * move.counts_per_cm() + 0.5)
+
+def run_arc(segment):
+    """
+    Execute an ArcSegment. Leaves the motors running if the segment is chained to
+    the next one. Returns the final count error of the heading difference.
+    """
+    target_diff = segment.target_diff
+    left_q10 = segment.left_q10
+    right_q10 = segment.right_q10
+    feedforward = segment.base_speed
+    planned_rate = segment.planned_rate
+    right_factor_q10 = int(move.right_wheel_factor * (1 << fastcore.RIGHT_SHIFT) + 0.5)
+    kx_q8 = int(move.track_kx * (1 << fastcore.GAIN_SHIFT) + 0.5)
+    kv_q8 = int(move.track_kv * (1 << fastcore.GAIN_SHIFT) + 0.5)
+    max_base = move.max_base_speed
+    turning_left = segment.turning_left
+    motors = hw.motors()
+    encoders = hw.encoders()
+
+    left_start, right_start = encoders.get_counts()
+    odometry.update(left_start, right_start)
+    coast.observe(left_start, right_start)
+    # Entered at the hand-over speed of the move before it
+    fastcore.velocity_reset(left_start, right_start, planned_rate, planned_rate)
+    diff = 0
+
+    telemetry.header(telemetry.KIND_ARC, int(segment.angle * 100), int(segment.time_expected * 1000),
+                     feedforward, target_diff, int(segment.radius_cm * 10), 0, -1)
+
+    def step(elapsed_us, dt_us):
+        """
+        One control iteration, integers only. Returns True once the heading change is reached.
+        """
+        nonlocal diff
+        left_count, right_count = encoders.get_counts()
+        odometry.update(left_count, right_count)
+        left = left_count - left_start
+        right = right_count - right_start
+
+        diff = right - left if turning_left else left - right
+        if diff >= target_diff:
+            return True
+
+        # The centre tracks the planned distance along the arc, like a move tracks its
+        # profile (elapsed in ms keeps the product a small integer)
+        rate = fastcore.velocity_update(left_count, right_count, dt_us)
+        lag = planned_rate * (elapsed_us // 1000) // 1000 - ((left + right) >> 1)
+        base_speed = fastcore.track_speed(feedforward, lag, planned_rate - rate, kx_q8, kv_q8, max_base)
+
+        # Zero when the wheels travel in the ratio of the arc
+        error_q10 = left * right_q10 - right * left_q10
+        correction = (ARC_KP * error_q10) >> 10
+        left_speed = (base_speed * left_q10 >> 10) - correction
+        right_speed = ((base_speed * right_q10 >> 10) * right_factor_q10 >> fastcore.RIGHT_SHIFT) + correction
+        motors.set_speeds(left_speed, right_speed)
+        telemetry.record(left_count, right_count, base_speed, correction,
+                         left_speed, right_speed, -1, telemetry.KIND_ARC)
+        return False
+
+    if control_loop.run(step, idle=screen.service, idle_us=screen.SHOW_US):
+        telemetry.mark_exit(telemetry.EXIT_DISTANCE)
+
+    # The next move starts fresh from the end of the arc
+    move.carry_counts = 0
+    if not segment.chain:
+        motors.set_speeds(0, 0)
+    return target_diff - diff
+
 # Test code
 # while True:
-#     if robot.ButtonA().is_pressed():
+#     if hw.button_a().is_pressed():
 #         time.sleep(0.2)
 #         error = turn(90)  # Turn left 90 degrees
 #         print(f"Error: {error}")
-#     if robot.ButtonB().is_pressed():
+#     if hw.button_b().is_pressed():
 #         time.sleep(0.2)
 #         error = turn(-90)  # Turn right 90 degrees
 #         print(f"Error: {error}")
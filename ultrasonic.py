@@ -0,0 +1,171 @@
+import time
+import machine
+import hw
+
+# Ultrasonic sensor pins
+TRIG_PIN = 27  # GP27
+ECHO_PIN = 28  # GP28
+
+PING_INTERVAL_MS = 60  # HC-SR04 needs ~60ms between pings to let echoes die out
+ECHO_TIMEOUT_US = 30000  # Echo pulses longer than this mean "no target"
+SOUND_CM_PER_US = 0.0343  # Speed of sound is ~343m/s or 0.0343cm/µs
+
+# Configure ultrasonic pins
+trigger = hw.pin(TRIG_PIN, machine.Pin.OUT)
+echo = hw.pin(ECHO_PIN, machine.Pin.IN)
+
+# State shared with the interrupt handlers. Only integers are stored here so the
+# hard IRQ never allocates; conversion to cm happens in read().
+_rise_us = 0
+_width_us = -1  # last echo pulse width, or -1/-2 like measure_distance()
+_reading_us = 0  # ticks_us when the last echo finished
+_pending = False  # a ping was sent and its echo has not finished yet
+_timer = None
+readings = 0  # Background readings finished (echoes and errors), to tell a new one from the last
+
+def measure_distance():
+    """
+    Measure distance using HC-SR04 ultrasonic sensor.
+    Returns distance in centimeters.
+    Blocks for up to ~60ms; use start()/read() inside control loops.
+    """
+    # Ensure trigger is low
+    trigger.value(0)
+    time.sleep_us(2)
+
+    # Send 10us pulse to trigger
+    trigger.value(1)
+    time.sleep_us(10)
+    trigger.value(0)
+
+    # Wait for echo to go high
+    timeout = 0
+    while echo.value() == 0:
+        timeout += 1
+        if timeout > 30000:  # Timeout after ~30ms
+            return -1  # Error - no echo received
+
+    # Measure the time the echo pin stays high
+    start = time.ticks_us()
+    timeout = 0
+
+    while echo.value() == 1:
+        timeout += 1
+        if timeout > 30000:  # Timeout after ~30ms
+            return -2  # Error - echo too long
+
+    end = time.ticks_us()
+
+    # Calculate distance: Time * speed of sound / 2 (roundtrip)
+    duration = time.ticks_diff(end, start)
+    distance = (duration * SOUND_CM_PER_US) / 2
+
+    return distance
+
+def _echo_irq(pin):
+    """
+    Timestamp both edges of the echo pulse.
+    """
+    global _rise_us, _width_us, _reading_us, _pending, readings
+    now = time.ticks_us()
+    if pin.value():
+        _rise_us = now
+        return
+    if not _pending:
+        return  # Falling edge without a rising edge we saw
+    width = time.ticks_diff(now, _rise_us)
+    _width_us = width if width < ECHO_TIMEOUT_US else -2
+    _reading_us = now
+    _pending = False
+    readings += 1
+
+def _ping(timer=None):
+    """
+    Send a 10us trigger pulse. Runs from the ping timer.
+    """
+    global _width_us, _reading_us, _pending, readings
+    if _pending:
+        # The previous ping never produced a complete echo
+        _width_us = -1
+        _reading_us = time.ticks_us()
+        readings += 1
+    _pending = True
+    trigger.value(1)
+    time.sleep_us(10)
+    trigger.value(0)
+
+def running():
+    """
+    True while background pinging is on.
+    """
+    return _timer is not None
+
+def start(interval_ms=PING_INTERVAL_MS):
+    """
+    Start pinging in the background every interval_ms.
+    Readings are collected by pin interrupts; call read() for the latest one.
+    """
+    global _timer, _width_us, _reading_us, _pending
+    if _timer is not None:
+        return
+    _width_us = -1
+    _pending = False
+    _reading_us = time.ticks_us()
+    trigger.value(0)
+    echo.irq(handler=_echo_irq, trigger=machine.Pin.IRQ_RISING | machine.Pin.IRQ_FALLING, hard=True)
+    _timer = machine.Timer(mode=machine.Timer.PERIODIC, period=interval_ms, callback=_ping)
+    _ping()
+
+def stop():
+    """
+    Stop background pinging and release the echo interrupt.
+    """
+    global _timer, _pending
+    if _timer is None:
+        return
+    _timer.deinit()
+    _timer = None
+    echo.irq(handler=None)
+    _pending = False
+
+def fresh_width(max_age_ms):
+    """
+    Return the latest echo width in microseconds, or -1 if it is older than
+    max_age_ms. Negative on error like read(). Integers only, for control loops
+    that compare against a width from cm_to_width().
+    """
+    if time.ticks_diff(time.ticks_us(), _reading_us) > max_age_ms * 1000:
+        return -1
+    return _width_us
+
+def cm_to_width(distance_cm):
+    """
+    Echo width in microseconds for a distance in cm.
+    """
+    return int(distance_cm * 2 / SOUND_CM_PER_US + 0.5)
+
+def width_to_cm(width_us):
+    """
+    Distance in cm for an echo width in microseconds.
+    """
+    return (width_us * SOUND_CM_PER_US) / 2
+
+def width_to_mm(width_us):
+    """
+    Integer distance in mm for an echo width; negative error codes pass through.
+    """
+    if width_us < 0:
+        return width_us
+    return width_us * 343 // 2000
+
+def read():
+    """
+    Return (distance_cm, age_ms) for the latest background reading.
+    distance_cm is -1 (no echo) or -2 (echo too long) on error, like measure_distance().
+    Never blocks.
+    """
+    width = _width_us
+    age_ms = time.ticks_diff(time.ticks_us(), _reading_us) // 1000
+    if width < 0:
+        return width, age_ms
+    return width_to_cm(width), age_ms